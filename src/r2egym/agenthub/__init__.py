@@ -50,3 +50,8 @@ IMPORTANT: YOU SHOULD NEVER ASK FOR HUMAN HELP.
 
 # timeout for bash commands
 CMD_TIMEOUT = 120  # seconds: 5 minutes
+
+# bounded capture of agent command output: bytes kept from the start / end of the output
+# (the rest is replaced by a marker with the total byte and line counts)
+OUTPUT_HEAD_BYTES = 256 * 1024
+OUTPUT_TAIL_BYTES = 256 * 1024
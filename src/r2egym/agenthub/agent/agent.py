@@ -1,7 +1,7 @@
 import os
 import re
-import copy
 import yaml
+import asyncio
 import json
 import time
 from pathlib import Path
@@ -14,9 +14,14 @@ from openai import OpenAI
 
 from r2egym.agenthub.action import Action
 from r2egym.agenthub.utils.log import get_logger
+from r2egym.agenthub.utils.concurrency import llm_slot
+from r2egym.agenthub.agent.history import MessageHistory, render_messages
+from r2egym.agenthub.agent.context import get_context_policy
+from r2egym.agenthub.agent.llm_cache import LLMCache, query_key
 from r2egym.agenthub.environment.env import RepoEnv
 from r2egym.agenthub.runtime.docker import DockerRuntime
 from r2egym.agenthub.trajectory import TrajectoryStep, Trajectory
+from r2egym.agenthub.trajectory.journal import TrajectoryJournal
 from anthropic import Anthropic, AnthropicVertex  # Add Anthropic Vertex import
 from r2egym.agenthub.tools import (
     r2egym_bash_execute_tool,
@@ -30,6 +35,10 @@ from r2egym.agenthub.tools import (
 import traceback
 logger = get_logger(__name__)  # Logger for this module
 MAX_CONTEXT_TOKENS = 65536
+# where dynamic hints (the step count) go: "suffix" appends them to the last message,
+# "append_only" sends them as new trailing messages, so that every request extends the
+# previous one (stable prefix for the prefix cache of e.g. self-hosted vLLM endpoints)
+PROMPT_LAYOUTS = ["suffix", "append_only"]
 
 ##############################################################################
 # AgentArgs Dataclass
@@ -58,7 +67,9 @@ class AgentArgs:
 class Agent:
     """Agent handles the behavior of the model and how it interacts with the environment."""
 
-    def __init__(self, name: str, args: AgentArgs, logger=None):
+    def __init__(
+        self, name: str, args: AgentArgs, logger=None, llm_cache: Optional[LLMCache] = None
+    ):
         self.name = name
         self.args = args
         # self.trajectory_steps: List[TrajectoryStep] = []
@@ -81,6 +92,12 @@ class Agent:
         self.logger.info(f"Initialized Agent: {name} with LLM: {args.llm_name}")
         self.max_retries = self.other_args.get("max_retries", 5)
         self.llm_timeout = self.other_args.get("timeout", 3000)
+        # condensation of the conversation (see ContextPolicy), None keeps all of it
+        self.context_policy = get_context_policy(self.other_args.get("context_policy"))
+        # record / replay of the LLM responses (see LLMCache)
+        self.llm_cache = llm_cache
+        self.prompt_layout = self.other_args.get("prompt_layout", "suffix")
+        assert self.prompt_layout in PROMPT_LAYOUTS, f"Invalid prompt layout: {self.prompt_layout}, must be one of {PROMPT_LAYOUTS}"
 
 
 
@@ -139,24 +156,29 @@ class Agent:
     def reset(self):
         """Reset the agent's trajectory."""
         self.trajectory_steps = []
-        self.history = []
+        self.history = MessageHistory(model=self.llm_name)
 
-    def _count_tokens(self, messages: List[Dict[str, str]]) -> int:
+    def _count_tokens(
+        self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None
+    ) -> int:
         """
-        Counts the tokens for a list of messages using the litellm library.
-        Adjust as needed depending on the model and library.
+        Counts the tokens for a list of messages (and tool schemas): read from the token
+        ledger of a MessageHistory, else counted with the litellm library.
         """
-        token_count = litellm.token_counter(model=self.llm_name, messages=messages)
+        if isinstance(messages, MessageHistory):
+            token_count = messages.tokens + messages.ledger.tools_tokens(tools)
+        else:
+            tools_kwargs = {"tools": tools} if tools else {}
+            token_count = litellm.token_counter(
+                model=self.llm_name, messages=messages, **tools_kwargs
+            )
         self.logger.info(f"Total tokens in conversation: {token_count}")
         return token_count
 
-    def model_query(
-        self, messages: List[Dict[str, str]], temperature: float = 0,) -> Dict[str, Any]:
-        """Query the LLM with the messages and measure execution time."""
-        response = None
-        retries = 0
+    def _query_tools(self) -> Tuple[Optional[List[Dict]], int]:
+        """Tools for the query and the number of prompt caching breakpoints on the messages."""
         tools = None
-
+        cache_breakpoints = 0
         if self.use_fn_calling:
             if self.scaffold == "r2egym":
                 tools = [search_tool, file_editor, r2egym_bash_execute_tool, finish_tool]
@@ -168,48 +190,82 @@ class Agent:
                 # litellm might need dev install with vertex: https://github.com/BerriAI/litellm/issues/6898
                 # add prompt caching for anthropic
                 tools[-1]["function"]["cache_control"] = {"type": "ephemeral"}
-                breakpoints_remaining = 3  # remaining 1 for system/tool (above)
-                for message in reversed(messages):
-                    if message["role"] in ("user", "tool"):
-                        if breakpoints_remaining > 0:
-                            message["cache_control"] = {"type": "ephemeral"}
-                            breakpoints_remaining -= 1
-                        else:
-                            break
-
-        # Start timer
-        start_time = time.time()
+                cache_breakpoints = 3  # remaining 1 for system/tool (above)
+                # moving breakpoints would change sent messages: self-hosted servers
+                # cache prefixes without them
+                local = "openai/" in self.llm_name or "hosted" in self.llm_name
+                if self.prompt_layout == "append_only" and local:
+                    cache_breakpoints = 0
+        return tools, cache_breakpoints
+
+    def _query_messages(
+        self,
+        messages: List[Dict[str, str]],
+        tools: Optional[List[Dict]] = None,
+        cache_breakpoints: int = 0,
+    ) -> List[Dict[str, str]]:
+        """Messages to send (rendered with their overlays), checked against the context limit."""
         # check if using locally hosted models
         using_local = "openai/" in self.llm_name or "hosted" in self.llm_name
         if using_local:
             litellm.api_key = None
 
-        messages_ = copy.deepcopy(messages)
-        total_tokens = self._count_tokens(messages_)
+        total_tokens = self._count_tokens(messages, tools)
         if total_tokens > MAX_CONTEXT_TOKENS:
             logger.warning(f"Total tokens: {total_tokens} > {MAX_CONTEXT_TOKENS}")
             raise ValueError(f"Total tokens: {total_tokens} > {MAX_CONTEXT_TOKENS}")
-        
+        if isinstance(messages, MessageHistory):
+            return messages.render(cache_breakpoints)
+        return render_messages(messages, cache_breakpoints)
+
+    def _completion_kwargs(
+        self, tools: Optional[List[Dict]], temperature: float
+    ) -> Dict[str, Any]:
+        kwargs = {
+            "tool_choice": "none",
+            "function_call": None,
+        }
+        if tools:
+            kwargs = {}
+        if "o3" not in self.llm_name and "o4" not in self.llm_name:
+            kwargs["temperature"] = temperature
+        return dict(
+            model=self.llm_name,
+            tools=tools,
+            timeout=self.llm_timeout,
+            api_base=self.llm_base_url,
+            # max_tokens=3000,
+            **kwargs,
+        )
+
+    def model_query(
+        self, messages: List[Dict[str, str]], temperature: float = 0,) -> Dict[str, Any]:
+        """Query the LLM with the messages and measure execution time."""
+        response = None
+        retries = 0
+        tools, cache_breakpoints = self._query_tools()
+
+        # Start timer
+        start_time = time.time()
+        messages_ = self._query_messages(messages, tools, cache_breakpoints)
+        # recorded response (see LLMCache)
+        if self.llm_cache is not None:
+            response = self.llm_cache.get(self.llm_name, messages_, tools, temperature)
+            if response is not None:
+                self.logger.info(
+                    f"Replaying recorded LLM response "
+                    f"{query_key(self.llm_name, messages_, tools, temperature)[:12]} "
+                    f"({len(messages_)} messages)"
+                )
+                return response, time.time() - start_time
+
         # query the model with retries
         while retries < self.max_retries:
             try:
-                kwargs = {
-                    "tool_choice": "none",
-                    "function_call": None,
-                }
-                if tools:
-                    kwargs = {}
-                if "o3" not in self.llm_name and "o4" not in self.llm_name:
-                    kwargs["temperature"] = temperature
-                response = litellm.completion(
-                    model=self.llm_name,
-                    tools=tools,
-                    messages=messages_,
-                    timeout=self.llm_timeout,
-                    api_base=self.llm_base_url,
-                    # max_tokens=3000,
-                    **kwargs,
-                )
+                with llm_slot():
+                    response = litellm.completion(
+                        messages=messages_, **self._completion_kwargs(tools, temperature)
+                    )
                 self.logger.warning(f"Querying LLM complete")
                 break
             except Exception as e:
@@ -220,6 +276,58 @@ class Agent:
                 if retries >= self.max_retries:
                     raise e
 
+        if self.llm_cache is not None and response is not None:
+            self.llm_cache.put(self.llm_name, messages_, tools, temperature, response)
+
+        # End timer, calculate total execution time, and include in response
+        exec_time = time.time() - start_time
+        return response, exec_time
+
+    async def amodel_query(
+        self, messages: List[Dict[str, str]], temperature: float = 0,) -> Dict[str, Any]:
+        """Coroutine counterpart of `model_query` (litellm.acompletion)."""
+        response = None
+        retries = 0
+        tools, cache_breakpoints = self._query_tools()
+
+        # Start timer
+        start_time = time.time()
+        messages_ = self._query_messages(messages, tools, cache_breakpoints)
+        # recorded response (see LLMCache)
+        if self.llm_cache is not None:
+            # file reads / flock waits, off the event loop
+            response = await asyncio.to_thread(
+                self.llm_cache.get, self.llm_name, messages_, tools, temperature
+            )
+            if response is not None:
+                self.logger.info(
+                    f"Replaying recorded LLM response "
+                    f"{query_key(self.llm_name, messages_, tools, temperature)[:12]} "
+                    f"({len(messages_)} messages)"
+                )
+                return response, time.time() - start_time
+
+        # query the model with retries
+        while retries < self.max_retries:
+            try:
+                response = await litellm.acompletion(
+                    messages=messages_, **self._completion_kwargs(tools, temperature)
+                )
+                self.logger.warning(f"Querying LLM complete")
+                break
+            except Exception as e:
+                self.logger.error(f"LLM query failed @ {retries}: {e}")
+                retries += 1
+                if "RateLimitError" in str(e):
+                    await asyncio.sleep(60)
+                if retries >= self.max_retries:
+                    raise e
+
+        if self.llm_cache is not None and response is not None:
+            await asyncio.to_thread(
+                self.llm_cache.put, self.llm_name, messages_, tools, temperature, response
+            )
+
         # End timer, calculate total execution time, and include in response
         exec_time = time.time() - start_time
         return response, exec_time
@@ -301,7 +409,7 @@ class Agent:
 
         return thought, action
 
-    def run(
+    def _run_loop(
         self,
         env: "RepoEnv",  # env: RepoEnv
         use_fn_calling: bool = True,
@@ -319,7 +427,17 @@ class Agent:
         # additional metadata e.g. for hints / additional inputs etc
         metadata: Optional[Dict[str, Any]] = {},
         scaffold: str = "r2egym",
+        journal: Optional[TrajectoryJournal] = None,
     ):
+        """
+        The agent loop shared by `run` and `arun`. Environment and LLM I/O is not done
+        here but yielded as (operation, args) requests ("reset", "llm", "step", "patch",
+        and "peek_patch" / "apply_patch" for the journal) to the driver, which sends back the result (or throws the exception in).
+        Returns the trajectory.
+
+        With a `journal`, every step is journaled as it is produced and a run found in
+        the journal is resumed from its last step (see TrajectoryJournal).
+        """
         assert scaffold in ["r2egym", "openhands", "sweagent"], "Scaffold must be either r2egym or openhands or sweagent"
         self.scaffold = scaffold
         # get the start time
@@ -341,8 +459,7 @@ class Agent:
         self.logger.info(f"Running agent {self.name} in environment {env}.")
 
         # Reset the environment and the agent
-        env.reset()
-        env.add_commands(self.command_files)
+        yield ("reset", ())
         self.reset()
 
         # Prepare problem_statement and structure from the environment
@@ -374,17 +491,54 @@ class Agent:
         self.logger.info(f"User Prompt with demo: {user_prompt}")
 
         # initialize the history
-        self.history = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
+        self.history = MessageHistory(
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            model=self.llm_name,
+        )
 
         # initialize the parameters
         obs = None
         done = False
         step_count = 0
         total_time_traj = 0
+        exit_reason = None
         self.trajectory_steps: List[TrajectoryStep] = []
+        # prompt / cached prompt tokens over the run (prefix cache hit rate)
+        total_prompt_tokens = 0
+        total_cached_tokens = 0
+
+        if journal is not None:
+            state = journal.load(self.history)
+            if state is None:
+                journal.start(self.history)
+            else:
+                self.logger.warning(
+                    f"Resuming from journal {journal.path} after step {state.step_count}"
+                )
+                self.history = MessageHistory(state.history, model=self.llm_name)
+                self.trajectory_steps = state.steps
+                step_count = state.step_count
+                total_time_traj = state.total_time_traj
+                done = state.done
+                exit_reason = state.exit_reason
+                total_prompt_tokens = sum(max(step.token_usage_prompt, 0) for step in state.steps)
+                total_cached_tokens = sum(step.token_usage_cached for step in state.steps)
+                # bring the environment back to the journaled state
+                if journal.resume == "replay":
+                    for step in state.steps:
+                        if step.done:
+                            continue
+                        try:
+                            yield ("step", (step.parsed_action, max_exec_time))
+                        except Exception as e:
+                            self.logger.error(f"Error replaying step {step.step_idx}: {e}")
+                elif state.patch:
+                    output, error_code = yield ("apply_patch", (state.patch,))
+                    if error_code != "0":
+                        self.logger.error(f"Error restoring the journaled patch: {output}")
 
         # agent loop
         while not done:
@@ -396,15 +550,18 @@ class Agent:
                 stepcount_message = f"Steps Remaining: {steps_remaining}"
             else:
                 stepcount_message = "You have reached the maximum number of steps. Please submit your answer NOW."
-            self.history[-1][
-                "content"
-            ] += f"\n{stepcount_message}"  # postpend stepcount message
+            if self.prompt_layout == "append_only":
+                # in a message of its own: the request only appends to the previous one
+                history_len = len(self.history)
+                self.history.append({"role": "user", "content": stepcount_message})
+            else:
+                self.history.add_suffix(f"\n{stepcount_message}")  # postpend stepcount message
+                history_len = len(self.history)
             self.logger.info(stepcount_message)
 
-            # Query the LLM
-            messages = copy.deepcopy(self.history)
+            # Query the LLM (the history is rendered, not copied, by the query)
             try:
-                response, llm_exec_time = self.model_query(messages, temperature)
+                response, llm_exec_time = yield ("llm", (self.history, temperature))
             except Exception as e:
                 self.logger.error(f"Error querying LLM: {e}")
                 self.logger.error(f"Error querying LLM: {traceback.format_exc()}")
@@ -421,14 +578,25 @@ class Agent:
 
                 prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
                 self.logger.warning(f"Prompt Token Details: {prompt_tokens_details}")
+                # prompt tokens served from the prefix cache (vLLM needs --enable-prompt-tokens-details)
+                if isinstance(prompt_tokens_details, dict):
+                    cached_tokens = prompt_tokens_details.get("cached_tokens") or 0
+                else:
+                    cached_tokens = getattr(prompt_tokens_details, "cached_tokens", None) or 0
+                total_prompt_tokens += max(prompt_tokens or 0, 0)
+                total_cached_tokens += cached_tokens
+                self.logger.info(
+                    f"Cached Prompt Tokens: {cached_tokens}, prefix cache hit rate: {total_cached_tokens / max(total_prompt_tokens, 1):.2%}"
+                )
                 self.logger.info(
                     f"Prompt Tokens: {prompt_tokens}\nCompletion Tokens: {completion_tokens}\nTotal Tokens: {total_tokens}"
                 )
             else:
                 completion_tokens = -1
                 prompt_tokens = -1
+                cached_tokens = 0
                 total_tokens = -1
-                total_tokens =  self._count_tokens(messages)
+                total_tokens = self._count_tokens(self.history)
                 self.logger.warning(
                     "No token usage information available in the response."
                 )
@@ -449,7 +617,7 @@ class Agent:
 
             # Send the action to the environment
             try:
-                obs, reward, done, info = env.step(action, timeout=max_exec_time)
+                obs, reward, done, info = yield ("step", (action, max_exec_time))
                 # env.runtime.commit_after_step(step_count)
             except Exception as e:
                 obs = str(e)
@@ -500,6 +668,16 @@ class Agent:
             self.logger.info(f"OBSERVATION:\n{obs}\n")
             self.logger.info("-" * 50)
 
+            # condense old messages of the conversation if it grows too large
+            if self.context_policy is not None:
+                condensed = self.context_policy.apply(
+                    self.history, min(max_token_limit, MAX_CONTEXT_TOKENS)
+                )
+                if condensed:
+                    self.logger.warning(
+                        f"Condensed {condensed} messages, tokens in conversation: {self.history.tokens}"
+                    )
+
             # Check if the agent has reached limits or done
             # check if agent has finished naturally i.e. the agent uses the finish tool
             if done:
@@ -518,10 +696,10 @@ class Agent:
                         f"Agent has finished after continuing past the max steps: {max_steps}. current step count: {step_count}."
                     )
                     exit_reason = "agent_max_step_limit"
-            # check for token limit
-            elif total_tokens >= max_token_limit:
+            # check for token limit (on the conversation the next query would send)
+            elif self.history.tokens >= max_token_limit:
                 self.logger.info(
-                    f"Agent reached max tokens: {max_token_limit}. Current token count: {total_tokens}. Exiting."
+                    f"Agent reached max tokens: {max_token_limit}. Current token count: {self.history.tokens}. Exiting."
                 )
                 exit_reason = "token_limit"
                 done = True
@@ -551,6 +729,7 @@ class Agent:
                 token_usage_prompt=prompt_tokens,
                 token_usage_completion=completion_tokens,
                 token_usage_total=total_tokens,
+                token_usage_cached=cached_tokens,
                 # metadata (current step stats)
                 llm_exec_time=llm_exec_time,
                 env_exec_time=env_exec_time,
@@ -559,6 +738,15 @@ class Agent:
                 step_count=step_count,
             )
             self.trajectory_steps.append(trajectory_step)
+            if journal is not None:
+                patch = (yield ("peek_patch", ())) if journal.record_patch else None
+                journal.append_step(
+                    trajectory_step,
+                    stepcount_message if self.prompt_layout == "suffix" else None,
+                    self.history[history_len:],
+                    patch=patch,
+                    exit_reason=exit_reason if done else None,
+                )
 
         # get the output patch
         # output_patch, _ = env.runtime.run(f"git diff {initial_commit} HEAD")
@@ -566,7 +754,7 @@ class Agent:
         # env.runtime.soft_git_reset()
 
         # compute output patch cummulatively from the start using git diff from the initial commit
-        output_patch = env.runtime.get_patch()
+        output_patch = yield ("patch", ())
 
         # Create a Trajectory object
         self.trajectory = Trajectory(
@@ -589,3 +777,121 @@ class Agent:
 
         self.logger.info(f"Agent completed in {time.time() - start_time} seconds.")
         return self.trajectory
+
+    def run(
+        self,
+        env: "RepoEnv",  # env: RepoEnv
+        use_fn_calling: bool = True,
+        # step limits TODO: maybe add these limits in the agent args
+        max_steps: int = 10,
+        max_steps_absolute: int = 50,
+        # token limits
+        max_token_limit: int = 65536,  # 64k tokens
+        # time limits
+        max_exec_time: int = 90,  # 5 mins per env execution
+        max_total_time: int = 50000,  # 20 minutes overall agent run limit
+        max_llm_time: int = 7200,  # 2 mins per LLM timeout (note this is per query exlcuding retries | not enforcing hard limit since llm might hit rate limits etc)
+        # temperature
+        temperature=0,
+        # additional metadata e.g. for hints / additional inputs etc
+        metadata: Optional[Dict[str, Any]] = {},
+        scaffold: str = "r2egym",
+        journal: Optional[TrajectoryJournal] = None,
+    ):
+        loop = self._run_loop(
+            env,
+            use_fn_calling=use_fn_calling,
+            max_steps=max_steps,
+            max_steps_absolute=max_steps_absolute,
+            max_token_limit=max_token_limit,
+            max_exec_time=max_exec_time,
+            max_total_time=max_total_time,
+            max_llm_time=max_llm_time,
+            temperature=temperature,
+            metadata=metadata,
+            scaffold=scaffold,
+            journal=journal,
+        )
+        result, error = None, None
+        while True:
+            try:
+                op, args = loop.throw(error) if error else loop.send(result)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = None, None
+                if op == "reset":
+                    env.reset()
+                    env.add_commands(self.command_files)
+                elif op == "llm":
+                    result = self.model_query(*args)
+                elif op == "step":
+                    action, timeout = args
+                    result = env.step(action, timeout=timeout)
+                elif op == "patch":
+                    result = env.runtime.get_patch()
+                elif op == "peek_patch":
+                    result = env.runtime.peek_patch()
+                elif op == "apply_patch":
+                    result = env.runtime.apply_patch(*args)
+            except Exception as e:
+                error = e
+
+    async def arun(
+        self,
+        env: "AsyncRepoEnv",  # env: AsyncRepoEnv
+        use_fn_calling: bool = True,
+        max_steps: int = 10,
+        max_steps_absolute: int = 50,
+        max_token_limit: int = 65536,
+        max_exec_time: int = 90,
+        max_total_time: int = 50000,
+        max_llm_time: int = 7200,
+        temperature=0,
+        metadata: Optional[Dict[str, Any]] = {},
+        scaffold: str = "r2egym",
+        journal: Optional[TrajectoryJournal] = None,
+    ):
+        """
+        Coroutine counterpart of `run` on an AsyncRepoEnv: LLM queries and environment
+        commands are awaited, so one event loop can drive many agents concurrently.
+        (Use one Agent instance per concurrent rollout.)
+        """
+        loop = self._run_loop(
+            env,
+            use_fn_calling=use_fn_calling,
+            max_steps=max_steps,
+            max_steps_absolute=max_steps_absolute,
+            max_token_limit=max_token_limit,
+            max_exec_time=max_exec_time,
+            max_total_time=max_total_time,
+            max_llm_time=max_llm_time,
+            temperature=temperature,
+            metadata=metadata,
+            scaffold=scaffold,
+            journal=journal,
+        )
+        result, error = None, None
+        while True:
+            try:
+                op, args = loop.throw(error) if error else loop.send(result)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = None, None
+                if op == "reset":
+                    await env.areset()
+                    await env.aadd_commands(self.command_files)
+                elif op == "llm":
+                    result = await self.amodel_query(*args)
+                elif op == "step":
+                    action, timeout = args
+                    result = await env.astep(action, timeout=timeout)
+                elif op == "patch":
+                    result = await env.runtime.aget_patch()
+                elif op == "peek_patch":
+                    result = await env.runtime.apeek_patch()
+                elif op == "apply_patch":
+                    result = await env.runtime.aapply_patch(*args)
+            except Exception as e:
+                error = e
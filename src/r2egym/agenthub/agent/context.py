@@ -0,0 +1,195 @@
+import os
+import json
+from typing import Any, Dict, List, Optional, Union
+
+from r2egym.agenthub.action import Action
+from r2egym.agenthub.agent.history import MessageHistory
+
+# tools whose `view` output is superseded by a later view / edit of the same path
+FILE_EDITOR_TOOLS = ["file_editor", "str_replace_editor"]
+# classes of the messages after the prefix (system prompt and task), which is never condensed
+MESSAGE_CLASSES = ["assistant", "observation"]
+
+
+def condense_text(text: str, keep_lines: int = 5, max_chars: int = 2000) -> str:
+    """The first / last `keep_lines` lines of a text (and at most ~`max_chars` characters)."""
+    lines = text.splitlines()
+    if len(lines) > 2 * keep_lines + 1:
+        text = "\n".join(
+            lines[:keep_lines]
+            + [f"[... {len(lines) - 2 * keep_lines} lines condensed ...]"]
+            + lines[-keep_lines:]
+        )
+    if len(text) > max_chars:
+        half = max_chars // 2
+        text = f"{text[:half]}\n[... {len(text) - 2 * half} characters condensed ...]\n{text[-half:]}"
+    return text
+
+
+def message_action(message: Dict[str, Any]) -> Action:
+    """The action of an assistant message (function calling or XML)."""
+    tool_calls = message.get("tool_calls")
+    if tool_calls:
+        function = tool_calls[0].get("function") or {}
+        try:
+            parameters = json.loads(function.get("arguments") or "{}")
+        except ValueError:
+            parameters = {}
+        return Action(function.get("name") or "", parameters)
+    return Action.from_string(message.get("content") or "")
+
+
+##############################################################################
+# Context policy
+##############################################################################
+class ContextPolicy:
+    """
+    Keeps the conversation sent to the LLM within a token budget, so that long
+    trajectories keep going (instead of failing the query over the context limit) and
+    steps get cheaper. Old messages are condensed as overlays of the history
+    (`MessageHistory.condense`): the records, the journal and the trajectory are untouched.
+
+    Condensation is watermark based. Below `high_watermark` (a fraction of the context
+    limit) nothing changes, so the prompt only grows and its prefix stays cached. Once
+    above, one pass brings the conversation under `low_watermark`, in this order:
+        1. stale views: file editor `view` outputs of a path viewed / edited again
+           later are replaced by a stub,
+        2. budgets: while a message class ("assistant", "observation") takes more than
+           its budget (a fraction of the context limit), its oldest messages are condensed,
+        3. the oldest observations are condensed.
+    The prefix (system prompt and task) and the last `keep_recent` steps are never
+    condensed. A condensed message keeps its first / last `keep_lines` lines (see
+    `condense_text`); the action of an assistant message is kept.
+    """
+
+    def __init__(
+        self,
+        high_watermark: float = 0.8,
+        low_watermark: float = 0.5,
+        budgets: Optional[Dict[str, float]] = None,
+        keep_recent: int = 3,
+        keep_lines: int = 5,
+        max_chars: int = 2000,
+        prefix_len: int = 2,
+    ):
+        assert 0 < low_watermark <= high_watermark <= 1, "Invalid watermarks"
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.budgets = {"observation": 0.4, "assistant": 0.2} if budgets is None else budgets
+        for cls in self.budgets:
+            assert cls in MESSAGE_CLASSES, f"Invalid message class: {cls}, must be one of {MESSAGE_CLASSES}"
+        self.keep_recent = keep_recent
+        self.keep_lines = keep_lines
+        self.max_chars = max_chars
+        self.prefix_len = prefix_len
+
+    @staticmethod
+    def message_class(message: Dict[str, Any]) -> str:
+        return "assistant" if message["role"] == "assistant" else "observation"
+
+    def _condensable(self, history: MessageHistory) -> List[int]:
+        """Indices of the messages that can be condensed, oldest first."""
+        # the last `keep_recent` steps start at their assistant messages
+        assistants = [
+            idx for idx in range(self.prefix_len, len(history)) if history[idx]["role"] == "assistant"
+        ]
+        if not self.keep_recent:
+            end = len(history)
+        elif len(assistants) < self.keep_recent:
+            end = self.prefix_len
+        else:
+            end = assistants[-self.keep_recent]
+        return [idx for idx in range(self.prefix_len, end) if not history.is_condensed(idx)]
+
+    def _condense(self, history: MessageHistory, idx: int) -> None:
+        content = history[idx].get("content") or ""
+        if history[idx]["role"] == "assistant":
+            # keep the action (XML function call) of non fn calling messages
+            split = content.find("<function=")
+            thought, action = (content, "") if split < 0 else (content[:split], content[split:])
+            history.condense(idx, condense_text(thought, self.keep_lines, self.max_chars) + action)
+        else:
+            history.condense(idx, condense_text(content, self.keep_lines, self.max_chars))
+
+    def _stale_views(self, history: MessageHistory, indices: List[int]) -> List[int]:
+        """Observations of file editor views superseded by a later view / edit of the path."""
+        stale = []
+        condensable = set(indices)
+        seen = set()
+        for idx in range(len(history) - 1, self.prefix_len, -1):
+            if history[idx]["role"] == "assistant" or history[idx - 1]["role"] != "assistant":
+                continue
+            action = message_action(history[idx - 1])
+            path = action.parameters.get("path")
+            if action.function_name not in FILE_EDITOR_TOOLS or not path:
+                continue
+            path = os.path.normpath(os.path.join("/testbed", path))
+            if action.parameters.get("command") == "view" and path in seen and idx in condensable:
+                stale.append(idx)
+            seen.add(path)
+        return stale
+
+    def apply(self, history: MessageHistory, limit: int) -> int:
+        """
+        Condense the history if it is over the high watermark of `limit` tokens.
+        Returns the number of messages condensed.
+        """
+        if history.tokens < self.high_watermark * limit:
+            return 0
+        target = self.low_watermark * limit
+        indices = self._condensable(history)
+        condensed = 0
+
+        for idx in self._stale_views(history, indices):
+            action = message_action(history[idx - 1])
+            history.condense(
+                idx,
+                f"[Output of `{action.function_name} view {action.parameters['path']}` "
+                "removed: the file was viewed or edited again later]",
+            )
+            condensed += 1
+        indices = [idx for idx in indices if not history.is_condensed(idx)]
+
+        counts = history.ledger.counts
+        for cls, budget in self.budgets.items():
+            members = [idx for idx in indices if self.message_class(history[idx]) == cls]
+            total = sum(counts[idx] for idx in range(self.prefix_len, len(history))
+                        if self.message_class(history[idx]) == cls)
+            for idx in members:
+                if total <= budget * limit:
+                    break
+                before = counts[idx]
+                self._condense(history, idx)
+                total -= before - counts[idx]
+                condensed += 1
+        indices = [idx for idx in indices if not history.is_condensed(idx)]
+
+        for idx in indices:
+            if history.tokens <= target:
+                break
+            if self.message_class(history[idx]) == "observation":
+                self._condense(history, idx)
+                condensed += 1
+        return condensed
+
+
+CONTEXT_POLICIES = {"condense": ContextPolicy}
+
+
+def get_context_policy(
+    spec: Union[None, str, Dict[str, Any], ContextPolicy]
+) -> Optional[ContextPolicy]:
+    """
+    Context policy from its spec (e.g. the `context_policy` of the agent's `other_args`):
+    a name of CONTEXT_POLICIES, or a dict with the name and its arguments, e.g.
+        {"name": "condense", "high_watermark": 0.8, "budgets": {"observation": 0.4}}
+    None keeps the whole conversation.
+    """
+    if spec is None or isinstance(spec, ContextPolicy):
+        return spec
+    if isinstance(spec, str):
+        spec = {"name": spec}
+    kwargs = dict(spec)
+    name = kwargs.pop("name", "condense")
+    assert name in CONTEXT_POLICIES, f"Invalid context policy: {name}, must be one of {list(CONTEXT_POLICIES)}"
+    return CONTEXT_POLICIES[name](**kwargs)
@@ -0,0 +1,244 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+import litellm
+
+# probe message used to measure the fixed overhead of a token count
+_PROBE = {"role": "user", "content": "hi"}
+
+
+##############################################################################
+# Token ledger
+##############################################################################
+class TokenLedger:
+    """
+    Incremental token count of a conversation. Each message is tokenized once, when it
+    is added, and the total is kept up to date in O(1), instead of running
+    `litellm.token_counter` over the whole conversation for every query.
+
+    `token_counter` adds a fixed per-request overhead (reply priming) to the sum of the
+    per-message counts. It is measured once per model, excluded from the per-message
+    counts and added back once, so that `total` matches
+    `token_counter(model, messages)`. Tool schemas are counted once per distinct set.
+    """
+
+    # model -> fixed per-request overhead of token_counter
+    _overheads: Dict[str, int] = {}
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model or ""
+        self.counts: List[int] = []
+        self._sum = 0
+        # serialized tool schemas -> tokens
+        self._tool_counts: Dict[str, int] = {}
+
+    def _overhead(self) -> int:
+        if self.model not in self._overheads:
+            one = litellm.token_counter(model=self.model, messages=[_PROBE])
+            two = litellm.token_counter(model=self.model, messages=[_PROBE, _PROBE])
+            self._overheads[self.model] = max(0, 2 * one - two)
+        return self._overheads[self.model]
+
+    def count(self, message: Dict[str, Any]) -> int:
+        """Tokens of one message (without the per-request overhead)."""
+        return litellm.token_counter(model=self.model, messages=[message]) - self._overhead()
+
+    def append(self, message: Dict[str, Any]) -> None:
+        tokens = self.count(message)
+        self.counts.append(tokens)
+        self._sum += tokens
+
+    def copy(self) -> "TokenLedger":
+        ledger = TokenLedger(self.model)
+        ledger.counts = list(self.counts)
+        ledger._sum = self._sum
+        ledger._tool_counts = dict(self._tool_counts)
+        return ledger
+
+    def recount(self, index: int, message: Dict[str, Any]) -> None:
+        """Recount a message whose rendering changed."""
+        tokens = self.count(message)
+        self._sum += tokens - self.counts[index]
+        self.counts[index] = tokens
+
+    def add_text(self, index: int, text: str) -> None:
+        """Account for `text` appended to the content of a message."""
+        tokens = litellm.token_counter(model=self.model, text=text)
+        self.counts[index] += tokens
+        self._sum += tokens
+
+    def tools_tokens(self, tools: Optional[List[Dict[str, Any]]]) -> int:
+        if not tools:
+            return 0
+        key = json.dumps(tools, sort_keys=True, default=str)
+        if key not in self._tool_counts:
+            try:
+                self._tool_counts[key] = litellm.token_counter(
+                    model=self.model, messages=[_PROBE], tools=tools
+                ) - litellm.token_counter(model=self.model, messages=[_PROBE])
+            except TypeError:
+                # token_counter without tool support: count the serialized schemas
+                self._tool_counts[key] = litellm.token_counter(model=self.model, text=key)
+        return self._tool_counts[key]
+
+    @property
+    def total(self) -> int:
+        """Tokens of the whole conversation."""
+        return self._sum + self._overhead() if self.counts else 0
+
+
+##############################################################################
+# Message history
+##############################################################################
+class Message(dict):
+    """
+    Immutable message record: a dict (JSON serializable, journaled as is) whose keys
+    cannot be changed. Nested values (e.g. tool calls) are shared, never mutated.
+    """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Message records are immutable")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce_ex__(self, protocol):
+        return Message, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def render_messages(
+    messages: Iterable[Dict[str, Any]], cache_breakpoints: int = 0
+) -> List[Dict[str, Any]]:
+    """
+    Messages of a request: shallow copies (the provider layer may edit the top-level
+    keys of what it is sent), with prompt caching breakpoints on the last
+    `cache_breakpoints` user / tool messages.
+    """
+    rendered = [dict(message) for message in messages]
+    for message in reversed(rendered):
+        if cache_breakpoints <= 0:
+            break
+        if message["role"] in ("user", "tool"):
+            message["cache_control"] = {"type": "ephemeral"}
+            cache_breakpoints -= 1
+    return rendered
+
+
+class MessageHistory(list):
+    """
+    The agent's conversation: an append-only list of immutable message records, with a
+    TokenLedger kept in step with it.
+
+    Decorations are overlays rather than edits of the records: the step count suffix
+    appended to a message (`add_suffix`) and condensed contents (`condense`, see
+    ContextPolicy) live in a rendered view of the history, and per-request ones
+    (prompt caching breakpoints) are applied by `render`. The agent loop thus never
+    copies the history. Iterating / slicing it gives the records as they were appended
+    (e.g. for the journal), `render` gives what is sent.
+
+    Usage:
+        history = MessageHistory([system_message, user_message], model=llm_name)
+        history.add_suffix(stepcount_message)
+        history.tokens  # O(1)
+        messages = history.render(cache_breakpoints=3)
+        history.append(assistant_message)
+    """
+
+    def __init__(self, messages: Iterable[Dict[str, Any]] = (), model: Optional[str] = None):
+        super().__init__()
+        self.ledger = TokenLedger(model)
+        # records with their overlays, as sent
+        self._view: List[Message] = []
+        # index -> suffix appended to the content of the record
+        self._suffixes: Dict[int, str] = {}
+        # index -> content replacing the one of the record
+        self._condensed: Dict[int, str] = {}
+        self.extend(messages)
+
+    def append(self, message: Dict[str, Any]) -> None:
+        record = message if isinstance(message, Message) else Message(message)
+        super().append(record)
+        self._view.append(record)
+        self.ledger.append(record)
+
+    def extend(self, messages: Iterable[Dict[str, Any]]) -> None:
+        for message in messages:
+            self.append(message)
+
+    def _render_record(self, index: int) -> None:
+        record = self[index]
+        content = self._condensed.get(index, record.get("content") or "")
+        self._view[index] = Message({**record, "content": content + self._suffixes.get(index, "")})
+
+    def add_suffix(self, text: str, index: int = -1) -> None:
+        """Append `text` to the content of a message (the last one by default) as sent."""
+        index = range(len(self))[index]
+        self._suffixes[index] = self._suffixes.get(index, "") + text
+        self._render_record(index)
+        self.ledger.add_text(index, text)
+
+    def condense(self, index: int, content: str) -> None:
+        """Send `content` instead of the content of a message (its suffix is kept)."""
+        index = range(len(self))[index]
+        self._condensed[index] = content
+        self._render_record(index)
+        self.ledger.recount(index, self._view[index])
+
+    def is_condensed(self, index: int) -> bool:
+        return range(len(self))[index] in self._condensed
+
+    def rendered(self, index: int) -> Message:
+        """A message as sent (with its suffix, condensed)."""
+        return self._view[index]
+
+    def render(self, cache_breakpoints: int = 0) -> List[Dict[str, Any]]:
+        """The messages of a request (see `render_messages`)."""
+        return render_messages(self._view, cache_breakpoints)
+
+    def __copy__(self):
+        # records are immutable and shared, the view and the ledger are the copy's own
+        return _rebuild_history(
+            list(self), self._view, self._suffixes, self._condensed, self.ledger.copy()
+        )
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def __reduce_ex__(self, protocol):
+        # pickles carry the ledger instead of re-counting every message
+        return _rebuild_history, (
+            list(self), self._view, self._suffixes, self._condensed, self.ledger
+        )
+
+    def _not_append_only(self, *args, **kwargs):
+        raise TypeError("MessageHistory is append-only")
+
+    insert = pop = remove = clear = sort = reverse = _not_append_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _not_append_only
+
+    @property
+    def tokens(self) -> int:
+        """Tokens of the conversation as sent (without tool schemas)."""
+        return self.ledger.total
+
+
+def _rebuild_history(
+    records: List[Message],
+    view: List[Message],
+    suffixes: Dict[int, str],
+    condensed: Dict[int, str],
+    ledger: TokenLedger,
+) -> MessageHistory:
+    history = MessageHistory.__new__(MessageHistory)
+    list.extend(history, records)
+    history._view = list(view)
+    history._suffixes = dict(suffixes)
+    history._condensed = dict(condensed)
+    history.ledger = ledger
+    return history
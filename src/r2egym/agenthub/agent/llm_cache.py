@@ -0,0 +1,220 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+
+import litellm
+
+from r2egym.agenthub.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+#   "record": always query the LLM and record the responses
+#   "replay": only serve recorded responses (a missing one is an error), no network
+#   "record_missing": serve recorded responses, query (and record) the missing ones
+LLM_CACHE_MODES = ["record", "replay", "record_missing"]
+
+
+class LLMCacheMiss(KeyError):
+    """No recorded response for a query in replay mode."""
+
+
+def _append_line(f, line: bytes) -> int:
+    """Append a line to a file opened "ab+" (on a new line after a torn one), returns its offset."""
+    end = f.seek(0, os.SEEK_END)
+    if end:
+        f.seek(end - 1)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+            end += 1
+    f.write(line)
+    f.flush()
+    return end
+
+
+def _canonical(value: Any) -> Any:
+    # provider hints (prompt caching) and unset fields do not change the response
+    if isinstance(value, dict):
+        return {
+            key: _canonical(item)
+            for key, item in value.items()
+            if key != "cache_control" and item is not None
+        }
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def query_key(
+    model: str,
+    messages: List[Dict[str, Any]],
+    tools: Optional[List[Dict[str, Any]]] = None,
+    temperature: float = 0,
+) -> str:
+    """sha256 of the canonicalized (model, messages, tools, temperature) of a query."""
+    query = _canonical(
+        {"model": model, "messages": messages, "tools": tools or [], "temperature": float(temperature)}
+    )
+    text = json.dumps(query, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+##############################################################################
+# LLM response cache
+##############################################################################
+class LLMCache:
+    """
+    Record / replay cache of LLM responses, keyed on the canonicalized
+    (model, messages, tools, temperature) of the query (see `query_key`), so that an
+    experiment can be re-run (e.g. against a changed runtime) without inference.
+
+    Responses are appended to `responses.jsonl` in `cache_dir`, with a sidecar index
+    (`responses.jsonl.index`, one `key offset length` line per response) read once and
+    then followed incrementally; the file is shared by processes (appends hold an
+    exclusive flock) and by threads (e.g. `asyncio.to_thread` in async agents). Lines without an index entry (a writer died in between) are
+    indexed on open.
+
+    A query made several times in a run (e.g. restarts at the same temperature) is
+    recorded once per occurrence, and the n-th occurrence replays the n-th recorded
+    response (the last one past the recorded count in "replay" mode).
+
+    Usage:
+        cache = LLMCache("llm_cache/", mode="record_missing")
+        response = cache.get(model, messages, tools, temperature)  # None on a miss
+        if response is None:
+            response = litellm.completion(...)
+            cache.put(model, messages, tools, temperature, response)
+    """
+
+    def __init__(self, cache_dir: str, mode: str = "record_missing"):
+        assert mode in LLM_CACHE_MODES, f"Invalid LLM cache mode: {mode}, must be one of {LLM_CACHE_MODES}"
+        self.mode = mode
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.jsonl")
+        self.index_path = f"{self.path}.index"
+        # key -> [(offset, length)] in recording order
+        self._entries: Dict[str, List[tuple]] = {}
+        # key -> occurrences served / recorded in this process
+        self._seen: Dict[str, int] = {}
+        self._index_pos = 0
+        # end of the last indexed response
+        self._end = 0
+        # the index state is shared by the threads of the process
+        self._lock = threading.Lock()
+        with self._locked() as f:
+            self._read_index()
+            self._index_tail(f)
+
+    def _locked(self):
+        f = open(self.path, "ab+")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
+
+    def _read_index(self) -> None:
+        """Read the index entries appended since the last read."""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._index_pos += len(line)
+                try:
+                    key, offset, length = line.split()
+                    offset, length = int(offset), int(length)
+                except ValueError:
+                    continue
+                self._entries.setdefault(key.decode(), []).append((offset, length))
+                self._end = max(self._end, offset + length)
+
+    def _index(self, entries: List[tuple]) -> None:
+        """Append (key, offset, length) entries to the index (needs the lock)."""
+        with open(self.index_path, "ab+") as index:
+            for key, offset, length in entries:
+                _append_line(index, f"{key} {offset} {length}\n".encode())
+        self._read_index()
+
+    def _index_tail(self, f) -> None:
+        """Index the complete lines past the indexed ones (needs the lock)."""
+        f.seek(self._end)
+        offset = self._end
+        entries = []
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append((json.loads(line)["key"], offset, len(line)))
+            except (ValueError, KeyError):
+                pass
+            offset += len(line)
+        if entries:
+            logger.warning(f"Indexing {len(entries)} unindexed responses of {self.path}")
+            self._index(entries)
+
+    def _load(self, offset: int, length: int) -> Dict[str, Any]:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def get(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]] = None,
+        temperature: float = 0,
+    ) -> Optional[Any]:
+        """
+        Recorded response of the query (a litellm ModelResponse), None if it is to be
+        queried. Raises LLMCacheMiss in "replay" mode when nothing was recorded.
+        """
+        if self.mode == "record":
+            return None
+        key = query_key(model, messages, tools, temperature)
+        with self._lock:
+            occurrence = self._seen.get(key, 0)
+            if len(self._entries.get(key, [])) <= occurrence:
+                # recorded by another process since
+                self._read_index()
+            entries = self._entries.get(key, [])
+            if len(entries) <= occurrence and (self.mode != "replay" or not entries):
+                if self.mode == "replay":
+                    raise LLMCacheMiss(f"No recorded response for query {key} of {model}")
+                return None
+            self._seen[key] = occurrence + 1
+            entry = entries[min(occurrence, len(entries) - 1)]
+        record = self._load(*entry)
+        return litellm.ModelResponse(**record["response"])
+
+    def put(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]],
+        temperature: float,
+        response: Any,
+    ) -> None:
+        """Record the response of a query."""
+        key = query_key(model, messages, tools, temperature)
+        data = response.model_dump() if hasattr(response, "model_dump") else dict(response)
+        line = (json.dumps({"key": key, "model": model, "response": data}, default=str) + "\n").encode("utf-8")
+        with self._lock, self._locked() as f:
+            self._read_index()
+            self._index_tail(f)
+            offset = _append_line(f, line)
+            self._index([(key, offset, len(line))])
+            self._seen[key] = self._seen.get(key, 0) + 1
+
+
+# (cache_dir, mode) -> LLMCache of this process
+_llm_caches: Dict[tuple, LLMCache] = {}
+
+
+def get_llm_cache(cache_dir: str, mode: str = "record_missing") -> LLMCache:
+    """LLMCache of `cache_dir`, opened (and its index read) once per process."""
+    key = (os.path.abspath(cache_dir), mode)
+    if key not in _llm_caches:
+        _llm_caches[key] = LLMCache(cache_dir, mode=mode)
+    return _llm_caches[key]
@@ -0,0 +1,80 @@
+import time
+import asyncio
+from typing import Dict, Tuple, Any
+
+from r2egym.agenthub.action import Action
+from r2egym.agenthub.observation import Observation
+from r2egym.agenthub.environment.env import RepoEnv
+from r2egym.agenthub.runtime.async_docker import AsyncDockerRuntime
+
+
+class AsyncRepoEnv(RepoEnv):
+    """
+    RepoEnv with coroutine entry points (`create`, `areset`, `astep`, ...) for
+    driving many environments from one event loop (see `Agent.arun`).
+
+    Usage:
+        env = await AsyncRepoEnv.create(EnvArgs(ds=ds_entry))
+        await env.aadd_commands(command_files)
+        obs, reward, done, info = await env.astep(action)
+        await env.aclose()
+    """
+
+    runtime_cls = AsyncDockerRuntime
+
+    @classmethod
+    async def create(cls, *args, **kwargs) -> "AsyncRepoEnv":
+        """Build the environment (starting its container) without blocking the event loop."""
+        return await asyncio.to_thread(cls, *args, **kwargs)
+
+    async def areset(self) -> Dict[str, Any]:
+        # the runtime may be replaced by `reset`: drop its connections (reopened lazily)
+        await self.runtime.aclose_http()
+        return await asyncio.to_thread(self.reset)
+
+    async def aadd_commands(self, cmd_files: list[str]):
+        await asyncio.to_thread(self.add_commands, cmd_files)
+
+    async def arun_action(self, action: Action, timeout: int):
+        # check for empty or no function call / action
+        if not action.function_name:
+            return "", 0, 0
+
+        start_time = time.time()
+        try:
+            bash_cmd = self._action_to_bashcmd(action)
+            bash_output, error_code = await self.runtime.arun(
+                bash_cmd,
+                timeout=timeout,
+                head_bytes=self.output_head_bytes,
+                tail_bytes=self.output_tail_bytes,
+            )
+        except Exception as e:
+            # Capture the error message as observation
+            obs = str(e)
+            error = f"Exception occurred: {obs}"
+            self.logger.error(error)
+            error_code = -1
+            bash_output = ""
+        end_time = time.time()
+        total_time = end_time - start_time
+        return bash_output, error_code, total_time
+
+    async def astep(
+        self, action: Action, timeout: int = None,
+    ) -> Tuple[Observation, int, bool, Dict[str, Any]]:
+        """Coroutine counterpart of `step`."""
+        if not timeout:
+            timeout = self.step_timeout
+        bash_output, error_code, total_time = await self.arun_action(
+            action, timeout=timeout
+        )
+        return self._finish_step(action, bash_output, error_code, total_time)
+
+    async def acompute_reward(self, timeout: int = None) -> float:
+        if not timeout:
+            timeout = self.reward_timeout
+        return await self.runtime.acalculate_reward(timeout=timeout)
+
+    async def aclose(self):
+        await self.runtime.aclose()
@@ -8,6 +8,7 @@ import gym
 import logging
 
 from r2egym.agenthub.action import Action
+from r2egym.agenthub import OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES
 from r2egym.agenthub.utils.log import get_logger
 from r2egym.agenthub.observation import Observation
 from r2egym.agenthub.runtime.docker import DockerRuntime
@@ -26,13 +27,20 @@ class EnvArgs:
 
 
 class RepoEnv(gym.Env):
+    # runtime class instantiated for the container (see AsyncRepoEnv)
+    runtime_cls = DockerRuntime
+
     def __init__(self,
                  args: EnvArgs,
                  logger=None,
                  backend: str = "docker",
                  verbose: bool = True,
                  step_timeout: int = 90,
-                 reward_timeout: int = 300):
+                 reward_timeout: int = 300,
+                 container_name: Optional[str] = None,
+                 use_session: bool = False,
+                 output_head_bytes: Optional[int] = OUTPUT_HEAD_BYTES,
+                 output_tail_bytes: Optional[int] = OUTPUT_TAIL_BYTES):
         # Get the logger
         if logger is None:
             self.logger = get_logger("RepoEnv")  # Pass the module name for clarity
@@ -44,16 +52,18 @@ class RepoEnv(gym.Env):
             #logging.getLogger().setLevel(logging.CRITICAL)  # Disable root logger
             #logging.disable(logging.CRITICAL)  # Disable all logging
 
-        self.runtime = DockerRuntime(
-            ds=args.ds, command=["/bin/bash", "-l"], logger=self.logger, backend=backend
-        )
-
         self.args = args
+        self.backend = backend
+        self.use_session = use_session
+        # bytes of command output kept from the start / end of each action's output
+        self.output_head_bytes = output_head_bytes
+        self.output_tail_bytes = output_tail_bytes
+        self.runtime = self._make_runtime(container_name=container_name)
+
         self.done = False
         self.observation = None
         self.state = None
         self.cmd_parser = ParseCommandBash()
-        self.backend = backend
         self.step_timeout = step_timeout
         self.reward_timeout = reward_timeout
         self.logger.info(
@@ -65,26 +75,44 @@ class RepoEnv(gym.Env):
         Resets the environment and returns an initial observation.
         """
         self.logger.info(f"Resetting RepoEnv ...")
-        # close the runtime
-        self.runtime.close()
         self.observation = "Environment reset"
         self.state = None
         self.done = False
+        # nothing has run in the container since it was set up: it is already in its initial state
+        if self.runtime.pristine:
+            return self.observation
+        # otherwise restore the post-setup snapshot in place
+        if self.runtime.restore():
+            return self.observation
+        # fallback: close the runtime
+        self.runtime.close()
         # also just recreate env again with the same args
-        self.runtime = DockerRuntime(
-            ds=self.args.ds, command=["/bin/bash", "-l"], logger=self.logger, backend=self.backend
-        )
+        self.runtime = self._make_runtime()
         return self.observation  # self.get_observation()
 
+    def _make_runtime(self, container_name: Optional[str] = None) -> DockerRuntime:
+        return self.runtime_cls(
+            ds=self.args.ds,
+            command=["/bin/bash", "-l"],
+            logger=self.logger,
+            backend=self.backend,
+            container_name=container_name,
+            use_session=self.use_session,
+        )
+
     def add_commands(self, cmd_files: list[str]):
         """
         Adds command files to the environment by parsing them,
         copying them to the Docker container, and making them executable or sourced.
+        All command files are shipped in a single archive and sourced in a single exec.
 
         Args:
             cmd_files: List of paths to command files.
         """
         cmds = []
+        files = {}
+        modes = {}
+        to_source = []
         for cmd_file in cmd_files:
             # Parse commands from file
             parsed_commands = self.cmd_parser.parse_command_file(cmd_file)
@@ -103,26 +131,32 @@ class RepoEnv(gym.Env):
                 else:
                     container_cmd_name = cmd_name
                 container_path = f"/usr/local/bin/{container_cmd_name}"
-                self.runtime.copy_to_container(cmd_file, container_path)
-                self.runtime.run(f"chmod +x {container_path}")
+                modes[container_path] = 0o755
 
             elif ext == ".sh":
-                # Bash script ending with .sh: copy, chmod, and source it
+                # Bash script ending with .sh: copy (keeping its mode) and source it
                 container_cmd_name = cmd_name
                 container_path = f"/usr/local/bin/{container_cmd_name}"
-                self.runtime.copy_to_container(cmd_file, container_path)
-                # self.runtime.run(f"chmod +x {container_path}")
-                # Source the script inside the container
-                self.runtime.run(f"bash -c 'source {container_path}'")
+                modes[container_path] = os.stat(cmd_file).st_mode & 0o777
+                to_source.append(container_path)
 
             else:
                 # Bash script without shebang: copy, chmod, and source it
                 container_cmd_name = cmd_name
                 container_path = f"/usr/local/bin/{container_cmd_name}"
-                self.runtime.copy_to_container(cmd_file, container_path)
-                self.runtime.run(f"chmod +x {container_path}")
-                # Source the script inside the container
-                self.runtime.run(f"bash -c 'source {container_path}'")
+                modes[container_path] = 0o755
+                to_source.append(container_path)
+
+            with open(cmd_file, "rb") as f:
+                files[container_path] = f.read()
+
+        if files:
+            self.runtime.copy_files_to_container(files, modes=modes)
+        if to_source:
+            # Source the scripts inside the container
+            self.runtime.run(
+                " ; ".join(f"bash -c 'source {path}'" for path in to_source)
+            )
 
         # Store the parsed commands for reference
         self.commands = cmds
@@ -149,16 +183,13 @@ class RepoEnv(gym.Env):
 
         start_time = time.time()
         try:
-            # Check if action is in allowed actions/commands
-            action_name = action.function_name
-            allowed_cmds = [x.name for x in self.commands]
-            assert (
-                action_name in allowed_cmds
-            ), f"Invalid Action: input action must be one of allowed actions \n Allowed actions: {allowed_cmds} \n Input action: {action_name}\t"
-
-            # Run action and return
-            bash_cmd = action.to_bashcmd()
-            bash_output, error_code = self.runtime.run(bash_cmd, timeout=timeout)
+            bash_cmd = self._action_to_bashcmd(action)
+            bash_output, error_code = self.runtime.run(
+                bash_cmd,
+                timeout=timeout,
+                head_bytes=self.output_head_bytes,
+                tail_bytes=self.output_tail_bytes,
+            )
         except Exception as e:
             # Capture the error message as observation
             obs = str(e)
@@ -170,6 +201,15 @@ class RepoEnv(gym.Env):
         total_time = end_time - start_time
         return bash_output, error_code, total_time
 
+    def _action_to_bashcmd(self, action: Action) -> str:
+        # Check if action is in allowed actions/commands
+        action_name = action.function_name
+        allowed_cmds = [x.name for x in self.commands]
+        assert (
+            action_name in allowed_cmds
+        ), f"Invalid Action: input action must be one of allowed actions \n Allowed actions: {allowed_cmds} \n Input action: {action_name}\t"
+        return action.to_bashcmd()
+
     def step(
         self, action: Action, timeout: int = None,
     ) -> Tuple[Observation, int, bool, Dict[str, Any]]:
@@ -189,6 +229,11 @@ class RepoEnv(gym.Env):
         if not timeout:
             timeout = self.step_timeout
         bash_output, error_code, total_time = self.run_action(action, timeout=timeout)
+        return self._finish_step(action, bash_output, error_code, total_time)
+
+    def _finish_step(
+        self, action: Action, bash_output: str, error_code, total_time: float
+    ) -> Tuple[Observation, int, bool, Dict[str, Any]]:
         self.observation = Observation(bash_output, error_code, action)
         reward = self.calculate_reward(self.observation)
         if "finish" in action.function_name.lower() or "submit" in action.function_name.lower():
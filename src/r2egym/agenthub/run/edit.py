@@ -8,12 +8,28 @@ from pathlib import Path
 from typing import Any, Dict, List, Optional
 from datetime import datetime
 import json
+import os
+import asyncio
+import itertools
 import concurrent.futures
 import threading
+from collections import deque
 import docker
 
 from r2egym.agenthub.runtime.docker import DockerRuntime
+from r2egym.agenthub.runtime.pool import ContainerPool
+from r2egym.agenthub.runtime.image_cache import ImageCache
+from r2egym.agenthub.runtime.prefetch import ImagePrefetcher
+from r2egym.agenthub.run.scheduler import order_instances
+from r2egym.agenthub.utils.concurrency import (
+    make_limits,
+    init_limits,
+    host_has_capacity,
+)
+from r2egym.agenthub.runtime.reward_cache import RewardCache
+from r2egym.agenthub.agent.llm_cache import get_llm_cache
 from r2egym.agenthub.environment.env import EnvArgs, RepoEnv
+from r2egym.agenthub.environment.async_env import AsyncRepoEnv
 from r2egym.agenthub.agent.agent import AgentArgs, Agent
 
 from r2egym.docker_bash_utils.docker_list_tags import fetch_docker_tags
@@ -26,6 +42,8 @@ from r2egym.agenthub.utils.utils import match_dockerimage_to_repo
 from r2egym.agenthub import SUPPORTED_REPOS
 from datasets import load_dataset
 from r2egym.agenthub.trajectory import TrajectoryStep, Trajectory
+from r2egym.agenthub.trajectory.journal import TrajectoryJournal, instance_journal_dir
+from r2egym.agenthub.trajectory.index import TrajectoryIndex
 import time
 
 ##############################################################################
@@ -38,6 +56,11 @@ logger = get_logger(__name__)  # Initialize the logger
 ##############################################################################
 file_lock = threading.Lock()
 
+# seconds between host capacity checks while rollouts are held back
+ADMISSION_POLL_INTERVAL = 30
+# seconds between checks while all upcoming images are pulling / containers warming
+READY_POLL_INTERVAL = 2
+
 
 ##############################################################################
 # Utility Function
@@ -120,6 +143,43 @@ def prepull_docker_images(ds_selected: List[Dict], max_workers: Optional[int] =
 ##############################################################################
 # editagent Functions
 ##############################################################################
+def iteration_temperatures(temperature: float, max_iterations: int) -> List[float]:
+    # if original is at temp = 0, then we do next with 0.1 and 0.2 and so on (max 0.2)
+    # if temperature is 0, create list of increasing temperatures up to 0.2
+    if temperature == 0:
+        temperatures = [0.0 + 0.1 * i for i in range(max_iterations)]
+        temperatures = [min(t, 0.2) for t in temperatures]  # cap at 0.2
+    else:
+        temperatures = [temperature] * max_iterations
+    return temperatures
+
+
+def load_agent_args(scaffold: str, use_fn_calling: bool, llm_name: str) -> AgentArgs:
+    # set agent args
+    if use_fn_calling:
+        assert scaffold != "sweagent", "SWEagent scaffold does not support fn calling"
+        agent_args = AgentArgs.from_yaml(
+            Path(f"./src/r2egym/agenthub/config/{scaffold}/edit_fn_calling.yaml")
+        )
+    else:
+        agent_args = AgentArgs.from_yaml(
+            Path(f"./src/r2egym/agenthub/config/{scaffold}/edit_non_fn_calling.yaml")
+        )
+    agent_args.llm_name = llm_name
+    return agent_args
+
+
+def attempt_journal(
+    journal_dir: Optional[str], iteration: int, idx: int, resume: str = "patch"
+) -> Optional[TrajectoryJournal]:
+    """Journal of one agent run (iteration / restart) of an instance (None without a journal_dir)."""
+    if journal_dir is None:
+        return None
+    return TrajectoryJournal(
+        os.path.join(journal_dir, f"attempt_{iteration}_{idx}.jsonl"), resume=resume
+    )
+
+
 def run_agent_with_restarts(
     agent,
     env,
@@ -131,6 +191,8 @@ def run_agent_with_restarts(
     max_iterations: int = 1,
     scaffold: str = "r2egym",
     max_tokens: int = 65536,
+    journal_dir: Optional[str] = None,
+    journal_resume: str = "patch",
 ):
     """
     Iterative eval protocol:
@@ -141,6 +203,7 @@ def run_agent_with_restarts(
     - finally choose the trajectory with the lowest number of steps
     - note restarts and iterative_evals are different (so just use one of them | add an assert flag)
     - also if original is at temp = 0, then we do next with 0.1 and 0.2 and so on (max 0.2)
+    - with a journal_dir, every run is journaled there (one journal per run) and resumed if found
     """
     steps_per_agent = max_steps // num_restarts
     logger.warning(f"running {steps_per_agent} steps per agent")
@@ -150,13 +213,7 @@ def run_agent_with_restarts(
     assert not (num_restarts > 1 and iterative_eval), "only one of restarts > 1 and iterative_eval can be True"
     logger.warning(f"Using iterations: {max_iterations}, using iterative protocol: {iterative_eval}")
 
-    # if original is at temp = 0, then we do next with 0.1 and 0.2 and so on (max 0.2)
-    # if temperature is 0, create list of increasing temperatures up to 0.2
-    if temperature == 0:
-        temperatures = [0.0 + 0.1 * i for i in range(max_iterations)]
-        temperatures = [min(t, 0.2) for t in temperatures]  # cap at 0.2
-    else:
-        temperatures = [temperature] * max_iterations
+    temperatures = iteration_temperatures(temperature, max_iterations)
     logger.warning(f"Using temperatures: {temperatures}")
 
     # run the agent in iterative protocol
@@ -172,6 +229,7 @@ def run_agent_with_restarts(
                 use_fn_calling=use_fn_calling,
                 scaffold=scaffold,
                 max_token_limit=max_tokens,
+                journal=attempt_journal(journal_dir, iteration, idx, journal_resume),
             )
             # remove reproduce.py
             # env.runtime.run('rm reproduce_issue.py')
@@ -196,11 +254,20 @@ def runagent(
     llm_name="gpt-4o",
     temperature=0,
     use_fn_calling: bool = True,
-    backend: str = "kubernetes", # "kubernetes" or "docker"
+    backend: str = "kubernetes", # "kubernetes", "docker" or "local"
     max_reward_calc_time: int = 300,
     max_iterations: int = 1,
     scaffold: str = "r2egym",
     max_tokens: int = 65536,
+    container_name: Optional[str] = None,
+    use_session: bool = False,
+    reward_cache_dir: Optional[str] = None,
+    reward_mode: str = "full",
+    reward_shards: int = 1,
+    journal_dir: Optional[str] = None,
+    journal_resume: str = "patch",
+    llm_cache_dir: Optional[str] = None,
+    llm_cache_mode: str = "record_missing",
 ) -> Optional[str]:
     """
     Runs the editagent agent on a specified Docker image.
@@ -210,6 +277,15 @@ def runagent(
         traj_dir: Directory to save trajectories.
         jsonl_file: Path to the JSONL file to save results. If not provided, generated using traj_dir and exp_name.
         exp_name: Experiment name. Used if jsonl_file is not provided. If not provided, a unique name is generated.
+        container_name: Name of an already running and set up container to use (e.g. handed out by a ContainerPool).
+        use_session: Run commands over one persistent shell session in the container instead of an exec per command.
+        reward_cache_dir: Directory of a persistent RewardCache consulted before running the tests (disabled if None).
+        reward_mode: "full" runs the whole test script, "targeted" only the FAIL_TO_PASS/PASS_TO_PASS tests with early exit.
+        reward_shards: Number of test shards run concurrently in the container when computing the reward (r2e / swesmith dockers).
+        journal_dir: Directory of per-step trajectory journals: an interrupted run of the same experiment and instance is resumed from its last journaled step (None disables).
+        journal_resume: How the environment is brought back to the journaled state: "patch" (apply the recorded diff) or "replay" (re-execute the actions).
+        llm_cache_dir: Directory of a record / replay LLMCache of the LLM responses (disabled if None).
+        llm_cache_mode: "record" (query and record), "replay" (recorded responses only, no network) or "record_missing" (query and record the missing ones).
     """
     logger = setup_logging(
         name=ds["docker_image"].replace("/", "_"),
@@ -230,21 +306,22 @@ def runagent(
     env_args = EnvArgs(ds=ds)
 
     # Initialize the RepoEnv
-    env = RepoEnv(env_args, logger=logger, backend=backend)
-    # set agent args
-    if use_fn_calling:
-        assert scaffold != "sweagent", "SWEagent scaffold does not support fn calling"
-        agent_args = AgentArgs.from_yaml(
-            Path(f"./src/r2egym/agenthub/config/{scaffold}/edit_fn_calling.yaml")
-        )
-    else:
-        agent_args = AgentArgs.from_yaml(
-            Path(f"./src/r2egym/agenthub/config/{scaffold}/edit_non_fn_calling.yaml")
-        )
-    agent_args.llm_name = llm_name
+    env = RepoEnv(
+        env_args,
+        logger=logger,
+        backend=backend,
+        container_name=container_name,
+        use_session=use_session,
+    )
+    agent_args = load_agent_args(scaffold, use_fn_calling, llm_name)
 
     # Initialize the agent
-    agent = Agent(name="EditAgent", args=agent_args, logger=logger)
+    agent = Agent(
+        name="EditAgent",
+        args=agent_args,
+        logger=logger,
+        llm_cache=get_llm_cache(llm_cache_dir, llm_cache_mode) if llm_cache_dir else None,
+    )
 
     # run agent editagent
     try:
@@ -259,6 +336,12 @@ def runagent(
             max_iterations=max_iterations,
             scaffold=scaffold,
             max_tokens=max_tokens,
+            journal_dir=(
+                instance_journal_dir(journal_dir, exp_name, ds["docker_image"])
+                if journal_dir
+                else None
+            ),
+            journal_resume=journal_resume,
         )
     except Exception as e:
         logger.error(
@@ -268,7 +351,14 @@ def runagent(
 
     # also get the gt outputs
     reward_calc_time = time.time()
-    reward, test_output = env.runtime._calculate_reward(get_test_output=True, timeout=max_reward_calc_time)
+    reward_cache = RewardCache(reward_cache_dir) if reward_cache_dir else None
+    reward, test_output = env.runtime._calculate_reward(
+        get_test_output=True,
+        timeout=max_reward_calc_time,
+        reward_cache=reward_cache,
+        reward_mode=reward_mode,
+        reward_shards=reward_shards,
+    )
     reward_calc_time = time.time() - reward_calc_time
     # Close the environment and runtime
     env.close()
@@ -287,40 +377,21 @@ def runagent(
     return trajectory.model_dump_json()
 
 
-def runagent_multiple(
+def select_instances(
     dataset: str,
     split: str,
     k: int = 1,
+    start_idx: int = 0,
     traj_dir: str = "./traj",
     exp_name: Optional[str] = None,
-    start_idx=0,
-    max_steps=40,
-    num_restarts=1,
-    max_steps_absolute=50,
-    max_workers: Optional[int] = None,
-    llm_name="gpt-4o",
     use_existing: bool = True,
     skip_existing: bool = False,
-    temperature: float = 0,
-    use_fn_calling: bool = True,
-    backend: str = "kubernetes", # "kubernetes" or "docker"
-    max_reward_calc_time: int = 300,
-    max_iterations: int = 1,
-    scaffold: str = "r2egym",
-    prepull_images: bool = False,
-    max_tokens: int = 65536,
 ):
     """
-    Runs the editagent agent on the first k Docker images.
+    Selects the dataset entries to run and the JSONL file to append the trajectories to.
 
-    Args:
-        k: The number of Docker images to process.
-        traj_dir: Directory to save trajectories.
-        exp_name: Experiment name for the JSONL file. If not provided, a unique name is generated.
-        start_idx: The starting index in the Docker images list.
-        max_steps: Maximum steps for the agent run.
-        max_workers: Maximum number of threads to use.
-        prepull_images: Whether to prepull Docker images in parallel before starting execution.
+    Returns:
+        (ds_selected, jsonl_file, exp_name)
     """
     # Load the dataset
     ds = load_dataset(dataset, split=split)
@@ -349,19 +420,12 @@ def runagent_multiple(
     # Generate a filename for the JSONL file
     jsonl_file = traj_dir_path / f"{exp_name}.jsonl"
 
+    # completed instances are read from the trajectory files' sidecar indexes
     if use_existing:
         if jsonl_file.exists():
-            with open(jsonl_file) as f:
-                existing_dockers = []
-                for line in f.readlines():
-                    try:
-                        existing_dockers.append(
-                            Trajectory.load_from_model_dump_json(line).ds[
-                                "docker_image"
-                            ]
-                        )
-                    except:
-                        print("error in jsonl file")
+            existing_dockers = {
+                entry["docker_image"] for entry in TrajectoryIndex(jsonl_file).entries()
+            }
 
             ds_selected = [
                 ds_entry
@@ -372,13 +436,13 @@ def runagent_multiple(
     if skip_existing:
         old_jsonl_files_glob = f"{exp_name[:-1]}*"
         for old_jsonl_file in traj_dir_path.glob(old_jsonl_files_glob):
-            with open(old_jsonl_file) as f:
-                existing_dockers = [
-                    loadline["ds"]["docker_image"]
-                    for line in f
-                    for loadline in [json.loads(line)]
-                    if loadline["reward"] == 1
-                ]
+            if old_jsonl_file.suffix == ".index":
+                continue
+            existing_dockers = {
+                entry["docker_image"]
+                for entry in TrajectoryIndex(old_jsonl_file).entries()
+                if entry["reward"] == 1
+            }
 
             ds_selected = [
                 ds_entry
@@ -390,59 +454,570 @@ def runagent_multiple(
         f"Starting editagent on {len(ds_selected)} Docker images after filtering."
     )
 
+    return ds_selected, jsonl_file, exp_name
+
+
+def runagent_multiple(
+    dataset: str,
+    split: str,
+    k: int = 1,
+    traj_dir: str = "./traj",
+    exp_name: Optional[str] = None,
+    start_idx=0,
+    max_steps=40,
+    num_restarts=1,
+    max_steps_absolute=50,
+    max_workers: Optional[int] = None,
+    llm_name="gpt-4o",
+    use_existing: bool = True,
+    skip_existing: bool = False,
+    temperature: float = 0,
+    use_fn_calling: bool = True,
+    backend: str = "kubernetes", # "kubernetes", "docker" or "local"
+    max_reward_calc_time: int = 300,
+    max_iterations: int = 1,
+    scaffold: str = "r2egym",
+    prepull_images: bool = False,
+    max_tokens: int = 65536,
+    warm_pool_size: int = 0,
+    use_session: bool = False,
+    reward_cache_dir: Optional[str] = None,
+    reward_mode: str = "full",
+    reward_shards: int = 1,
+    disk_budget_gb: Optional[float] = None,
+    prefetch_lookahead: int = 0,
+    max_concurrent_pulls: int = 4,
+    schedule: str = "dataset",
+    schedule_seed: int = 42,
+    max_llm_concurrency: Optional[int] = None,
+    max_exec_concurrency: Optional[int] = None,
+    max_load_per_cpu: Optional[float] = None,
+    min_free_memory_gb: Optional[float] = None,
+    journal_dir: Optional[str] = None,
+    journal_resume: str = "patch",
+    llm_cache_dir: Optional[str] = None,
+    llm_cache_mode: str = "record_missing",
+):
+    """
+    Runs the editagent agent on the first k Docker images.
+
+    Args:
+        k: The number of Docker images to process.
+        traj_dir: Directory to save trajectories.
+        exp_name: Experiment name for the JSONL file. If not provided, a unique name is generated.
+        start_idx: The starting index in the Docker images list.
+        max_steps: Maximum steps for the agent run.
+        max_workers: Maximum number of rollouts (worker processes, each with a live container) in flight.
+        prepull_images: Whether to prepull Docker images in parallel before starting execution.
+        warm_pool_size: Number of upcoming instances for which a started and set up container is kept ready (0 disables the warm pool).
+        use_session: Run commands over one persistent shell session per container instead of an exec per command.
+        reward_cache_dir: Directory of a persistent RewardCache (shared by all workers) consulted before running the tests.
+        reward_mode: "full" runs the whole test script, "targeted" only the FAIL_TO_PASS/PASS_TO_PASS tests with early exit.
+        reward_shards: Number of test shards run concurrently in the container when computing the reward (r2e / swesmith dockers).
+        disk_budget_gb: Disk budget for the local Docker images (docker backend): images are pulled on demand and the least recently used ones no longer needed are evicted (None disables).
+        prefetch_lookahead: Number of upcoming instances whose Docker images are pulled in the background while rollouts run (docker backend, 0 disables); each instance only waits for its own image.
+        max_concurrent_pulls: Maximum number of concurrent background image pulls.
+        schedule: Order in which the instances are run: "dataset" (shuffled dataset order) or "locality" (instances of the same repo pulled and run one after another, for image layer reuse).
+        schedule_seed: Seed of the "locality" schedule.
+        max_llm_concurrency: Maximum number of LLM requests in flight over all rollouts (None: one per rollout).
+        max_exec_concurrency: Maximum number of commands executing in containers over all rollouts (None: one per rollout).
+        max_load_per_cpu: Only start a new rollout while the host's 1 minute load average per CPU is below this.
+        min_free_memory_gb: Only start a new rollout while the host has at least this much available memory.
+        journal_dir: Directory of per-step trajectory journals: rerunning the same exp_name resumes interrupted instances from their last step (None disables).
+        journal_resume: How the environment is brought back to the journaled state: "patch" (apply the recorded diff) or "replay" (re-execute the actions).
+        llm_cache_dir: Directory of a record / replay LLMCache of the LLM responses (disabled if None).
+        llm_cache_mode: "record" (query and record), "replay" (recorded responses only, no network) or "record_missing" (query and record the missing ones).
+    """
+    ds_selected, jsonl_file, exp_name = select_instances(
+        dataset,
+        split,
+        k=k,
+        start_idx=start_idx,
+        traj_dir=traj_dir,
+        exp_name=exp_name,
+        use_existing=use_existing,
+        skip_existing=skip_existing,
+    )
+    max_workers = max_workers or os.cpu_count()
+    ds_selected = order_instances(
+        ds_selected, schedule, concurrency=max_workers, seed=schedule_seed
+    )
+
+    image_cache = None
+    if disk_budget_gb is not None:
+        if backend != "docker":
+            logger.warning("disk_budget_gb only applies to the docker backend, ignoring it")
+        else:
+            image_cache = ImageCache(disk_budget_gb)
+            # keyed on the images that are started (e.g. swesmith entries resolve to another image)
+            image_cache.need(DockerRuntime.resolve_docker_image(ds_entry) for ds_entry in ds_selected)
+            if prepull_images:
+                logger.warning("Not prepulling Docker images with a disk budget, pulling them on demand")
+                prepull_images = False
+
+    prefetcher = None
+    if prefetch_lookahead > 0:
+        if backend != "docker":
+            logger.warning("prefetch_lookahead only applies to the docker backend, ignoring it")
+        else:
+            prefetcher = ImagePrefetcher(
+                max_concurrent_pulls=max_concurrent_pulls, image_cache=image_cache
+            )
+            if prepull_images:
+                logger.warning("Not prepulling Docker images, prefetching them instead")
+                prepull_images = False
+
+    if prepull_images and backend == "local":
+        logger.warning("Local sandboxes use exported image roots, not prepulling Docker images")
+        prepull_images = False
+
     # Prepull all Docker images in parallel before starting main execution
     if ds_selected and prepull_images:
         logger.info("Prepulling Docker images before starting main execution...")
         prepull_docker_images(ds_selected, max_workers=max_workers)
         logger.info("Docker image prepull completed.")
 
-    # with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks to the executor using keyword arguments
-        future_to_image = {
-            executor.submit(
-                runagent,
-                ds=ds_entry,
-                exp_name=exp_name,
-                max_steps=max_steps,
-                num_restarts=num_restarts,
+    pool = ContainerPool(backend=backend) if warm_pool_size > 0 else None
+    pending = deque(ds_selected)
+    index = TrajectoryIndex(jsonl_file)
+    index.refresh()
+    admission_control = max_load_per_cpu is not None or min_free_memory_gb is not None
+
+    try:
+        # with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # LLM requests and container execs are limited separately from the rollouts in flight
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_limits,
+            initargs=make_limits(max_llm_concurrency, max_exec_concurrency),
+        ) as executor, open(jsonl_file, "a") as f:
+            # Submit tasks as workers free up, so that warm containers are handed out on demand
+            future_to_image = {}
+            warmed = 0  # number of instances at the head of `pending` with a container warming
+
+            def warm_upcoming():
+                # keep containers warming for the next `warm_pool_size` instances
+                nonlocal warmed
+                if pool is None:
+                    return
+                for ds_entry in itertools.islice(pending, warmed, warm_pool_size):
+                    pool.warm(ds_entry)
+                warmed = max(warmed, min(warm_pool_size, len(pending)))
+
+            def prefetch_upcoming():
+                # keep images pulling for the next `prefetch_lookahead` instances
+                if prefetcher is None:
+                    return
+                for ds_entry in itertools.islice(pending, prefetch_lookahead):
+                    prefetcher.prefetch(DockerRuntime.resolve_docker_image(ds_entry))
+
+            # upcoming instances that can be started out of order
+            lookahead = max(
+                prefetch_lookahead if prefetcher is not None else 0,
+                warm_pool_size if pool is not None else 0,
+                1,
+            )
+
+            def next_ready():
+                # position in `pending` of the first upcoming instance whose image is pulled
+                # and warm container is up, None if they are all still pulling / warming
+                for position, ds_entry in enumerate(itertools.islice(pending, lookahead)):
+                    if prefetcher is not None and not prefetcher.ready(
+                        DockerRuntime.resolve_docker_image(ds_entry)
+                    ):
+                        continue
+                    if pool is not None and not pool.ready(ds_entry):
+                        continue
+                    return position
+                return None
+
+            while pending or future_to_image:
+                waiting = False
+                while pending and len(future_to_image) < max_workers:
+                    if (
+                        admission_control
+                        and future_to_image
+                        and not host_has_capacity(max_load_per_cpu, min_free_memory_gb)
+                    ):
+                        logger.info(
+                            f"Host at capacity, not starting a new rollout ({len(future_to_image)} in flight)"
+                        )
+                        break
+                    prefetch_upcoming()
+                    warm_upcoming()
+                    position = next_ready()
+                    if position is None:
+                        if future_to_image:
+                            # collect finished rollouts instead of blocking on a pull / warm-up
+                            waiting = True
+                            break
+                        position = 0
+                    ds_entry = pending[position]
+                    del pending[position]
+                    if position < warmed:
+                        warmed -= 1
+                    runtime_image = DockerRuntime.resolve_docker_image(ds_entry)
+                    if image_cache is not None:
+                        # pinned until the instance is done, so it is not evicted under the worker
+                        image_cache.pin(runtime_image)
+                    try:
+                        if prefetcher is not None:
+                            prefetcher.wait(runtime_image)
+                        elif image_cache is not None:
+                            # pulled here when there is no prefetcher
+                            image_cache.ensure(runtime_image)
+                        container_name = pool.acquire(ds_entry) if pool is not None else None
+                        future = executor.submit(
+                            runagent,
+                            ds=ds_entry,
+                            exp_name=exp_name,
+                            max_steps=max_steps,
+                            num_restarts=num_restarts,
+                            max_steps_absolute=max_steps_absolute,
+                            llm_name=llm_name,
+                            temperature=temperature,
+                            use_fn_calling=use_fn_calling,
+                            backend=backend,
+                            max_reward_calc_time=max_reward_calc_time,
+                            max_iterations=max_iterations,
+                            scaffold=scaffold,
+                            max_tokens=max_tokens,
+                            container_name=container_name,
+                            use_session=use_session,
+                            reward_cache_dir=reward_cache_dir,
+                            reward_mode=reward_mode,
+                            reward_shards=reward_shards,
+                            journal_dir=journal_dir,
+                            journal_resume=journal_resume,
+                            llm_cache_dir=llm_cache_dir,
+                            llm_cache_mode=llm_cache_mode,
+                        )
+                    except BaseException:
+                        if image_cache is not None:
+                            image_cache.unpin(runtime_image)
+                        raise
+                    future_to_image[future] = (
+                        ds_entry["docker_image"],
+                        runtime_image,
+                    )  # <-- store the docker_image from ds_entry here
+
+                prefetch_upcoming()
+                warm_upcoming()
+                done, _ = concurrent.futures.wait(
+                    future_to_image,
+                    # re-check the host capacity / upcoming instances periodically
+                    timeout=(
+                        READY_POLL_INTERVAL
+                        if waiting
+                        else ADMISSION_POLL_INTERVAL if admission_control else None
+                    ),
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    docker_image, runtime_image = future_to_image.pop(
+                        future
+                    )  # <-- retrieve that stored docker_image
+                    if image_cache is not None:
+                        image_cache.unpin(runtime_image)
+                        image_cache.release(runtime_image)
+                    try:
+                        result = future.result()
+                        if result is not None:
+                            with file_lock:
+                                offset = f.tell()
+                                f.write(result + "\n")
+                                f.flush()
+                                index.record(result, offset)
+                            if journal_dir:
+                                TrajectoryJournal.remove_dir(
+                                    instance_journal_dir(journal_dir, exp_name, docker_image)
+                                )
+                    except Exception as e:
+                        # Use docker_image from above when logging
+                        logger.error(f"Exception for Docker image {docker_image}: {e}")
+    finally:
+        if pool is not None:
+            pool.close()
+        if prefetcher is not None:
+            prefetcher.close()
+
+    logger.info(f"editagent completed on {len(ds_selected)} Docker images.")
+
+
+##############################################################################
+# asyncio editagent Functions
+##############################################################################
+async def arun_agent_with_restarts(
+    agent,
+    env,
+    max_steps=40,
+    num_restarts=1,
+    temperature=0.0,
+    max_steps_absolute=50,
+    use_fn_calling: bool = True,
+    max_iterations: int = 1,
+    scaffold: str = "r2egym",
+    max_tokens: int = 65536,
+    journal_dir: Optional[str] = None,
+    journal_resume: str = "patch",
+):
+    """Coroutine counterpart of `run_agent_with_restarts` (on an AsyncRepoEnv)."""
+    steps_per_agent = max_steps // num_restarts
+    iterative_eval = max_iterations > 1
+    assert not (num_restarts > 1 and iterative_eval), "only one of restarts > 1 and iterative_eval can be True"
+    temperatures = iteration_temperatures(temperature, max_iterations)
+
+    trajectories = []
+    for iteration in range(max_iterations):
+        for idx in range(num_restarts):
+            trajectory = await agent.arun(
+                env,
+                max_steps=steps_per_agent,
+                temperature=temperatures[iteration],
                 max_steps_absolute=max_steps_absolute,
-                llm_name=llm_name,
-                temperature=temperature,
                 use_fn_calling=use_fn_calling,
-                backend=backend,
-                max_reward_calc_time=max_reward_calc_time,
-                max_iterations=max_iterations,
                 scaffold=scaffold,
-                max_tokens=max_tokens,
-            ): ds_entry[
-                "docker_image"
-            ]  # <-- store the docker_image from ds_entry here
-            for ds_entry in ds_selected
-        }
+                max_token_limit=max_tokens,
+                journal=attempt_journal(journal_dir, iteration, idx, journal_resume),
+            )
+        if trajectory.exit_reason == "agent":
+            logger.warning(f"agent self-finished at iteration: {iteration}")
+            return trajectory
+        trajectories.append(trajectory)
+
+    # choose the trajectory with the lowest number of steps
+    trajectory = min(trajectories, key=lambda x: x.num_steps)
+    return trajectory
 
-        with open(jsonl_file, "a") as f:
-            for future in concurrent.futures.as_completed(future_to_image):
-                docker_image = future_to_image[
-                    future
-                ]  # <-- retrieve that stored docker_image
-                try:
-                    result = future.result()
-                    if result is not None:
-                        with file_lock:
-                            f.write(result + "\n")
-                except Exception as e:
-                    # Use docker_image from above when logging
-                    logger.error(f"Exception for Docker image {docker_image}: {e}")
+
+async def arunagent(
+    ds,
+    exp_name: Optional[str] = None,
+    max_steps=40,
+    num_restarts=1,
+    max_steps_absolute=50,
+    llm_name="gpt-4o",
+    temperature=0,
+    use_fn_calling: bool = True,
+    backend: str = "kubernetes", # "kubernetes", "docker" or "local"
+    max_reward_calc_time: int = 300,
+    max_iterations: int = 1,
+    scaffold: str = "r2egym",
+    max_tokens: int = 65536,
+    container_name: Optional[str] = None,
+    use_session: bool = False,
+    reward_cache_dir: Optional[str] = None,
+    reward_mode: str = "full",
+    reward_shards: int = 1,
+    journal_dir: Optional[str] = None,
+    journal_resume: str = "patch",
+    llm_cache_dir: Optional[str] = None,
+    llm_cache_mode: str = "record_missing",
+) -> Optional[str]:
+    """
+    Coroutine counterpart of `runagent`: runs the editagent agent on a specified Docker image
+    from the current event loop.
+    """
+    logger = setup_logging(
+        name=ds["docker_image"].replace("/", "_"),
+        log_file=f"run_logs/{exp_name}/{ds['docker_image'].replace('/', '_')}.log",
+        console=True,
+        level=INFO,
+    )
+    logger.info(f"Starting editagent on Docker image: {ds['docker_image']}")
+
+    assert scaffold in ["r2egym", "sweagent", "openhands"], f"Scaffold is {scaffold}, must be one of [r2egym, sweagent, openhands]"
+    # Generate a unique experiment name if not provided
+    if exp_name is None:
+        exp_name = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    env = await AsyncRepoEnv.create(
+        EnvArgs(ds=ds),
+        logger=logger,
+        backend=backend,
+        container_name=container_name,
+        use_session=use_session,
+    )
+    agent_args = load_agent_args(scaffold, use_fn_calling, llm_name)
+    agent = Agent(
+        name="EditAgent",
+        args=agent_args,
+        logger=logger,
+        llm_cache=get_llm_cache(llm_cache_dir, llm_cache_mode) if llm_cache_dir else None,
+    )
+
+    try:
+        trajectory = await arun_agent_with_restarts(
+            agent,
+            env,
+            max_steps=max_steps,
+            num_restarts=num_restarts,
+            temperature=temperature,
+            max_steps_absolute=max_steps_absolute,
+            use_fn_calling=use_fn_calling,
+            max_iterations=max_iterations,
+            scaffold=scaffold,
+            max_tokens=max_tokens,
+            journal_dir=(
+                instance_journal_dir(journal_dir, exp_name, ds["docker_image"])
+                if journal_dir
+                else None
+            ),
+            journal_resume=journal_resume,
+        )
+    except Exception as e:
+        logger.error(
+            f"Error during agent run for Docker image {ds['docker_image']}: {e}"
+        )
+        await env.aclose()
+        return None
+
+    # also get the gt outputs
+    reward_calc_time = time.time()
+    reward_cache = RewardCache(reward_cache_dir) if reward_cache_dir else None
+    reward, test_output = await env.runtime.acalculate_reward(
+        get_test_output=True,
+        timeout=max_reward_calc_time,
+        reward_cache=reward_cache,
+        reward_mode=reward_mode,
+        reward_shards=reward_shards,
+    )
+    reward_calc_time = time.time() - reward_calc_time
+    # Close the environment and runtime
+    await env.aclose()
+
+    # update the trajectory object
+    trajectory.reward = reward
+    trajectory.test_output = test_output
+    trajectory.ds = ds
+    trajectory.exp_name = exp_name
+    trajectory.reward_calc_time = reward_calc_time # time taken to calculate reward
+    logger.info(f"editagent completed for Docker image: {ds['docker_image']}")
+    return trajectory.model_dump_json()
+
+
+async def arunagent_multiple(
+    dataset: str,
+    split: str,
+    k: int = 1,
+    traj_dir: str = "./traj",
+    exp_name: Optional[str] = None,
+    start_idx=0,
+    max_steps=40,
+    num_restarts=1,
+    max_steps_absolute=50,
+    max_concurrency: int = 64,
+    llm_name="gpt-4o",
+    use_existing: bool = True,
+    skip_existing: bool = False,
+    temperature: float = 0,
+    use_fn_calling: bool = True,
+    backend: str = "kubernetes", # "kubernetes", "docker" or "local"
+    max_reward_calc_time: int = 300,
+    max_iterations: int = 1,
+    scaffold: str = "r2egym",
+    max_tokens: int = 65536,
+    use_session: bool = False,
+    reward_cache_dir: Optional[str] = None,
+    reward_mode: str = "full",
+    reward_shards: int = 1,
+    schedule: str = "dataset",
+    schedule_seed: int = 42,
+    journal_dir: Optional[str] = None,
+    journal_resume: str = "patch",
+    llm_cache_dir: Optional[str] = None,
+    llm_cache_mode: str = "record_missing",
+):
+    """
+    Runs the editagent agent on the first k Docker images from a single event loop,
+    with up to `max_concurrency` rollouts in flight.
+
+    LLM queries and (docker backend) commands are awaited; blocking operations
+    (container start and setup, reward computation, kubernetes exec) run in a thread
+    pool sized to `max_concurrency`. See `runagent_multiple` for the other arguments.
+    """
+    ds_selected, jsonl_file, exp_name = select_instances(
+        dataset,
+        split,
+        k=k,
+        start_idx=start_idx,
+        traj_dir=traj_dir,
+        exp_name=exp_name,
+        use_existing=use_existing,
+        skip_existing=skip_existing,
+    )
+    ds_selected = order_instances(
+        ds_selected, schedule, concurrency=max_concurrency, seed=schedule_seed
+    )
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+    )
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(ds_entry):
+        async with semaphore:
+            try:
+                result = await arunagent(
+                    ds=ds_entry,
+                    exp_name=exp_name,
+                    max_steps=max_steps,
+                    num_restarts=num_restarts,
+                    max_steps_absolute=max_steps_absolute,
+                    llm_name=llm_name,
+                    temperature=temperature,
+                    use_fn_calling=use_fn_calling,
+                    backend=backend,
+                    max_reward_calc_time=max_reward_calc_time,
+                    max_iterations=max_iterations,
+                    scaffold=scaffold,
+                    max_tokens=max_tokens,
+                    use_session=use_session,
+                    reward_cache_dir=reward_cache_dir,
+                    reward_mode=reward_mode,
+                    reward_shards=reward_shards,
+                    journal_dir=journal_dir,
+                    journal_resume=journal_resume,
+                    llm_cache_dir=llm_cache_dir,
+                    llm_cache_mode=llm_cache_mode,
+                )
+            except Exception as e:
+                logger.error(f"Exception for Docker image {ds_entry['docker_image']}: {e}")
+                result = None
+            return ds_entry, result
+
+    # tasks are created (and take the semaphore) in schedule order
+    tasks = [asyncio.ensure_future(run_one(ds_entry)) for ds_entry in ds_selected]
+    index = TrajectoryIndex(jsonl_file)
+    index.refresh()
+    with open(jsonl_file, "a") as f:
+        for task in asyncio.as_completed(tasks):
+            ds_entry, result = await task
+            if result is not None:
+                offset = f.tell()
+                f.write(result + "\n")
+                f.flush()
+                index.record(result, offset)
+                if journal_dir:
+                    TrajectoryJournal.remove_dir(
+                        instance_journal_dir(journal_dir, exp_name, ds_entry["docker_image"])
+                    )
 
     logger.info(f"editagent completed on {len(ds_selected)} Docker images.")
 
 
+def runagent_multiple_async(*args, **kwargs):
+    """Command line entry point for `arunagent_multiple`."""
+    asyncio.run(arunagent_multiple(*args, **kwargs))
+
+
 if __name__ == "__main__":
     # Expose functions via Fire
     Fire(
         {
             "runagent": runagent,
             "runagent_multiple": runagent_multiple,
+            "runagent_multiple_async": runagent_multiple_async,
         }
     )
@@ -0,0 +1,85 @@
+import random
+from collections import defaultdict
+from typing import Dict, List
+
+SCHEDULES = ["dataset", "locality"]
+
+
+def instance_group(ds: dict) -> str:
+    """
+    Locality group of a dataset entry: instances of the same repo (whose images share
+    most of their layers, e.g. `namanjain12/pandas_final:*`).
+    """
+    for field in ["repo", "repo_name"]:
+        if ds.get(field):
+            return ds[field]
+    image = ds.get("docker_image") or ds.get("image_name") or ""
+    return image.rsplit(":", 1)[0]
+
+
+def locality_order(ds_entries: List[dict], concurrency: int, seed: int = 42) -> List[dict]:
+    """
+    Order instances so that images sharing layers are used one after another.
+
+    Instances are grouped by repo (see `instance_group`) and the groups are spread over
+    `concurrency` lanes, the instances of a lane being run in order. The lanes are
+    interleaved round robin, so that the ~`concurrency` instances in flight at any time
+    come from different lanes. Within a lane, each pull then reuses the layers of the
+    previous image of the same repo (rather than every worker pulling a near-identical
+    image at once), and the images of a repo are used close together in time, which
+    keeps them cached. Repos with more instances than a lane's fair share are split
+    over several lanes so that no lane lags behind.
+
+    Deterministic given `seed` (and the input order).
+    """
+    if not ds_entries:
+        return []
+    rng = random.Random(seed)
+    concurrency = max(1, concurrency)
+
+    groups: Dict[str, List[dict]] = defaultdict(list)
+    for ds in ds_entries:
+        groups[instance_group(ds)].append(ds)
+    group_order = list(groups)
+    rng.shuffle(group_order)
+
+    # split groups into jobs of at most a lane's fair share
+    job_size = max(1, -(-len(ds_entries) // concurrency))
+    jobs = []
+    for name in group_order:
+        members = groups[name]
+        rng.shuffle(members)
+        # the same image back to back
+        first_index = {}
+        for i, ds in enumerate(members):
+            first_index.setdefault(ds.get("docker_image"), i)
+        members.sort(key=lambda ds: first_index[ds.get("docker_image")])
+        for start in range(0, len(members), job_size):
+            jobs.append(members[start : start + job_size])
+
+    # largest job first onto the least loaded lane (stable on ties)
+    lanes: List[List[dict]] = [[] for _ in range(min(concurrency, len(jobs)))]
+    for job in sorted(jobs, key=len, reverse=True):
+        lane = min(range(len(lanes)), key=lambda i: len(lanes[i]))
+        lanes[lane].extend(job)
+
+    ordered = []
+    for position in range(max(len(lane) for lane in lanes)):
+        for lane in lanes:
+            if position < len(lane):
+                ordered.append(lane[position])
+    return ordered
+
+
+def order_instances(
+    ds_entries: List[dict], schedule: str = "dataset", concurrency: int = 1, seed: int = 42
+) -> List[dict]:
+    """
+    Order in which the selected instances are run:
+        "dataset": the (shuffled) dataset order
+        "locality": grouped by repo for image layer reuse (see `locality_order`)
+    """
+    assert schedule in SCHEDULES, f"Invalid schedule: {schedule}, must be one of {SCHEDULES}"
+    if schedule == "locality":
+        return locality_order(ds_entries, concurrency, seed=seed)
+    return list(ds_entries)
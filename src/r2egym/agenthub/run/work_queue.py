@@ -0,0 +1,470 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import contextlib
+import concurrent.futures
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fire import Fire
+
+from r2egym.agenthub.run.edit import runagent, select_instances
+from r2egym.agenthub.run.scheduler import order_instances
+from r2egym.agenthub.trajectory.index import TrajectoryIndex
+from r2egym.agenthub.trajectory.journal import TrajectoryJournal, instance_journal_dir
+from r2egym.agenthub.utils.concurrency import make_limits, init_limits
+from r2egym.agenthub.utils.log import get_logger
+
+##############################################################################
+# Initialize Logger
+##############################################################################
+logger = get_logger(__name__)
+
+# task states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+# leases of a task before it is given up on
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+@dataclass
+class Lease:
+    """A task handed out to a worker until `lease_until` (unless renewed by heartbeats)."""
+
+    task_id: int
+    ds: Dict[str, Any]
+    attempts: int
+    lease_until: float
+
+
+##############################################################################
+# Brokers
+##############################################################################
+class Broker(ABC):
+    """
+    Queue of rollout tasks (one per dataset entry) shared by the workers of any number of
+    hosts.
+
+    A worker leases a task for `lease_seconds` and renews the lease with heartbeats while
+    the rollout runs; the task of a worker that died (lease expired) is handed out again,
+    up to `max_attempts` leases (set when the tasks are queued, and stored with them).
+    Results are kept by the broker until collected.
+    """
+
+    @abstractmethod
+    def enqueue(self, ds_entries: List[Dict[str, Any]], exp_name: str) -> int:
+        """Add tasks (instances already queued are skipped); returns the number added."""
+
+    @abstractmethod
+    def exp_name(self) -> Optional[str]:
+        """Experiment the queue runs."""
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Lease]:
+        """Next task to run, or None if there is none available right now."""
+
+    @abstractmethod
+    def heartbeat(self, task_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Renew a lease; False if the worker no longer holds it."""
+
+    @abstractmethod
+    def complete(self, task_id: int, worker_id: str, result: str) -> None:
+        """Store the result (trajectory JSON) of a task."""
+
+    @abstractmethod
+    def fail(self, task_id: int, worker_id: str, error: str) -> None:
+        """Give a task back (retried until it has been leased `max_attempts` times)."""
+
+    @abstractmethod
+    def results(self) -> Iterator[Tuple[int, str]]:
+        """Uncollected (task_id, result) pairs."""
+
+    @abstractmethod
+    def mark_collected(self, task_ids: List[int]) -> None:
+        pass
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of tasks per state."""
+
+    def finished(self) -> bool:
+        counts = self.counts()
+        return counts.get(PENDING, 0) == 0 and counts.get(LEASED, 0) == 0
+
+
+class SQLiteBroker(Broker):
+    """
+    Broker backed by a sqlite database file. Safe to share between processes, and
+    between hosts through a shared filesystem with working POSIX locks (the default
+    rollback journal is used, since WAL does not work over network filesystems).
+
+    `max_attempts` is stored by `enqueue`; None uses the stored one (or
+    DEFAULT_MAX_ATTEMPTS for a queue without one).
+    """
+
+    def __init__(self, db_path: str, max_attempts: Optional[int] = None):
+        self.db_path = os.path.expanduser(db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "id INTEGER PRIMARY KEY, docker_image TEXT UNIQUE, ds TEXT, "
+                "state TEXT, worker TEXT, lease_until REAL, attempts INTEGER, "
+                "result TEXT, error TEXT, collected INTEGER DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_until)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            row = conn.execute("SELECT value FROM meta WHERE key = 'max_attempts'").fetchone()
+        if max_attempts is None:
+            max_attempts = int(row[0]) if row else DEFAULT_MAX_ATTEMPTS
+        self.max_attempts = max_attempts
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one short-lived connection (and transaction) per operation: safe across processes
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def enqueue(self, ds_entries: List[Dict[str, Any]], exp_name: str) -> int:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('exp_name', ?)", (exp_name,)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('max_attempts', ?)", (str(self.max_attempts),)
+            )
+            before = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (docker_image, ds, state, attempts) "
+                "VALUES (?, ?, ?, 0)",
+                [
+                    (ds["docker_image"], json.dumps(ds, default=str), PENDING)
+                    for ds in ds_entries
+                ],
+            )
+            after = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        return after - before
+
+    def exp_name(self) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'exp_name'").fetchone()
+        return row[0] if row else None
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Lease]:
+        now = time.time()
+        with self._connect() as conn:
+            # expired leases out of attempts are given up on
+            conn.execute(
+                "UPDATE tasks SET state = ?, error = 'lease expired' "
+                "WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, ds, attempts FROM tasks "
+                "WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY id LIMIT 1",
+                (PENDING, LEASED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            task_id, ds, attempts = row
+            lease_until = now + lease_seconds
+            conn.execute(
+                "UPDATE tasks SET state = ?, worker = ?, lease_until = ?, attempts = ? "
+                "WHERE id = ?",
+                (LEASED, worker_id, lease_until, attempts + 1, task_id),
+            )
+        return Lease(task_id, json.loads(ds), attempts + 1, lease_until)
+
+    def heartbeat(self, task_id: int, worker_id: str, lease_seconds: float) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE id = ? AND state = ? AND worker = ?",
+                (time.time() + lease_seconds, task_id, LEASED, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: int, worker_id: str, result: str) -> None:
+        # a result is accepted even if the lease was lost meanwhile: the first one wins
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = ?, worker = ?, result = ?, error = NULL "
+                "WHERE id = ? AND state != ?",
+                (DONE, worker_id, result, task_id, DONE),
+            )
+
+    def fail(self, task_id: int, worker_id: str, error: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "error = ?, lease_until = NULL "
+                "WHERE id = ? AND state = ? AND worker = ?",
+                (self.max_attempts, FAILED, PENDING, error, task_id, LEASED, worker_id),
+            )
+
+    def results(self) -> Iterator[Tuple[int, str]]:
+        with self._connect() as conn:
+            task_ids = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT id FROM tasks WHERE state = ? AND collected = 0 ORDER BY id",
+                    (DONE,),
+                )
+            ]
+        # one result at a time: trajectories are large
+        for task_id in task_ids:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT result FROM tasks WHERE id = ?", (task_id,)
+                ).fetchone()
+            yield task_id, row[0]
+
+    def mark_collected(self, task_ids: List[int]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE tasks SET collected = 1, result = NULL WHERE id = ?",
+                [(task_id,) for task_id in task_ids],
+            )
+
+    def counts(self) -> Dict[str, int]:
+        now = time.time()
+        with self._connect() as conn:
+            counts = dict(
+                conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+            )
+            # expired leases will be handed out again
+            expired = conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE state = ? AND lease_until < ? AND attempts < ?",
+                (LEASED, now, self.max_attempts),
+            ).fetchone()[0]
+        if expired:
+            counts[LEASED] -= expired
+            counts[PENDING] = counts.get(PENDING, 0) + expired
+        return counts
+
+
+BROKERS = {"sqlite": SQLiteBroker}
+
+
+def get_broker(broker: str, max_attempts: Optional[int] = None) -> Broker:
+    """
+    Broker from a URL `<kind>://<location>`, e.g. "sqlite:///shared/queues/exp.sqlite"
+    (a bare path is a sqlite database). `max_attempts` is only given when queueing tasks:
+    otherwise the one stored with the queue is used.
+    """
+    kind, sep, location = broker.partition("://")
+    if not sep:
+        kind, location = "sqlite", broker
+    assert kind in BROKERS, f"Invalid broker: {kind}, must be one of {list(BROKERS)}"
+    return BROKERS[kind](location, max_attempts=max_attempts)
+
+
+##############################################################################
+# Entry points
+##############################################################################
+def enqueue(
+    broker: str,
+    dataset: str,
+    split: str,
+    k: int = 1,
+    traj_dir: str = "./traj",
+    exp_name: Optional[str] = None,
+    start_idx=0,
+    use_existing: bool = True,
+    skip_existing: bool = False,
+    schedule: str = "dataset",
+    schedule_seed: int = 42,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+):
+    """
+    Queues the instances `runagent_multiple` would run, for `worker`s on any number of hosts.
+
+    Args:
+        broker: Queue URL (see `get_broker`), e.g. a sqlite file on a shared filesystem.
+        traj_dir, exp_name, use_existing, skip_existing: As for `runagent_multiple` (instances already in the trajectory files are not queued).
+        schedule: Order in which the instances are handed out: "dataset" or "locality".
+        max_attempts: Number of times a task is leased before it is given up on (stored with the queue, used by all workers).
+    """
+    ds_selected, _, exp_name = select_instances(
+        dataset,
+        split,
+        k=k,
+        start_idx=start_idx,
+        traj_dir=traj_dir,
+        exp_name=exp_name,
+        use_existing=use_existing,
+        skip_existing=skip_existing,
+    )
+    ds_selected = order_instances(ds_selected, schedule, seed=schedule_seed)
+    added = get_broker(broker, max_attempts=max_attempts).enqueue(ds_selected, exp_name)
+    logger.info(f"Queued {added} instances of experiment {exp_name} on {broker}")
+
+
+def worker(
+    broker: str,
+    max_workers: Optional[int] = None,
+    lease_seconds: float = 600,
+    heartbeat_interval: float = 60,
+    poll_interval: float = 30,
+    exit_when_done: bool = True,
+    max_llm_concurrency: Optional[int] = None,
+    max_exec_concurrency: Optional[int] = None,
+    **runagent_kwargs,
+):
+    """
+    Runs queued instances on this host until the queue is drained.
+
+    Args:
+        broker: Queue URL (see `get_broker`).
+        max_workers: Maximum number of rollouts in flight on this host.
+        lease_seconds: Lease duration: a task whose worker sent no heartbeat for this long is handed out again.
+        heartbeat_interval: Seconds between lease renewals of the running tasks.
+        poll_interval: Seconds between queue polls while the queue is empty but tasks are leased elsewhere.
+        exit_when_done: Exit once no task is pending or leased (otherwise keep polling for new tasks).
+        max_llm_concurrency, max_exec_concurrency: As for `runagent_multiple` (per host).
+        runagent_kwargs: Arguments of `runagent` (llm_name, backend, max_steps, ...).
+    """
+    assert heartbeat_interval < lease_seconds, "heartbeat_interval must be below lease_seconds"
+    queue = get_broker(broker)
+    exp_name = queue.exp_name()
+    max_workers = max_workers or os.cpu_count()
+    journal_dir = runagent_kwargs.get("journal_dir")
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    logger.info(f"Worker {worker_id} running experiment {exp_name} from {broker}")
+
+    running: Dict[concurrent.futures.Future, Lease] = {}
+    stop = threading.Event()
+
+    def send_heartbeats():
+        while not stop.wait(heartbeat_interval):
+            for lease in list(running.values()):
+                try:
+                    if not queue.heartbeat(lease.task_id, worker_id, lease_seconds):
+                        logger.warning(f"Lost the lease of {lease.ds['docker_image']}")
+                except Exception as e:
+                    logger.error(f"Heartbeat failed: {repr(e)}")
+
+    heartbeats = threading.Thread(target=send_heartbeats, daemon=True)
+    heartbeats.start()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_limits,
+            initargs=make_limits(max_llm_concurrency, max_exec_concurrency),
+        ) as executor:
+            while True:
+                while len(running) < max_workers:
+                    lease = queue.lease(worker_id, lease_seconds)
+                    if lease is None:
+                        break
+                    logger.info(
+                        f"Leased {lease.ds['docker_image']} (attempt {lease.attempts})"
+                    )
+                    future = executor.submit(
+                        runagent, ds=lease.ds, exp_name=exp_name, **runagent_kwargs
+                    )
+                    running[future] = lease
+
+                if not running:
+                    if exit_when_done and queue.finished():
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = concurrent.futures.wait(
+                    running,
+                    timeout=poll_interval,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    lease = running.pop(future)
+                    docker_image = lease.ds["docker_image"]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Exception for Docker image {docker_image}: {e}")
+                        result = None
+                    if result is None:
+                        queue.fail(lease.task_id, worker_id, "rollout failed")
+                        continue
+                    queue.complete(lease.task_id, worker_id, result)
+                    if journal_dir:
+                        TrajectoryJournal.remove_dir(
+                            instance_journal_dir(journal_dir, exp_name, docker_image)
+                        )
+    finally:
+        stop.set()
+    logger.info(f"Worker {worker_id} done: {queue.counts()}")
+
+
+def collect(
+    broker: str,
+    traj_dir: str = "./traj",
+    follow: bool = False,
+    poll_interval: float = 60,
+):
+    """
+    Appends the finished trajectories of a queue to `<traj_dir>/<exp_name>.jsonl` (and
+    its index), as `runagent_multiple` would have written them.
+
+    Args:
+        broker: Queue URL (see `get_broker`).
+        follow: Keep collecting until no task is pending or leased.
+    """
+    queue = get_broker(broker)
+    exp_name = queue.exp_name()
+    traj_dir_path = Path(traj_dir)
+    traj_dir_path.mkdir(parents=True, exist_ok=True)
+    jsonl_file = traj_dir_path / f"{exp_name}.jsonl"
+    index = TrajectoryIndex(jsonl_file)
+
+    while True:
+        finished = queue.finished()
+        # instances already written (e.g. by an interrupted collect) are not duplicated
+        existing = {entry["docker_image"] for entry in index.refresh()}
+        collected = []
+        with open(jsonl_file, "a") as f:
+            for task_id, result in queue.results():
+                entry = TrajectoryIndex.entry(result, 0)
+                if entry is None or entry["docker_image"] not in existing:
+                    offset = f.tell()
+                    f.write(result + "\n")
+                    f.flush()
+                    index.record(result, offset)
+                    if entry is not None:
+                        existing.add(entry["docker_image"])
+                collected.append(task_id)
+        queue.mark_collected(collected)
+        logger.info(f"Collected {len(collected)} trajectories into {jsonl_file}: {queue.counts()}")
+        if not follow or finished:
+            break
+        time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    Fire(
+        {
+            "enqueue": enqueue,
+            "worker": worker,
+            "collect": collect,
+        }
+    )
@@ -0,0 +1,201 @@
+import os
+import asyncio
+from typing import Optional
+
+import aiohttp
+
+from r2egym.agenthub import CMD_TIMEOUT
+from r2egym.agenthub.runtime.docker import DockerRuntime, DOCKER_PATH
+from r2egym.agenthub.runtime.output import OutputCapture
+
+
+DEFAULT_DOCKER_SOCKET = "/var/run/docker.sock"
+
+
+##############################################################################
+# Asyncio runtime
+##############################################################################
+class AsyncDockerRuntime(DockerRuntime):
+    """
+    DockerRuntime with coroutine entry points, so that a single event loop can drive
+    hundreds of rollouts without a thread (or process) per in-flight command.
+
+    On the docker backend, `arun` talks to the docker engine API directly over its
+    unix socket (exec create -> start -> inspect) with aiohttp, so an in-flight command
+    costs one socket and no thread. Everything else (container start / setup, the
+    kubernetes backend, session mode, reward computation) reuses the blocking
+    implementation in a worker thread.
+
+    Usage:
+        runtime = await AsyncDockerRuntime.create(ds=ds_entry)
+        output, error_code = await runtime.arun("ls")
+        await runtime.aclose()
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._http: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    async def create(cls, *args, **kwargs) -> "AsyncDockerRuntime":
+        """Start (or attach to) the container without blocking the event loop."""
+        return await asyncio.to_thread(cls, *args, **kwargs)
+
+    def _get_http(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            docker_host = os.environ.get("DOCKER_HOST", "")
+            if docker_host.startswith("tcp://"):
+                connector = aiohttp.TCPConnector()
+                self._base_url = "http://" + docker_host[len("tcp://"):]
+            else:
+                socket_path = (
+                    docker_host[len("unix://"):]
+                    if docker_host.startswith("unix://")
+                    else DEFAULT_DOCKER_SOCKET
+                )
+                connector = aiohttp.UnixConnector(path=socket_path)
+                self._base_url = "http://localhost"
+            self._base_url += f"/v{self.client.api.api_version}"
+            # no client-side timeout: `arun` bounds each command with asyncio.wait_for
+            self._http = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=None)
+            )
+        return self._http
+
+    async def _exec_docker(
+        self, cmd: list[str], workdir: str, capture: OutputCapture
+    ) -> int:
+        http = self._get_http()
+        async with http.post(
+            f"{self._base_url}/containers/{self.container.id}/exec",
+            json={
+                "Cmd": cmd,
+                "AttachStdout": True,
+                "AttachStderr": True,
+                "WorkingDir": workdir,
+                "Env": [f"PATH={DOCKER_PATH}"],
+            },
+        ) as resp:
+            resp.raise_for_status()
+            exec_id = (await resp.json())["Id"]
+        async with http.post(
+            f"{self._base_url}/exec/{exec_id}/start",
+            json={"Detach": False, "Tty": False},
+        ) as resp:
+            resp.raise_for_status()
+            # docker multiplexed stream: 8 byte header (stream type, 0, 0, 0, big endian size) + payload
+            buffer = b""
+            async for chunk in resp.content.iter_any():
+                buffer += chunk
+                while len(buffer) >= 8:
+                    size = int.from_bytes(buffer[4:8], "big")
+                    if len(buffer) < 8 + size:
+                        break
+                    capture.write(buffer[8 : 8 + size])
+                    buffer = buffer[8 + size :]
+        async with http.get(f"{self._base_url}/exec/{exec_id}/json") as resp:
+            resp.raise_for_status()
+            exit_code = (await resp.json())["ExitCode"]
+        return exit_code
+
+    async def arun(
+        self,
+        code: str,
+        timeout: int = CMD_TIMEOUT,
+        args: str = "",
+        workdir=None,
+        head_bytes: Optional[int] = None,
+        tail_bytes: Optional[int] = None,
+    ) -> tuple[str, str]:
+        """
+        Coroutine counterpart of `run`, with the same timeout handling, output capture and
+        (output, error_message) contract.
+        """
+        if self.backend != "docker" or self.use_session:
+            return await asyncio.to_thread(
+                self.run,
+                code,
+                timeout=timeout,
+                args=args,
+                workdir=workdir,
+                head_bytes=head_bytes,
+                tail_bytes=tail_bytes,
+            )
+
+        exec_workdir = self.repo_path if workdir is None else workdir
+        self.pristine = False
+        capture = OutputCapture(head_bytes=head_bytes, tail_bytes=tail_bytes)
+        command = f"timeout {timeout} {code} {args}"
+        try:
+            error_code = await asyncio.wait_for(
+                self._exec_docker(["/bin/sh", "-c", command], exec_workdir, capture),
+                timeout=timeout + 5,
+            )
+            output = capture.getvalue()
+
+            if error_code == 124:
+                self.logger.error(f"Internal Timeout: {timeout}s")
+                return f"The command took too long to execute (>{timeout}s)", "-1"
+
+            if error_code != 0:
+                self.logger.error(
+                    f"Error: Exit code {error_code} \nError Message: {output}"
+                )
+                return output, f"Error: Exit code {error_code}"
+
+            # Remove ANSI escape codes and \r characters
+            output = capture.getvalue(strip_ansi=True)
+            return output, str(error_code)
+
+        ## timeout
+        except asyncio.TimeoutError:
+            self.logger.error(f"Timeout: {timeout}s")
+            return f"The command took too long to execute (>{timeout}s)", "-1"
+
+        except Exception as e:
+            return f"Error: {repr(e)}", "-1"
+
+    ####################################################################
+    # Blocking operations offloaded to a worker thread
+    ####################################################################
+    async def aget_patch(self) -> str:
+        return await asyncio.to_thread(self.get_patch)
+
+    async def aapply_patch(self, patch: str) -> tuple[str, str]:
+        return await asyncio.to_thread(self.apply_patch, patch)
+
+    async def apeek_patch(self) -> str:
+        return await asyncio.to_thread(self.peek_patch)
+
+    async def acalculate_reward(
+        self,
+        get_test_output=False,
+        timeout: int = 300,
+        reward_cache=None,
+        reward_mode: str = "full",
+        reward_shards: int = 1,
+    ):
+        return await asyncio.to_thread(
+            self._calculate_reward,
+            get_test_output=get_test_output,
+            timeout=timeout,
+            reward_cache=reward_cache,
+            reward_mode=reward_mode,
+            reward_shards=reward_shards,
+        )
+
+    async def arestore(self) -> bool:
+        return await asyncio.to_thread(self.restore)
+
+    async def aclose_http(self):
+        """Close the engine API connections (reopened lazily by `arun`)."""
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+
+    async def aclose(self):
+        await self.aclose_http()
+        await asyncio.to_thread(self.close)
+
+    async def adetach(self) -> str:
+        await self.aclose_http()
+        return await asyncio.to_thread(self.detach)
@@ -3,15 +3,34 @@ import json
 from time import sleep
 import time
 import uuid
-import tempfile
+from typing import Optional
 import docker
 from docker.models.containers import Container
 
-from r2egym.repo_analysis.execution_log_parser import parse_log_fn, decolor_dict_keys
+from r2egym.repo_analysis.execution_log_parser import (
+    parse_log_fn,
+    parse_test_report,
+    decolor_dict_keys,
+)
 from r2egym.agenthub.runtime.base import (
     ExecutionEnvironment,
 )
+from r2egym.agenthub.runtime.output import OutputCapture
+from r2egym.agenthub.utils.matcher import TestNameMatcher
+from r2egym.agenthub.utils.concurrency import exec_limited
+from r2egym.agenthub.runtime.session import (
+    ShellSession,
+    DockerExecTransport,
+    KubernetesExecTransport,
+    LocalProcessTransport,
+)
+from r2egym.agenthub.runtime.local import (
+    LocalSandbox,
+    local_root_dir,
+    LOCAL_SANDBOXES_DIR,
+)
 import base64
+import shlex
 import subprocess
 import datetime
 import hashlib
@@ -45,6 +64,19 @@ from kubernetes.stream import stream
 
 DEFAULT_NAMESPACE = "default"
 DOCKER_PATH = "/root/.venv/bin:/root/.local/bin:/root/.cargo/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+# post-setup snapshot of the repo (see DockerRuntime.snapshot): kept outside the repo, hidden from the agent
+SNAPSHOT_DIR = "/var/tmp/r2egym_snapshot"
+SNAPSHOT_REF = "refs/r2egym/snapshot"
+EDITOR_STATE_FILE = "/var/tmp/editor_state.json"  # undo history of the file editor tools
+SETUP_SCRIPT_PATH = "/var/tmp/r2egym_setup.sh"
+# pytest plugin (and its spec) for the targeted reward mode
+REWARD_PLUGIN_DIR = "/var/tmp/r2egym_reward"
+REWARD_PLUGIN_SOURCE = os.path.join(os.path.dirname(__file__), "r2egym_reward_plugin.py")
+REWARD_MODES = ["full", "targeted"]
+# structured test reports written by the reward plugin (one file per pytest process)
+REWARD_REPORT_DIR = f"{REWARD_PLUGIN_DIR}/reports"
+# separates the logs of test shards in the output of a sharded reward run
+SHARD_LOG_MARKER = "::r2egym-shard::"
 
 from swebench.harness.constants import (
     APPLY_PATCH_FAIL,
@@ -88,12 +120,14 @@ class DockerRuntime(ExecutionEnvironment):
         docker_image: str = None,  # docker image to use (if not provided, will be inferred from ds)
         command: str = "/bin/bash",
         logger=None,
-        backend="docker",
+        backend="docker",  # "docker", "kubernetes" or "local" (see LocalSandbox)
+        container_name: str = None,  # attach to an existing (already set up) container, e.g. from ContainerPool
+        use_session: bool = False,  # run commands over one persistent shell instead of an exec per command
         **docker_kwargs,
     ):
         # check if ds is provided (required for all dockers moving forward)
         assert ds, f"Dataset not provided for docker image: {docker_image}"
-        assert backend in ["docker", "kubernetes"], f"Invalid backend: {backend}"
+        assert backend in ["docker", "kubernetes", "local"], f"Invalid backend: {backend}"
         # swebench specific setup
         self.ds = ds
         self.backend = backend
@@ -108,9 +142,8 @@ class DockerRuntime(ExecutionEnvironment):
         self.swebench_verified = "swebench" in self.docker_image
         self.swesmith = "swesmith" in self.docker_image
         if self.swesmith:
-            image_name = self.ds['image_name'].replace('__', '_1776_')
             self.swebench_verified = False
-            self.docker_image = f'jyangballin/{image_name}:latest'
+            self.docker_image = self.resolve_docker_image(self.ds, self.docker_image)
         
         if self.swebench_verified:
             # also create a test spec for swebench verified dockers (useful for grading)
@@ -119,6 +152,10 @@ class DockerRuntime(ExecutionEnvironment):
         # set runtime params
         self.repo_path = repo_path
         self.alt_path = alt_path
+        if self.swebench_verified:
+            self.alt_path = (
+                "/"  # the run_test is in the "/" directory for swebench dockers
+            )
         self.command = command
         self.repo_name = (
             self.ds["repo"] if self.swebench_verified or self.swesmith else self.ds["repo_name"]
@@ -131,11 +168,19 @@ class DockerRuntime(ExecutionEnvironment):
             )
             self.commit = ParsedCommit(**json.loads(self.commit_json))
         self.docker_kwargs = docker_kwargs
+        self.use_session = use_session
+        self.session = None
+        # parsed test status map of the last reward computation
+        self.last_test_status = None
+        # structured {nodeid: status} report of the last reward test run (None: scrape the log)
+        self.last_test_report = None
         if logger is None:
             if self.backend == "docker":
                 logger_name = "DockerRuntime"
             elif self.backend == "kubernetes":
                 logger_name = "KubernetesRuntime"
+            elif self.backend == "local":
+                logger_name = "LocalRuntime"
             else:
                 raise ValueError(f"Invalid backend: {self.backend}")
             self.logger = get_logger(logger_name)  # Pass the module name for clarity
@@ -151,26 +196,39 @@ class DockerRuntime(ExecutionEnvironment):
             except Exception:
                 config.load_kube_config()
             self.client = client.CoreV1Api()
+        else:
+            # local sandboxes need no daemon
+            self.client = None
 
         # Start the container
         self.container = None
-        self.container_name = self._get_container_name(self.docker_image)
-        if self.backend == "kubernetes":
+        self.reused_container = False
+        if container_name is not None:
+            self.container_name = container_name
+        elif self.backend == "kubernetes":
             # Generate a random UUID and truncate to 30 characters
             self.container_name = str(uuid.uuid4())
+        else:
+            self.container_name = self._get_container_name(self.docker_image)
         self.start_container(
             self.docker_image, command, self.container_name, **docker_kwargs
         )
 
-        # Initialize the environment
-        self.setup_env()
+        # Initialize the environment (skipped when attaching to a container that is already set up)
+        if not self.reused_container:
+            self.setup_env()
+            self.snapshot()
+        # no command has been run in the container since setup
+        self.pristine = True
         if self.backend == "kubernetes":
             self.logger.info("Kubernetes environment initialized")
+        elif self.backend == "local":
+            self.logger.info("Local environment initialized")
         else:
             self.logger.info("Docker environment initialized")
         self.logger.info("repo name: %s", self.repo_name)
         self.logger.info("Docker image: %s", self.docker_image)
-        if self.backend == "docker":
+        if self.backend in ["docker", "local"]:
             self.logger.info("Container ID: %s", self.container.id)
         elif self.backend == "kubernetes":
             # Assuming self.container is a V1Pod object after creation/retrieval
@@ -181,6 +239,16 @@ class DockerRuntime(ExecutionEnvironment):
             )
             self.logger.info("Pod Name: %s", pod_name)
 
+    @staticmethod
+    def resolve_docker_image(ds, docker_image: str = None) -> str:
+        """Image that is started for a dataset entry (resolved without starting anything)."""
+        if not docker_image:
+            docker_image = ds["docker_image"] if "docker_image" in ds else ds["image_name"]
+        if "swesmith" in docker_image:
+            image_name = ds['image_name'].replace('__', '_1776_')
+            docker_image = f'jyangballin/{image_name}:latest'
+        return docker_image
+
     @staticmethod
     def _get_container_name(image_name: str) -> str:
         """Return name of container"""
@@ -222,6 +290,7 @@ class DockerRuntime(ExecutionEnvironment):
                 name=pod_name, namespace=DEFAULT_NAMESPACE, _request_timeout=60,
             )
             self.logger.info(f"Found existing Kubernetes pod: {pod_name}")
+            self.reused_container = True
             return
         except client.ApiException as e:
             not_found_error = e
@@ -358,6 +427,7 @@ class DockerRuntime(ExecutionEnvironment):
                 )
                 if containers:
                     self.container = containers[0]
+                    self.reused_container = True
                     if self.container.status != "running":
                         self.container.start()
                 else:
@@ -375,6 +445,14 @@ class DockerRuntime(ExecutionEnvironment):
                 self._start_kubernetes_pod(
                     docker_image, command, ctr_name, **docker_kwargs
                 )
+            elif self.backend == "local":
+                self.container = LocalSandbox(
+                    local_root_dir(docker_image), os.path.join(LOCAL_SANDBOXES_DIR, ctr_name)
+                )
+                if self.container.exists():
+                    self.reused_container = True
+                else:
+                    self.container.create()
         except Exception as e:
             print("Container start error:", repr(e))
             self.stop_container()
@@ -447,7 +525,7 @@ class DockerRuntime(ExecutionEnvironment):
     def stop_container(self):
         try:
             if self.container:
-                if self.backend == "docker":
+                if self.backend in ["docker", "local"]:
                     self.container.stop()
                     self.container.remove()
                 elif self.backend == "kubernetes":
@@ -469,125 +547,160 @@ class DockerRuntime(ExecutionEnvironment):
         )
         self.run(reset_command)
 
-    def setup_env_swesmith(self):
-        try:
-            commit_id = self.ds['base_commit']
-            self.run("git fetch")
-            self.run(f"git checkout {commit_id}")
-            # Setup the run_test.sh script for subsequent testing.  
-            test_command, _ = get_test_command(self.ds)
-            eval_script_content = "\n".join(
-                [
-                    "#!/bin/bash",
-                    "set -uxo pipefail",
-                    "source /opt/miniconda3/bin/activate",
-                    f"conda activate testbed",
-                    f"cd testbed/",
-                    f": '>>>>> Start Test Output'",
-                    test_command,
-                    f": '>>>>> End Test Output'",
-                ]
-            ) + "\n"
-            
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.sh') as temp_file:
-                temp_file.write(eval_script_content)
-                temp_file.flush()  # Ensure content is written to disk
-                temp_file_path = temp_file.name
-            
-            # Copy the file to container and clean up
-            self.copy_to_container(temp_file_path, "/run_tests.sh")
-            os.unlink(temp_file_path)  # Clean up the temporary file
-            
-            self.run("chmod +x /run_tests.sh")
-
+    def setup_steps_swesmith(self) -> tuple[list[tuple[str, str]], dict[str, str]]:
+        commit_id = self.ds['base_commit']
+        # Setup the run_test.sh script for subsequent testing.
+        test_command, _ = get_test_command(self.ds)
+        eval_script_content = "\n".join(
+            [
+                "#!/bin/bash",
+                "set -uxo pipefail",
+                "source /opt/miniconda3/bin/activate",
+                f"conda activate testbed",
+                f"cd testbed/",
+                f": '>>>>> Start Test Output'",
+                test_command,
+                f": '>>>>> End Test Output'",
+            ]
+        ) + "\n"
+        steps = [
+            ("git_fetch", "git fetch"),
+            ("git_checkout", f"git checkout {commit_id}"),
             # Ensure can call and execute the tools in /usr/local/bin.
-            self.run(f"ln -s /opt/miniconda3/envs/testbed /root/.venv")
-            self.run('echo \'export PATH="/usr/local/bin:$PATH"\' >> ~/.bashrc')
-            self.run("python -m pip install chardet")
-        except Exception as e:
-            self.logger.error(f"Error setting up environment: {repr(e)}")
-
-    def setup_env_swebench(self):
-        try:
+            ("link_venv", f"ln -s /opt/miniconda3/envs/testbed /root/.venv"),
+            ("bashrc_path", 'echo \'export PATH="/usr/local/bin:$PATH"\' >> ~/.bashrc'),
+            ("install_chardet", "python -m pip install chardet"),
+        ]
+        # /run_tests.sh is shipped (executable) along with the setup script
+        return steps, {"/run_tests.sh": eval_script_content}
+
+    def setup_steps_swebench(self) -> tuple[list[tuple[str, str]], dict[str, str]]:
+        steps = [
             # make the run_tests.sh executable
-            self.run("chmod +x /run_tests.sh")
+            ("chmod_run_tests", "chmod +x /run_tests.sh"),
+            # make symlink of conda env to /root/.venv
+            ("link_venv", f"ln -s /opt/miniconda3/envs/testbed /root/.venv"),
+            # install required packages
+            ("install_chardet", "python -m pip install chardet"),
+        ]
+        return steps, {}
 
-            # # move all skip files (if present) to /root
-            # for skip_file in SKIP_FILES:
-            #     self.run(f"mv {self.repo_path}/{skip_file} {self.alt_path}/{skip_file}")
-            self.alt_path = (
-                "/"  # the run_test is in the "/" directory for swebench dockers
+    def setup_steps_r2e(self) -> tuple[list[tuple[str, str]], dict[str, str]]:
+        steps = [
+            # create a symlink from repo_path/.venv to /root/.venv
+            ("link_venv", f"ln -s {self.repo_path}/.venv {self.alt_path}/.venv"),
+            (
+                "link_python",
+                f"ln -s {self.repo_path}/.venv/bin/python {self.alt_path}/.local/bin/python",
+            ),
+            (
+                "link_python3",
+                f"ln -s {self.repo_path}/.venv/bin/python {self.alt_path}/.local/bin/python3",
+            ),
+            (
+                "link_venv_bin",
+                f"find {self.repo_path}/.venv/bin -type f -executable -exec ln -sf {{}} {self.alt_path}/.local/bin/ \\;",
+            ),
+            # install required packages
+            ("install_chardet", "uv pip install chardet"),
+            ("delete_pyc", "find . -name '*.pyc' -delete"),
+            ("delete_pycache", "find . -name '__pycache__' -exec rm -rf {} +"),
+            # also delete pycache and pyc from /r2e_tests
+            ("delete_tests_pyc", "find /r2e_tests -name '*.pyc' -delete"),
+            ("delete_tests_pycache", "find /r2e_tests -name '__pycache__' -exec rm -rf {} +"),
+        ]
+        # move all skip files (if present) to /root
+        for skip_file in SKIP_FILES_NEW:
+            steps.append(
+                (
+                    f"hide_{skip_file}",
+                    f"mv {self.repo_path}/{skip_file} {self.alt_path}/{skip_file}",
+                )
             )
+        # r2e_tests are in the / directory, move them to /root
+        steps.append(("move_r2e_tests", f"mv /r2e_tests {self.alt_path}/r2e_tests"))
+        # make a softlink for /root/r2e_tests (if present)
+        steps.append(
+            ("link_r2e_tests", f"ln -s {self.alt_path}/r2e_tests {self.repo_path}/r2e_tests")
+        )
+        return steps, {}
 
-            # make symlink of conda env to /root/.venv
-            self.run(f"ln -s /opt/miniconda3/envs/testbed /root/.venv")
-
-            # install required packages TODO: check if working
-            # self.run(
-            #     "python -m pip install tree-sitter==0.20.4 tree_sitter_languages==1.10.2"
-            # )
-            self.run("python -m pip install chardet")
-            # sudo apt-get install patchutils
-            # self.run("apt-get update")
-            # self.run("apt-get install -y patchutils")
-        except Exception as e:
-            self.logger.error(
-                f"Error setting up environment: {repr(e)} @ {self.docker_image}"
-            )
+    @staticmethod
+    def build_setup_script(steps: list[tuple[str, str]], step_timeout: int = CMD_TIMEOUT) -> str:
+        """
+        Render setup steps as a single bash script. Every step runs (under its own timeout)
+        even if earlier ones fail, and reports `::r2egym-setup:: <name> <exit code> <ms>`
+        followed by its output if it failed.
+        """
+        lines = ["#!/bin/bash", "log=$(mktemp)"]
+        for name, cmd in steps:
+            lines += [
+                "start=$(date +%s%N)",
+                f'timeout {step_timeout} bash -c {shlex.quote(cmd)} > "$log" 2>&1; rc=$?',
+                "end=$(date +%s%N)",
+                f'echo "::r2egym-setup:: {name} $rc $(( (end - start) / 1000000 ))"',
+                'if [ "$rc" -ne 0 ]; then cat "$log"; echo; fi',
+            ]
+        lines.append('rm -f "$log"')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def parse_setup_report(output: str) -> list[dict]:
+        """Parse the output of `build_setup_script` into per-step results."""
+        report = []
+        for line in output.splitlines():
+            if line.startswith("::r2egym-setup:: "):
+                name, exit_code, elapsed_ms = line.split()[1:4]
+                report.append(
+                    {
+                        "step": name,
+                        "exit_code": int(exit_code),
+                        "time": int(elapsed_ms) / 1000 if elapsed_ms.isdigit() else None,
+                        "output": "",
+                    }
+                )
+            elif report:
+                report[-1]["output"] += line + "\n"
+        return report
 
     def setup_env(self):
+        """
+        Bootstrap the environment: the setup steps for the docker flavour (r2e / swebench / swesmith)
+        are rendered into one script, shipped with any extra files in a single archive and
+        executed in a single exec. Per-step results are kept in `self.setup_report`.
+        """
         if self.swebench_verified:
-            return self.setup_env_swebench()
+            steps, files = self.setup_steps_swebench()
         elif self.swesmith:
-            return self.setup_env_swesmith()
+            steps, files = self.setup_steps_swesmith()
+        else:
+            steps, files = self.setup_steps_r2e()
 
+        self.setup_report = []
         try:
-            # setup venv
-            # modify the repo path to a common path
-            # self.run(f"cp -r {self.repo_path} /workspace")
-
-            # create a symlink from repo_path/.venv to /root/.venv
-            self.run(f"ln -s {self.repo_path}/.venv {self.alt_path}/.venv")
-
-            self.run(
-                f"ln -s {self.repo_path}/.venv/bin/python {self.alt_path}/.local/bin/python"
+            files[SETUP_SCRIPT_PATH] = self.build_setup_script(steps)
+            self.copy_files_to_container(files, mode=0o755)
+            output, error_code = self.run(
+                f"bash {SETUP_SCRIPT_PATH}", timeout=CMD_TIMEOUT * len(steps)
             )
-            self.run(
-                f"ln -s {self.repo_path}/.venv/bin/python {self.alt_path}/.local/bin/python3"
-            )
-            self.run(
-                f"find {self.repo_path}/.venv/bin -type f -executable -exec ln -sf {{}} {self.alt_path}/.local/bin/ \\;"
+            self.setup_report = self.parse_setup_report(output)
+            if len(self.setup_report) != len(steps):
+                self.logger.error(
+                    f"Setup script did not complete ({len(self.setup_report)}/{len(steps)} steps): {output}"
+                )
+            for step in self.setup_report:
+                if step["exit_code"] != 0:
+                    self.logger.error(
+                        f"Setup step {step['step']} failed with exit code {step['exit_code']}: {step['output']}"
+                    )
+            self.logger.info(
+                "Setup step timings: "
+                + ", ".join(f"{step['step']}={step['time']}s" for step in self.setup_report)
             )
-            # print(self.run(f"ls -l {self.alt_path}/.local/bin"))
-
-            # self.run(f"mv {self.repo_path} /workspace")
-            # self.repo_path = "/workspace"
-
-            # install required packages
-            # self.run("uv pip install tree_sitter_languages") # remove since already installed in new dockers
-
-            self.run("uv pip install chardet")
-
-            self.run("find . -name '*.pyc' -delete")
-
-            self.run("find . -name '__pycache__' -exec rm -rf {} +")
-
-            # also delete pycache and pyc from /r2e_tests
-            self.run("find /r2e_tests -name '*.pyc' -delete")
-            self.run("find /r2e_tests -name '__pycache__' -exec rm -rf {} +")
-
-            # move all skip files (if present) to /root
-            for skip_file in SKIP_FILES_NEW:
-                self.run(f"mv {self.repo_path}/{skip_file} {self.alt_path}/{skip_file}")
-
-            # r2e_tests are in the / directory, move them to /root
-            self.run(f"mv /r2e_tests {self.alt_path}/r2e_tests")
-
-            # make a softlink for /root/r2e_tests (if present)
-            self.run(f"ln -s {self.alt_path}/r2e_tests {self.repo_path}/r2e_tests")
-            # self.run(f"ln -s /r2e_tests {self.repo_path}/r2e_tests")
         except Exception as e:
-            self.logger.error(f"Error setting up environment: {repr(e)}")
+            self.logger.error(
+                f"Error setting up environment: {repr(e)} @ {self.docker_image}"
+            )
 
     def get_task_instruction(self) -> str:
         # try getting the content inside of [ISSUE] [/ISSUE] using regex tags for ds['problem_statement'] else return ds['problem_statement']
@@ -603,12 +716,15 @@ class DockerRuntime(ExecutionEnvironment):
         timeout: int = CMD_TIMEOUT,
         args: str = "",
         workdir: str = "",
+        capture: OutputCapture = None,
     ) -> tuple[str, str]:
         """
         Kubernetes-specific method to execute code or commands in the pod, with a timeout.
         Mirrors the logic of the original Docker `run` method using Kubernetes API.
         """
         # Command includes 'timeout' and potentially 'cd <workdir> &&' from the main run method
+        if capture is None:
+            capture = OutputCapture()
         command = ""
         if workdir:
             # Use '&&' so that failure to change directory aborts the command
@@ -629,33 +745,24 @@ class DockerRuntime(ExecutionEnvironment):
                     tty=False,  # Match docker exec_run settings
                     _preload_content=False,  # Important for streaming
                 )
-                # Read until the command exits, accumulating each channel
-                combined_chunks = []
-                stdout_chunks = []
-                stderr_chunks = []
+                # Read until the command exits, streaming both channels into the capture
                 while resp.is_open():
                     resp.update(timeout=1)  # wait for data
                     if resp.peek_stdout():
-                        chunk = resp.read_stdout()
-                        stdout_chunks.append(chunk)
-                        combined_chunks.append(chunk)
+                        capture.write(resp.read_stdout())
                     if resp.peek_stderr():
-                        chunk = resp.read_stderr()
-                        stderr_chunks.append(chunk)
-                        combined_chunks.append(chunk)
+                        capture.write(resp.read_stderr())
                 resp.close()
-                exit_code = resp.returncode
-                combined_output = "".join(combined_chunks)
-                return combined_output, exit_code
+                return resp.returncode
 
             # Execute with an overall timeout slightly larger than the command's timeout
             with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
                 future = executor.submit(execute_command)
                 # Use timeout+10 as a buffer for k8s comms
-                combined_output, exit_code = future.result(timeout=timeout + 5)
+                exit_code = future.result(timeout=timeout + 5)
 
-            # Process results - combined_output already preserves inter-leaved stdout/stderr
-            output = combined_output
+            # the capture preserves inter-leaved stdout/stderr
+            output = capture.getvalue()
 
             if exit_code is None:  # Should not happen if command finished
                 self.logger.error("Kubernetes exec: Exit code not found.")
@@ -674,7 +781,7 @@ class DockerRuntime(ExecutionEnvironment):
                 return output, f"Error: Exit code {exit_code}"
 
             # Remove ANSI escape codes and \r characters from the combined output
-            output = re.sub(r"\x1b\[[0-9;]*m|\r", "", output)
+            output = capture.getvalue(strip_ansi=True)
             return output, str(exit_code)
         except concurrent.futures.TimeoutError:
             self.logger.error(f"Kubernetes exec Overall Timeout: {timeout + 5}s")
@@ -686,6 +793,66 @@ class DockerRuntime(ExecutionEnvironment):
             self.logger.error(f"Unexpected error during Kubernetes exec: {repr(e)}")
             return f"Error: {repr(e)}", "-1"
 
+    def _run_local(
+        self,
+        code: str,
+        timeout: int = CMD_TIMEOUT,
+        args: str = "",
+        workdir: str = "",
+        capture: OutputCapture = None,
+    ) -> tuple[str, str]:
+        """
+        Local-backend counterpart of `run`: executes the command in the LocalSandbox, with
+        the same timeout handling and (output, error_message) contract.
+        """
+        if capture is None:
+            capture = OutputCapture()
+        command = f"timeout {timeout} {code} {args}"
+        transport = LocalProcessTransport(
+            self.container.command(
+                ["/bin/sh", "-c", command],
+                workdir or self.repo_path,
+                environment={"PATH": DOCKER_PATH},
+            )
+        )
+
+        def execute_command():
+            while True:
+                chunk = transport.read(timeout=1)
+                if chunk is None:
+                    break
+                capture.write(chunk)
+            return transport.exit_code()
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            error_code = executor.submit(execute_command).result(timeout=timeout + 5)
+        except concurrent.futures.TimeoutError:
+            self.logger.error(f"Timeout: {timeout}s")
+            return f"The command took too long to execute (>{timeout}s)", "-1"
+        except Exception as e:
+            return f"Error: {repr(e)}", "-1"
+        finally:
+            # kills whatever is left of the command, which unblocks the reader
+            transport.close()
+            executor.shutdown(wait=False)
+
+        output = capture.getvalue()
+        if error_code == 124:
+            self.logger.error(f"Internal Timeout: {timeout}s")
+            return f"The command took too long to execute (>{timeout}s)", "-1"
+
+        if error_code != 0:
+            self.logger.error(
+                f"Error: Exit code {error_code} \nError Message: {output}"
+            )
+            return output, f"Error: Exit code {error_code}"
+
+        # Remove ANSI escape codes and \r characters
+        output = capture.getvalue(strip_ansi=True)
+        return output, str(error_code)
+
+    @exec_limited
     def run(
         self,
         code: str,
@@ -693,9 +860,13 @@ class DockerRuntime(ExecutionEnvironment):
         args: str = "",
         workdir=None,
         type: str = None,
+        head_bytes: Optional[int] = None,
+        tail_bytes: Optional[int] = None,
     ) -> tuple[str, str]:
         """
         General method to execute code or commands in the container, with a timeout.
+        The output is streamed into an OutputCapture: pass `head_bytes` / `tail_bytes` to
+        only keep that much of the start / end of it (by default all output is kept).
 
         :param code: The code or command to execute.
         :param args: Arguments to pass to the code/script.
@@ -704,28 +875,48 @@ class DockerRuntime(ExecutionEnvironment):
         """
         exec_code = code
         exec_workdir = self.repo_path if workdir is None else workdir
+        self.pristine = False
+        capture = OutputCapture(head_bytes=head_bytes, tail_bytes=tail_bytes)
+
+        if self.use_session:
+            return self._run_session(
+                exec_code, timeout, args, workdir=exec_workdir, capture=capture
+            )
 
         if self.backend == "kubernetes":
-            return self._run_kubernetes(exec_code, timeout, args, workdir=exec_workdir)
+            return self._run_kubernetes(
+                exec_code, timeout, args, workdir=exec_workdir, capture=capture
+            )
+
+        if self.backend == "local":
+            return self._run_local(
+                exec_code, timeout, args, workdir=exec_workdir, capture=capture
+            )
 
         command = f"timeout {timeout} {exec_code} {args}"
+
+        def execute_command():
+            # Notice we do NOT set tty=True here
+            api = self.client.api
+            exec_id = api.exec_create(
+                self.container.id,
+                ["/bin/sh", "-c", command],
+                stdout=True,
+                stderr=True,
+                workdir=exec_workdir,
+                environment={"PATH": DOCKER_PATH},
+            )["Id"]
+            for chunk in api.exec_start(exec_id, stream=True):
+                capture.write(chunk)
+            return api.exec_inspect(exec_id)["ExitCode"]
+
         try:
             with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-                # Notice we do NOT set tty=True here
-                future = executor.submit(
-                    self.container.exec_run,
-                    cmd=["/bin/sh", "-c", command],
-                    # cmd=command,
-                    workdir=exec_workdir,
-                    stdout=True,
-                    stderr=True,
-                    environment={"PATH": DOCKER_PATH},
-                )
-                exec_result = future.result(timeout=timeout + 5)
+                future = executor.submit(execute_command)
+                error_code = future.result(timeout=timeout + 5)
 
             # Retrieve output and exit code
-            output = exec_result.output.decode("utf-8", errors="replace")
-            error_code = exec_result.exit_code
+            output = capture.getvalue()
 
             if error_code == 124:
                 self.logger.error(f"Internal Timeout: {timeout}s")
@@ -738,7 +929,7 @@ class DockerRuntime(ExecutionEnvironment):
                 return output, f"Error: Exit code {error_code}"
 
             # Remove ANSI escape codes and \r characters
-            output = re.sub(r"\x1b\[[0-9;]*m|\r", "", output)
+            output = capture.getvalue(strip_ansi=True)
             return output, str(error_code)
 
         ## timeout
@@ -749,10 +940,154 @@ class DockerRuntime(ExecutionEnvironment):
         except Exception as e:
             return f"Error: {repr(e)}", "-1"
 
+    def _get_session(self) -> ShellSession:
+        """Return the persistent shell session, (re)starting it if needed."""
+        if self.session is None or self.session.closed:
+            if self.backend == "docker":
+                transport = DockerExecTransport(
+                    self.container,
+                    environment={"PATH": DOCKER_PATH},
+                    workdir=self.repo_path,
+                )
+            elif self.backend == "local":
+                transport = LocalProcessTransport(
+                    self.container.command(
+                        ["/bin/bash"], self.repo_path, environment={"PATH": DOCKER_PATH}
+                    )
+                )
+            else:
+                transport = KubernetesExecTransport(
+                    self.client, self.container_name, DEFAULT_NAMESPACE
+                )
+            self.session = ShellSession(transport)
+        return self.session
+
+    def _run_session(
+        self,
+        code: str,
+        timeout: int = CMD_TIMEOUT,
+        args: str = "",
+        workdir: str = "",
+        capture: OutputCapture = None,
+    ) -> tuple[str, str]:
+        """
+        Session-mode counterpart of `run`: executes the command over the persistent shell
+        session, with the same timeout handling and (output, error_message) contract.
+        """
+        if capture is None:
+            capture = OutputCapture()
+        command = f"timeout {timeout} {code} {args}"
+        try:
+            error_code = self._get_session().run(
+                command, workdir or self.repo_path, deadline=timeout + 5, capture=capture
+            )
+        except Exception as e:
+            return f"Error: {repr(e)}", "-1"
+        if error_code is None:
+            # the session is closed and will be restarted on the next command
+            self.logger.error(f"Session Timeout: {timeout}s")
+            return f"The command took too long to execute (>{timeout}s)", "-1"
+
+        output = capture.getvalue()
+        if error_code == 124:
+            self.logger.error(f"Internal Timeout: {timeout}s")
+            return f"The command took too long to execute (>{timeout}s)", "-1"
+
+        if error_code != 0:
+            self.logger.error(
+                f"Error: Exit code {error_code} \nError Message: {output}"
+            )
+            return output, f"Error: Exit code {error_code}"
+
+        # Remove ANSI escape codes and \r characters
+        output = capture.getvalue(strip_ansi=True)
+        return output, str(error_code)
+
+    @exec_limited
+    def run_with_stdin(
+        self,
+        code: str,
+        stdin: str | bytes,
+        timeout: int = CMD_TIMEOUT,
+        workdir=None,
+    ) -> tuple[str, str]:
+        """
+        Execute a command with `stdin` piped into it (e.g. a patch into `git apply`),
+        without writing any file on the host or in the container.
+        Same timeout handling and (output, error_message) contract as `run`.
+        """
+        if isinstance(stdin, str):
+            stdin = stdin.encode("utf-8")
+        exec_workdir = self.repo_path if workdir is None else workdir
+        self.pristine = False
+        capture = OutputCapture()
+        # the shell hands exactly len(stdin) bytes to the command, so stdin never needs to be closed
+        command = f"head -c {len(stdin)} | timeout {timeout} /bin/sh -c {shlex.quote(code)}"
+
+        def execute_command():
+            if self.backend == "docker":
+                transport = DockerExecTransport(
+                    self.container,
+                    command=["/bin/sh", "-c", command],
+                    environment={"PATH": DOCKER_PATH},
+                    workdir=exec_workdir,
+                )
+            elif self.backend == "local":
+                transport = LocalProcessTransport(
+                    self.container.command(
+                        ["/bin/sh", "-c", command],
+                        exec_workdir,
+                        environment={"PATH": DOCKER_PATH},
+                    )
+                )
+            else:
+                transport = KubernetesExecTransport(
+                    self.client,
+                    self.container_name,
+                    DEFAULT_NAMESPACE,
+                    command=["/bin/sh", "-c", f"cd {exec_workdir} && {command}"],
+                )
+            try:
+                transport.write(stdin)
+                while True:
+                    chunk = transport.read(timeout=1)
+                    if chunk is None:
+                        break
+                    capture.write(chunk)
+                return transport.exit_code()
+            finally:
+                transport.close()
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(execute_command)
+                error_code = future.result(timeout=timeout + 5)
+        except concurrent.futures.TimeoutError:
+            self.logger.error(f"Timeout: {timeout}s")
+            return f"The command took too long to execute (>{timeout}s)", "-1"
+        except Exception as e:
+            return f"Error: {repr(e)}", "-1"
+
+        output = capture.getvalue()
+        if error_code == 124:
+            self.logger.error(f"Internal Timeout: {timeout}s")
+            return f"The command took too long to execute (>{timeout}s)", "-1"
+
+        if error_code != 0:
+            self.logger.error(
+                f"Error: Exit code {error_code} \nError Message: {output}"
+            )
+            return output, f"Error: Exit code {error_code}"
+
+        # Remove ANSI escape codes and \r characters
+        output = capture.getvalue(strip_ansi=True)
+        return output, str(error_code)
+
     def demux_run(
         self, code: str, timeout: int = CMD_TIMEOUT, args: str = "", workdir=None
     ) -> tuple[str, str]:
         command = f"timeout {timeout} {code} {args}"
+        self.pristine = False
         try:
             with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
                 # Set demux=True to get separate stdout and stderr streams
@@ -785,17 +1120,10 @@ class DockerRuntime(ExecutionEnvironment):
         except Exception as e:
             return f"Error: {repr(e)}", f"Error: {repr(e)}", "-1"
 
-    def _copy_to_container_kubernetes(self, src_path: str, dest_path: str):
+    def _put_archive_kubernetes(self, tar_bytes: bytes, dest_dir: str):
         """
-        Copy a file or directory from host into Kubernetes pod using tar over exec.
+        Extract an in-memory tarball into a directory of the Kubernetes pod using tar over exec.
         """
-        # Calculate destination directory and prepare in-memory tarball
-        dest_dir = os.path.dirname(dest_path)
-        tar_stream = io.BytesIO()
-        with tarfile.open(fileobj=tar_stream, mode="w") as tar:
-            tar.add(src_path, arcname=os.path.basename(dest_path))
-        tar_stream.seek(0)
-
         # Retry with exponential backoff
         max_retries = 5
         retry_delay = 5  # Initial delay in seconds
@@ -815,7 +1143,7 @@ class DockerRuntime(ExecutionEnvironment):
                     _preload_content=False,
                 )
                 # Stream the tar binary data into the pod
-                resp.write_stdin(tar_stream.read())
+                resp.write_stdin(tar_bytes)
                 resp.close()
                 break  # Success, exit the retry loop
             except Exception as e:
@@ -824,32 +1152,64 @@ class DockerRuntime(ExecutionEnvironment):
                     time.sleep(retry_delay)
                     retry_delay *= 2  # Exponential backoff
                     retry_delay = min(retry_delay, 60)
-                    tar_stream.seek(0)  # Reset the stream for the next attempt
                 else:
                     self.logger.error(f"Copy to container failed after {max_retries} attempts: {str(e)}")
                     raise
 
+    def _put_archive(self, tar_bytes: bytes, dest_dir: str):
+        self.pristine = False
+        if self.backend in ["docker", "local"]:
+            self.container.put_archive(dest_dir, tar_bytes)
+        else:
+            # Kubernetes pod copy
+            self._put_archive_kubernetes(tar_bytes, dest_dir)
+
     def copy_to_container(self, src_path: str, dest_path: str):
         """
-        Copies a file or directory from the host into the container (Docker or Kubernetes).
+        Copies a file or directory from the host into the container (Docker, Kubernetes or local sandbox).
         """
-        if self.backend == "docker":
-            tar_stream = io.BytesIO()
-            with tarfile.open(fileobj=tar_stream, mode="w") as tar:
-                tar.add(src_path, arcname=os.path.basename(dest_path))
-            tar_stream.seek(0)
-            self.container.put_archive(os.path.dirname(dest_path), tar_stream.read())
-        else:
-            # Kubernetes pod copy
-            return self._copy_to_container_kubernetes(src_path, dest_path)
+        tar_stream = io.BytesIO()
+        with tarfile.open(fileobj=tar_stream, mode="w") as tar:
+            tar.add(src_path, arcname=os.path.basename(dest_path))
+        self._put_archive(tar_stream.getvalue(), os.path.dirname(dest_path))
+
+    def copy_files_to_container(
+        self, files: dict[str, str | bytes], mode: int = 0o644, modes: dict[str, int] = None
+    ):
+        """
+        Copies in-memory files into the container in a single archive.
+
+        :param files: mapping {absolute container path: content}.
+        :param mode: file mode used for all files.
+        :param modes: optional per-path file modes overriding `mode`.
+        """
+        modes = modes or {}
+        tar_stream = io.BytesIO()
+        with tarfile.open(fileobj=tar_stream, mode="w") as tar:
+            for path, content in files.items():
+                if isinstance(content, str):
+                    content = content.encode("utf-8")
+                info = tarfile.TarInfo(name=path.lstrip("/"))
+                info.size = len(content)
+                info.mode = modes.get(path, mode)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(content))
+        self._put_archive(tar_stream.getvalue(), "/")
 
     @DeprecationWarning  # TODO: remove dependency on this method with new dockers
     def read_file(self, rel_file_path: str) -> str:
         output, _ = self.run(f"cat /{self.alt_path}/{rel_file_path}")
         return output
 
-    def run_tests(self, timeout: int = 300) -> tuple[str, str]:
-        output, error_code = self.run(f"bash {self.alt_path}/run_tests.sh", timeout=timeout)
+    def run_tests(
+        self, timeout: int = 300, reward_mode: str = "full", reward_shards: int = 1
+    ) -> tuple[str, str]:
+        output, error_code = self._run_reward_tests(
+            f"bash {self.alt_path}/run_tests.sh",
+            timeout=timeout,
+            reward_mode=reward_mode,
+            reward_shards=reward_shards,
+        )
         # Remove ANSI escape codes and \r characters
         output = re.sub(r"\x1b\[[0-9;]*m|\r", "", output)
         return output, error_code
@@ -877,41 +1237,31 @@ class DockerRuntime(ExecutionEnvironment):
         # output, _ = self.run("git diff")
         return output
 
+    def peek_patch(self) -> str:
+        """
+        Same diff as `get_patch`, computed on a scratch copy of the index so that the
+        repo's own index (what `git diff` / `git status` show) is left untouched.
+        """
+        script = (
+            'index=$(mktemp) && cp "$(git rev-parse --git-dir)/index" "$index" && '
+            'GIT_INDEX_FILE="$index" git add -A && GIT_INDEX_FILE="$index" git diff --cached; '
+            'rm -f "$index"'
+        )
+        output, _ = self.run(f"bash -c {shlex.quote(script)}")
+        return output
+
     def create_file(self, file_path: str, content: str) -> tuple[str, str]:
-        # create a local file with the content
-        uuid_ = uuid.uuid4()
-        file_path_ = f"{file_path}_{uuid_}"
-        file_path__ = os.path.join("/tmp", file_path_)
-        with open(file_path__, "w") as f:
-            f.write(content)
-        # copy the file to the container
-        self.copy_to_container(file_path__, f"/testbed/{file_path_}")
-        self.run(f"mv /testbed/{file_path_} /{file_path}")
+        # ship the content straight to /{file_path} in the container
+        self.copy_files_to_container({f"/{file_path.lstrip('/')}": content})
 
     def apply_patch(self, patch: str) -> tuple[str, str]:
-        # store the patch locally in a file identifiable by docker container id and timestamp
-        # must contain unique patch name with both timestamp and docker image name
-        uuid_ = uuid.uuid4()
-        patch_path = f"{self.container_name}_{uuid_}.patch"
-        patch_path = os.path.join("/tmp", patch_path)
-        with open(patch_path, "w") as f:
-            f.write(patch)
-        # copy the patch to / of the container
-        self.copy_to_container(patch_path, f"/{patch_path}")
-        # apply the patch
-        output, error_code = self.run(f"git apply --whitespace=fix /{patch_path}")
+        # pipe the patch into git apply (no patch file on the host or in the container)
+        output, error_code = self.run_with_stdin("git apply --whitespace=fix", patch)
         return output, error_code
 
     def reverse_patch(self, patch: str) -> tuple[str, str]:
-        # store the patch locally in a file identifiable by docker container id and timestamp
-        patch_path = f"{self.container_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.patch"
-        patch_path = os.path.join("/tmp", patch_path)
-        with open(patch_path, "w") as f:
-            f.write(patch)
-        # copy the patch to / of the container
-        self.copy_to_container(patch_path, f"/{patch_path}")
-        # apply the patch
-        output, error_code = self.run(f"git apply -R /{patch_path}")
+        # pipe the patch into git apply -R (no patch file on the host or in the container)
+        output, error_code = self.run_with_stdin("git apply -R", patch)
         return output, error_code
 
     def get_logs_eval(
@@ -958,7 +1308,7 @@ class DockerRuntime(ExecutionEnvironment):
         #     return {}, False
 
         # Get status map of evaluation results
-        content = content.split(test_cmd)[-1]
+        content = content.rpartition(test_cmd)[2]
         self.logger.info(f"using swebench log_parser for repo: {repo}")
         return log_parser(content, test_spec), True
 
@@ -970,51 +1320,77 @@ class DockerRuntime(ExecutionEnvironment):
             return parsed_output
         else:
             return parse_log_fn(f"{self.repo_name}")(log_output)
+
+    def parse_test_results(self, log_output: str) -> dict:
+        """
+        Test status map of the last reward test run: from its structured report if the
+        test script produced one (pytest), from the log otherwise.
+        """
+        if self.last_test_report:
+            return parse_test_report(self.last_test_report)
+        return self.parse_logs(log_output)
     
-    def _calculate_reward_swesmith(self, get_test_output=False, timeout: int = 300) -> float:
+    def _calculate_reward_swesmith(
+        self,
+        get_test_output=False,
+        timeout: int = 300,
+        reward_mode: str = "full",
+        reward_shards: int = 1,
+    ) -> float:
         self.reset_swesmith_tests()
-        output, error_msg = self.run("/run_tests.sh", timeout=timeout)
-        parse = self.parse_logs(output)
-        
+        output, error_msg = self._run_reward_tests(
+            "/run_tests.sh",
+            timeout=timeout,
+            reward_mode=reward_mode,
+            reward_shards=reward_shards,
+        )
+        parse = self.parse_test_results(output)
+        self.last_test_status = parse
+        reward = self._swesmith_reward(parse)
+        if get_test_output:
+            return reward, output
+        return reward
+
+    def _swesmith_reward(self, parse: dict) -> float:
         fail2pass = [ ".".join(line.split("::")[1:]) for line in self.ds['FAIL_TO_PASS']]
         pass2pass = [ ".".join(line.split("::")[1:]) for line in self.ds['PASS_TO_PASS']]
         # @(Naman, Jas): Parse the output and return the reward. This implementation is a hack rn.
         if not parse:
             return 0.0
-        
-        # Check fail2pass
-        for test_name in fail2pass:
-            if test_name not in parse:
-                # Check if test_name is substring of any key
-                matching_key = next((k for k in parse.keys() if test_name in k), None)
-                if matching_key is None:
-                    return 0.0
-                if parse[matching_key] != 'PASSED':
-                    return 0.0
-                test_name = matching_key
-            if parse[test_name] != 'PASSED':
-                return 0.0
-        
-        # Check pass2pass
-        for test_name in pass2pass:
-            if test_name not in parse:
-                # Check if test_name is substring of any key
-                matching_key = next((k for k in parse.keys() if test_name in k), None)
-                if matching_key is None:
-                    return 0.0
-                test_name = matching_key
-            if parse[test_name] != 'PASSED':
-                return 0.0
-        return 1.0
-
-
-    def _calculate_reward_swebench(self, get_test_output=False, timeout: int = 300) -> float:
+
+        # every fail2pass and pass2pass test must pass (names resolved exact / suffix / ... match)
+        matcher = TestNameMatcher(parse)
+        reward = 1.0
+        for test_name in fail2pass + pass2pass:
+            if matcher.status(test_name) != "PASSED":
+                reward = 0.0
+                break
+        self.logger.info(f"Test name matching: {dict(matcher.stats)}")
+        return reward
+
+
+    def _calculate_reward_swebench(
+        self,
+        get_test_output=False,
+        timeout: int = 300,
+        reward_mode: str = "full",
+        reward_shards: int = 1,
+    ) -> float:
         # gt_test_patch = self.commit.get_patch(test_file=True,non_test_file=False)
         # self.apply_patch(gt_test_patch)
-        out, _ = self.run(
-            "/run_tests.sh", timeout=timeout
+        out, _ = self._run_reward_tests(
+            "/run_tests.sh",
+            timeout=timeout,
+            reward_mode=reward_mode,
+            reward_shards=reward_shards,
         )  # run the tests after applying the patch
         eval_status_map, found = self.get_logs_eval(self.test_spec, out)
+        self.last_test_status = eval_status_map
+        # grading uses exact names (as in swebench), the matcher only reports how names resolve
+        matcher = TestNameMatcher(eval_status_map, substring=False)
+        for test_name in list(self.test_spec.FAIL_TO_PASS) + list(self.test_spec.PASS_TO_PASS):
+            matcher.match(test_name)
+        self.logger.info(f"Test name matching: {dict(matcher.stats)}")
         eval_ref = {
             KEY_INSTANCE_ID: self.test_spec.instance_id,
             FAIL_TO_PASS: self.test_spec.FAIL_TO_PASS,
@@ -1025,15 +1401,11 @@ class DockerRuntime(ExecutionEnvironment):
         )
         success = get_resolution_status(report) == ResolvedStatus.FULL.value
         if get_test_output:
-            return success, out
+            return int(success), out
         return int(success)
 
-    def _calculate_reward_r2e(self, get_test_output=False, timeout: int = 300) -> float:
-        # calculate reward based for r2e-edit dockers
-        output, error_code = self.run_tests(timeout=timeout)
-        # print(output)x
-        parse = self.parse_logs(output)
-        parse = decolor_dict_keys(parse)
+    def _expected_test_status(self) -> dict:
+        # expected test status map for r2e-edit dockers
         try:
             expected_json = self.ds["expected_output_json"]
         except Exception as e:
@@ -1041,49 +1413,363 @@ class DockerRuntime(ExecutionEnvironment):
 
         expected: dict = json.loads(expected_json)
         expected = decolor_dict_keys(expected)
+        return {k.split(" - ")[0]: expected[k] for k in sorted(expected.keys())}
+
+    def _calculate_reward_r2e(
+        self,
+        get_test_output=False,
+        timeout: int = 300,
+        reward_mode: str = "full",
+        reward_shards: int = 1,
+    ) -> float:
+        # calculate reward based for r2e-edit dockers
+        output, error_code = self.run_tests(
+            timeout=timeout, reward_mode=reward_mode, reward_shards=reward_shards
+        )
+        # print(output)x
+        parse = self.parse_test_results(output)
+        parse = decolor_dict_keys(parse)
         parse = {k.split(" - ")[0]: parse[k] for k in sorted(parse.keys())}
-        expected = {k.split(" - ")[0]: expected[k] for k in sorted(expected.keys())}
+        self.last_test_status = parse
+        expected = self._expected_test_status()
 
         # Compare
         if len(parse) != len(expected):
             reward = 0.0
         else:
             # If ANY mismatch, reward = 0.0, else = 1.0
+            matcher = TestNameMatcher(expected)
             match = True
             for k in parse.keys():
                 if not k:
                     continue
-                if k not in expected:
-                    match = False
-                    break
-                if parse[k] != expected[k]:
+                if matcher.status(k, fuzzy=False) != parse[k]:
                     match = False
                     break
+            self.logger.info(f"Test name matching: {dict(matcher.stats)}")
             reward = 1.0 if match else 0.0
         # If the caller wants the test output as well, return (reward, output)
         if get_test_output:
             return reward, output
         return reward
 
-    def _calculate_reward(self, get_test_output=False, timeout: int = 300) -> float:
+    def _calculate_reward(
+        self,
+        get_test_output=False,
+        timeout: int = 300,
+        reward_cache=None,
+        reward_mode: str = "full",
+        reward_shards: int = 1,
+    ) -> float:
+        """
+        Run the tests and compute the reward for the current state of the repo.
+
+        :param reward_cache: optional RewardCache consulted first (keyed on the image
+            digest and the current patch) and filled in on a miss.
+        :param reward_mode: "full" runs the whole test script. "targeted" only runs the
+            FAIL_TO_PASS / PASS_TO_PASS tests (F2P first) and stops as soon as the reward
+            is known to be 0 (see r2egym_reward_plugin.py); the test output is then partial.
+        :param reward_shards: number of test shards run concurrently in the container
+            (r2e and swesmith dockers; swebench dockers always run serially).
+        """
+        assert reward_mode in REWARD_MODES, f"Invalid reward mode: {reward_mode}"
+        if reward_cache is not None:
+            key = reward_cache.key(
+                reward_cache.image_digest(self.docker_image, self.backend),
+                self.get_patch(),
+                reward_cache.test_spec(self.ds),
+                kind="reward" if reward_mode == "full" else f"reward_{reward_mode}",
+            )
+            entry = reward_cache.get(key)
+            if entry is not None:
+                self.logger.info(f"Reward cache hit: {entry['reward']}")
+                self.last_test_status = entry["parsed"]
+                if get_test_output:
+                    return entry["reward"], entry["output"]
+                return entry["reward"]
+
+        self.last_test_status = None
         if self.swebench_verified:
-            return self._calculate_reward_swebench(get_test_output=get_test_output, timeout=timeout)
+            reward_fn = self._calculate_reward_swebench
         elif self.swesmith:
-            return self._calculate_reward_swesmith(get_test_output=get_test_output, timeout=timeout)
+            reward_fn = self._calculate_reward_swesmith
         else:
-            return self._calculate_reward_r2e(get_test_output=get_test_output, timeout=timeout)
+            reward_fn = self._calculate_reward_r2e
+        result = reward_fn(
+            get_test_output=True,
+            timeout=timeout,
+            reward_mode=reward_mode,
+            reward_shards=reward_shards,
+        )
+        reward, output = result
+
+        if reward_cache is not None:
+            reward_cache.put(key, reward, parsed=self.last_test_status, output=output)
+        if get_test_output:
+            return reward, output
+        return reward
+
+    def reward_plugin_spec(self) -> dict:
+        """Spec of the targeted reward mode (see r2egym_reward_plugin.py)."""
+        if self.swebench_verified:
+            return {
+                "fail_to_pass": list(self.test_spec.FAIL_TO_PASS),
+                "pass_to_pass": list(self.test_spec.PASS_TO_PASS),
+            }
+        if self.swesmith:
+            return {
+                "fail_to_pass": list(self.ds[FAIL_TO_PASS]),
+                "pass_to_pass": list(self.ds[PASS_TO_PASS]),
+            }
+        # r2e: any extra or missing test changes the reward, so nothing is deselected
+        return {"expected": self._expected_test_status()}
+
+    def _run_reward_tests(
+        self,
+        command: str,
+        timeout: int = 300,
+        reward_mode: str = "full",
+        reward_shards: int = 1,
+    ) -> tuple[str, str]:
+        """
+        Run a test script for the reward with the reward plugin loaded into pytest, which
+        writes a structured report of the results (fetched into `last_test_report`),
+        selects / shards the tests and exits early as per `reward_mode` and `reward_shards`.
+        Falls back to a plain run if the plugin cannot be loaded; non-pytest test scripts
+        simply ignore it (and their results are scraped from the log).
+        """
+        self.last_test_report = None
+        if self.swebench_verified:
+            # swebench run_tests.sh applies / reverts the test patch: not safe to run concurrently,
+            # and the swebench log parsers have their own (per repo) test names
+            if reward_shards > 1:
+                self.logger.warning("Test sharding is not supported for swebench dockers, running serially")
+                reward_shards = 1
+            if reward_mode == "full":
+                return self.run(command, timeout=timeout)
+
+        with open(REWARD_PLUGIN_SOURCE) as f:
+            plugin_source = f.read()
+        spec_path = f"{REWARD_PLUGIN_DIR}/spec.json"
+        spec = self.reward_plugin_spec() if reward_mode == "targeted" else {}
+        self.copy_files_to_container(
+            {
+                f"{REWARD_PLUGIN_DIR}/r2egym_reward_plugin.py": plugin_source,
+                spec_path: json.dumps(spec),
+            }
+        )
+        self.run(f"rm -rf {REWARD_REPORT_DIR} && mkdir -p {REWARD_REPORT_DIR}")
+        plugin_env = (
+            f"R2EGYM_REWARD_SPEC={spec_path} "
+            f"PYTHONPATH={REWARD_PLUGIN_DIR}${{PYTHONPATH:+:$PYTHONPATH}}"
+        )
+        if reward_shards > 1:
+            output, error_code = self._run_sharded_tests(
+                command, plugin_env, reward_shards, timeout=timeout
+            )
+        else:
+            output, error_code = self.run(
+                f'env PYTEST_ADDOPTS="-p r2egym_reward_plugin ${{PYTEST_ADDOPTS:-}}" '
+                f"R2EGYM_REPORT={REWARD_REPORT_DIR}/0.json {plugin_env} {command}",
+                timeout=timeout,
+            )
+        # the plugin creates a marker once loaded: only without it can an import error
+        # in the log be the plugin's (non-pytest test scripts ignore the plugin)
+        markers, _ = self.run(f"ls {REWARD_REPORT_DIR}")
+        plugin_failed = ".loaded" not in markers and (
+            "r2egym_reward_plugin" in output
+            and ("Error importing plugin" in output or "No module named" in output)
+        )
+        if not plugin_failed:
+            if not self.swebench_verified:
+                self.last_test_report = self.read_test_report()
+            return output, error_code
+        self.logger.warning(
+            "Reward plugin could not be loaded, running the full test script"
+        )
+        return self.run(command, timeout=timeout)
+
+    def read_test_report(self) -> Optional[dict]:
+        """
+        Structured {nodeid: status} report of the last reward test run (merged over test
+        shards), fetched in one read. None if the tests did not produce one.
+        """
+        output, error_code = self.run(f"cat {REWARD_REPORT_DIR}/*.json")
+        if error_code != "0":
+            return None
+        report = {}
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            try:
+                report.update(json.loads(line))
+            except json.JSONDecodeError as e:
+                self.logger.warning(f"Invalid test report, parsing the test log instead: {repr(e)}")
+                return None
+        return report or None
+
+    def _run_sharded_tests(
+        self, command: str, plugin_env: str, num_shards: int, timeout: int = 300
+    ) -> tuple[str, str]:
+        """
+        Run `num_shards` copies of a pytest based test script concurrently in the
+        container, each one running a disjoint shard of the tests (R2EGYM_SHARD, see
+        r2egym_reward_plugin.py) with its own basetemp and without the pytest cache.
+        An early exit in one shard stops the others. Returns the merged log.
+        """
+        shard_dir = f"{REWARD_PLUGIN_DIR}/shards"
+        lines = [f"rm -rf {shard_dir} && mkdir -p {shard_dir}"]
+        for i in range(num_shards):
+            addopts = (
+                f"-p r2egym_reward_plugin -p no:cacheprovider "
+                f"--basetemp={shard_dir}/tmp_{i} ${{PYTEST_ADDOPTS:-}}"
+            )
+            lines.append(
+                f'( env PYTEST_ADDOPTS="{addopts}" R2EGYM_SHARD={i}/{num_shards} '
+                f"R2EGYM_STOP_FILE={shard_dir}/stop R2EGYM_REPORT={REWARD_REPORT_DIR}/{i}.json "
+                f"{plugin_env} {command} "
+                f"> {shard_dir}/{i}.log 2>&1; echo $? > {shard_dir}/{i}.rc ) &"
+            )
+        lines.append("wait")
+        for i in range(num_shards):
+            lines.append(
+                f'printf "\\n{SHARD_LOG_MARKER} {i} %s\\n" "$(cat {shard_dir}/{i}.rc)"; '
+                f"cat {shard_dir}/{i}.log"
+            )
+        script_path = f"{REWARD_PLUGIN_DIR}/run_shards.sh"
+        self.copy_files_to_container({script_path: "\n".join(lines) + "\n"}, mode=0o755)
+        output, error_code = self.run(f"bash {script_path}", timeout=timeout)
+        if error_code != "0":
+            return output, error_code
+
+        parts = re.split(rf"\n{SHARD_LOG_MARKER} (\d+) (\d*)\n", output)
+        logs, exit_codes = [], []
+        for i in range(1, len(parts) - 1, 3):
+            exit_codes.append(int(parts[i + 1]) if parts[i + 1] else -1)
+            logs.append(parts[i + 2])
+        output = self.merge_shard_logs(logs)
+        failed = [code for code in exit_codes if code != 0]
+        if failed:
+            self.logger.error(f"Error: Exit code {failed[0]} (test shards: {exit_codes})")
+            return output, f"Error: Exit code {failed[0]}"
+        return output, "0"
+
+    @staticmethod
+    def merge_shard_logs(logs: list[str]) -> str:
+        """
+        Merge pytest logs of test shards into one log with a single "short test summary
+        info" section (the part the log parsers read).
+        """
+        bodies, summaries = [], []
+        for log in logs:
+            body, marker, summary = log.partition("short test summary info")
+            if not marker:
+                bodies.append(log)
+                continue
+            # drop the rest of the "=== short test summary info ===" line
+            bodies.append(body.rstrip("= \n"))
+            summaries.append(summary.partition("\n")[2])
+        merged = "\n".join(bodies)
+        if summaries:
+            merged += (
+                "\n=========================== short test summary info ============================\n"
+                + "\n".join(summaries)
+            )
+        return merged
+
+    def snapshot(self) -> bool:
+        """
+        Record the current state of the repo (working tree, index and HEAD) and of the
+        file editor state, so that `restore` can bring the container back to it in place.
+        The working tree is stored as a git tree object under SNAPSHOT_REF using a scratch
+        index, so the repo's own index and history are left untouched.
+        """
+        script = "\n".join(
+            [
+                "set -e",
+                f"snap={SNAPSHOT_DIR}",
+                'gitdir=$(cd "$(git rev-parse --git-dir)" && pwd)',
+                'rm -rf "$snap" && mkdir -p "$snap"',
+                'cp "$gitdir/HEAD" "$snap/HEAD"',
+                'git rev-parse HEAD > "$snap/commit"',
+                'cp "$gitdir/index" "$snap/index"',
+                'cp "$snap/index" "$snap/work_index"',
+                'GIT_INDEX_FILE="$snap/work_index" git add -A',
+                f'git update-ref {SNAPSHOT_REF} "$(GIT_INDEX_FILE="$snap/work_index" git write-tree)"',
+                f'if [ -f {EDITOR_STATE_FILE} ]; then cp {EDITOR_STATE_FILE} "$snap/editor_state.json"; fi',
+            ]
+        )
+        output, error_code = self.run(f"bash -c {shlex.quote(script)}")
+        if error_code != "0":
+            self.logger.error(f"Failed to snapshot environment: {output}")
+            return False
+        return True
+
+    def restore(self) -> bool:
+        """
+        Restore the state recorded by `snapshot` in place: tracked and untracked (non-ignored)
+        files in the repo, the index, HEAD and the file editor state.
+
+        Returns:
+            True if the container was restored, False otherwise (e.g. no snapshot available).
+        """
+        start_time = time.time()
+        script = "\n".join(
+            [
+                "set -e",
+                f"snap={SNAPSHOT_DIR}",
+                'gitdir=$(cd "$(git rev-parse --git-dir)" && pwd)',
+                f"git rev-parse -q --verify {SNAPSHOT_REF} > /dev/null",
+                # capture the current working tree in a scratch index, then check out the snapshot
+                # tree over it: modified files are reverted and files added since are removed
+                'cp "$snap/index" "$snap/work_index"',
+                'GIT_INDEX_FILE="$snap/work_index" git add -A',
+                f'GIT_INDEX_FILE="$snap/work_index" git read-tree -u --reset {SNAPSHOT_REF}',
+                'cp "$snap/HEAD" "$gitdir/HEAD"',
+                'git reset -q --soft "$(cat "$snap/commit")"',
+                'cp "$snap/index" "$gitdir/index"',
+                f"rm -f {EDITOR_STATE_FILE}",
+                f'if [ -f "$snap/editor_state.json" ]; then cp "$snap/editor_state.json" {EDITOR_STATE_FILE}; fi',
+            ]
+        )
+        output, error_code = self.run(f"bash -c {shlex.quote(script)}")
+        if error_code != "0":
+            self.logger.error(f"Failed to restore environment snapshot: {output}")
+            return False
+        self.pristine = True
+        self.logger.info(
+            f"Restored environment snapshot in {time.time() - start_time:.2f}s"
+        )
+        return True
 
     def reset(self):
+        # restore the post-setup snapshot in place, else restart the container
+        if self.restore():
+            return
         self.stop_container()
         self.start_container(
             self.docker_image, self.command, self.container_name, **self.docker_kwargs
         )
 
     def close(self):
+        if self.session is not None:
+            self.session.close()
         self.stop_container()
         if self.backend == "docker":
             self.client.close()
 
+    def detach(self) -> str:
+        """
+        Release this handle without stopping the container, so that another process can
+        attach to it by name (e.g. `DockerRuntime(ds, container_name=...)`).
+        Returns the container name.
+        """
+        if self.session is not None:
+            self.session.close()
+        if self.backend == "docker":
+            self.client.close()
+        return self.container_name
+
     def run_swebv_regression(
         self, run_tests_regression: str | None = None, timeout: int = 300
     ) -> dict[str, str]:
@@ -1092,12 +1778,10 @@ class DockerRuntime(ExecutionEnvironment):
         if run_tests_regression is None:
             run_tests_regression = self.ds["run_tests_regression"]
 
-        with tempfile.NamedTemporaryFile("w") as f:
-            f.write(run_tests_regression)
-            f.flush()
-            self.copy_to_container(f.name, "/run_tests_regression.sh")
-        # make the script executable
-        self.run("chmod +x /run_tests_regression.sh")
+        # ship the script as an executable file
+        self.copy_files_to_container(
+            {"/run_tests_regression.sh": run_tests_regression}, mode=0o755
+        )
 
         # run the regression tests
         output, error_code = self.run("/run_tests_regression.sh", timeout=timeout)
@@ -0,0 +1,205 @@
+import time
+import threading
+import contextlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import docker
+
+from r2egym.agenthub.utils.log import get_logger
+
+
+##############################################################################
+# Local image cache
+##############################################################################
+class ImageCache:
+    """
+    Keeps the local docker images of a run within a disk budget.
+
+    Images are registered as needed by queued instances (`need`) and released once an
+    instance is done with them (`release`). Images in use are pinned (`pin` / `pinned`),
+    e.g. for as long as a container from them is live. Whenever the layers on disk exceed
+    `disk_budget_gb`, the least recently used images that are neither needed, pinned nor
+    used by any container on the host are removed, down to `low_watermark` of the budget.
+
+    Sizes come from the engine's disk usage report (`docker system df`): an image only frees
+    its unique layers (Size - SharedSize), and usage is re-read after every round of
+    removals since removing an image can make another image's layers unique.
+
+    Only images this cache has seen (needed / pulled) are evicted, unless `evict_untracked`.
+
+    Usage:
+        cache = ImageCache(disk_budget_gb=200)
+        cache.need(DockerRuntime.resolve_docker_image(ds) for ds in ds_selected)
+        image = DockerRuntime.resolve_docker_image(ds)
+        with cache.pinned(image):
+            cache.ensure(image)
+            ...  # run the instance
+        cache.release(image)
+    """
+
+    def __init__(
+        self,
+        disk_budget_gb: float,
+        low_watermark: float = 0.9,
+        evict_untracked: bool = False,
+        client=None,
+        logger=None,
+    ):
+        self.disk_budget = int(disk_budget_gb * 1024**3)
+        self.low_watermark = low_watermark
+        self.evict_untracked = evict_untracked
+        self.client = client if client is not None else docker.from_env(timeout=600)
+        if logger is None:
+            self.logger = get_logger("ImageCache")
+        else:
+            self.logger = logger
+        # image -> number of queued / running instances that need it
+        self._needed: Counter = Counter()
+        # image -> number of pins (live containers, pulls in progress)
+        self._pinned: Counter = Counter()
+        self._last_used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # eviction reads the disk usage of the whole engine: one pass at a time
+        self._evict_lock = threading.Lock()
+
+    ####################################################################
+    # Bookkeeping
+    ####################################################################
+    def need(self, images: Iterable[str]) -> None:
+        """Register images needed by queued instances (once per instance)."""
+        with self._lock:
+            for image in images:
+                self._needed[image] += 1
+                self._last_used.setdefault(image, 0.0)
+
+    def release(self, image: str, evict: bool = True) -> None:
+        """An instance is done with `image`: it may be evicted once no other instance needs it."""
+        with self._lock:
+            self._needed[image] -= 1
+            if self._needed[image] <= 0:
+                del self._needed[image]
+            self._last_used[image] = time.time()
+        if evict:
+            self.evict()
+
+    def pin(self, image: str) -> None:
+        with self._lock:
+            self._pinned[image] += 1
+            self._last_used[image] = time.time()
+
+    def unpin(self, image: str) -> None:
+        with self._lock:
+            self._pinned[image] -= 1
+            if self._pinned[image] <= 0:
+                del self._pinned[image]
+            self._last_used[image] = time.time()
+
+    @contextlib.contextmanager
+    def pinned(self, image: str):
+        self.pin(image)
+        try:
+            yield
+        finally:
+            self.unpin(image)
+
+    ####################################################################
+    # Pull / evict
+    ####################################################################
+    def is_local(self, image: str) -> bool:
+        try:
+            self.client.images.get(image)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+
+    def ensure(self, image: str) -> bool:
+        """
+        Make sure `image` is available locally (pulling it if needed), then evict other
+        images if the budget is exceeded. Returns False if the pull failed.
+        """
+        with self.pinned(image):
+            if not self.is_local(image):
+                try:
+                    self.logger.info(f"Pulling Docker image: {image}")
+                    self.client.images.pull(image)
+                except Exception as e:
+                    self.logger.error(f"Failed to pull Docker image {image}: {repr(e)}")
+                    return False
+            self.evict()
+        return True
+
+    def _protected(self) -> set:
+        with self._lock:
+            protected = set(self._needed) | set(self._pinned)
+        # containers of any process on the host (e.g. rollout workers, warm pools)
+        for container in self.client.containers.list(all=True):
+            protected.add(container.attrs.get("Image", ""))
+            protected.add(container.attrs.get("Config", {}).get("Image", ""))
+        return protected
+
+    def _candidates(self, df_images: List[dict], protected: set) -> List[dict]:
+        with self._lock:
+            tracked = set(self._last_used)
+            last_used = dict(self._last_used)
+        candidates = []
+        for image in df_images:
+            names = set(image.get("RepoTags") or [])
+            if image["Id"] in protected or names & protected:
+                continue
+            if image.get("Containers", 0) > 0:
+                continue
+            if not self.evict_untracked and not names & tracked:
+                continue
+            used = max([last_used.get(name, 0.0) for name in names] or [0.0])
+            candidates.append((used, image.get("Created", 0), image))
+        candidates.sort(key=lambda x: (x[0], x[1]))
+        return [image for _, _, image in candidates]
+
+    def evict(self) -> List[str]:
+        """Remove least recently used images until the layers on disk fit in the budget."""
+        removed = []
+        with self._evict_lock:
+            while True:
+                try:
+                    usage = self.client.df()
+                except Exception as e:
+                    self.logger.error(f"Could not read docker disk usage: {repr(e)}")
+                    return removed
+                total = usage.get("LayersSize") or 0
+                if total <= self.disk_budget:
+                    return removed
+                target = total - int(self.disk_budget * self.low_watermark)
+                candidates = self._candidates(usage.get("Images") or [], self._protected())
+                if not candidates:
+                    self.logger.warning(
+                        f"Docker images use {total / 1024**3:.1f}GB (budget: "
+                        f"{self.disk_budget / 1024**3:.1f}GB) but none can be evicted"
+                    )
+                    return removed
+                freed = 0
+                removed_round = 0
+                for image in candidates:
+                    if freed >= target:
+                        break
+                    # untag one name at a time (removing a multi-tagged image by id needs force)
+                    names = image.get("RepoTags") or [image["Id"]]
+                    try:
+                        for name in names:
+                            self.client.images.remove(name)
+                    except Exception as e:
+                        # e.g. a container was started from it in the meantime
+                        self.logger.warning(f"Could not remove image {image['Id']}: {repr(e)}")
+                        continue
+                    with self._lock:
+                        for name in names:
+                            self._last_used.pop(name, None)
+                    removed.extend(names)
+                    removed_round += 1
+                    # only the layers no other image shares are freed
+                    freed += max(image.get("Size", 0) - max(image.get("SharedSize", 0), 0), 0)
+                self.logger.info(
+                    f"Evicted {removed_round} Docker images (~{freed / 1024**3:.1f}GB)"
+                )
+                if removed_round == 0:
+                    return removed
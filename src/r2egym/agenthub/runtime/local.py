@@ -0,0 +1,176 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+from r2egym.agenthub.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# exported image roots, one directory per docker image (see `export_local_root`)
+LOCAL_ROOTS_DIR = os.environ.get(
+    "R2EGYM_LOCAL_ROOTS", os.path.expanduser("~/.cache/r2egym/local_roots")
+)
+# per-instance copy-on-write copies of the roots
+LOCAL_SANDBOXES_DIR = os.environ.get(
+    "R2EGYM_LOCAL_SANDBOXES", os.path.join(tempfile.gettempdir(), "r2egym_sandboxes")
+)
+# paths of an image exported by default (those missing from the image are skipped):
+# the repo and its venv / conda env, the hidden tests, the test script and the image's tools
+LOCAL_ROOT_PATHS = [
+    "/testbed",
+    "/root",
+    "/r2e_tests",
+    "/run_tests.sh",
+    "/opt/miniconda3",
+    "/usr/local/bin",
+]
+# the OS (shell, git, coreutils, ...) comes from the host, read-only
+HOST_SYSTEM_DIRS = ["/usr", "/bin", "/sbin", "/lib", "/lib32", "/lib64", "/libx32", "/etc"]
+# ... except for these, taken from the sandbox (the agent's tools are installed there)
+SANDBOX_OVERLAY_DIRS = ["/usr/local/bin"]
+
+
+def _extract(data: bytes, dest: str) -> None:
+    # trusted archives (images, our own files): keep absolute symlinks, e.g. of venvs
+    kwargs = {"filter": "fully_trusted"} if hasattr(tarfile, "fully_trusted_filter") else {}
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        tar.extractall(dest, **kwargs)
+
+
+def local_root_dir(docker_image: str) -> str:
+    """Directory of the exported root of a docker image."""
+    return os.path.join(LOCAL_ROOTS_DIR, docker_image.replace("/", "_").replace(":", "_"))
+
+
+def export_local_root(
+    docker_image: str,
+    paths: Optional[List[str]] = None,
+    root_dir: Optional[str] = None,
+    client=None,
+) -> str:
+    """
+    Export the paths of a docker image the runtime uses (by default `LOCAL_ROOT_PATHS`)
+    into a local root for the "local" backend. Needs docker once; the root is then
+    reused by any number of sandboxes without a daemon. Returns the root directory.
+    """
+    import docker
+
+    root_dir = root_dir or local_root_dir(docker_image)
+    client = client or docker.from_env(timeout=600)
+    container = client.containers.create(docker_image, "/bin/true")
+    staging = f"{root_dir}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        for path in paths or LOCAL_ROOT_PATHS:
+            try:
+                stream, _ = container.get_archive(path)
+            except docker.errors.NotFound:
+                continue
+            dest = os.path.join(staging, os.path.dirname(path).lstrip("/"))
+            os.makedirs(dest, exist_ok=True)
+            _extract(b"".join(stream), dest)
+            logger.info(f"Exported {docker_image}:{path}")
+    finally:
+        container.remove(force=True)
+    shutil.rmtree(root_dir, ignore_errors=True)
+    os.rename(staging, root_dir)
+    return root_dir
+
+
+##############################################################################
+# Local sandbox
+##############################################################################
+class LocalSandbox:
+    """
+    "Container" of the local backend: a copy-on-write copy (`cp --reflink=auto`, a plain
+    copy on filesystems without reflinks) of an exported image root, in which commands
+    run under bubblewrap with the sandbox as `/`. The container paths (/testbed, /root,
+    /run_tests.sh, ...) are thus the same as in docker, while the OS comes from the host
+    (`HOST_SYSTEM_DIRS`, read-only). No daemon and no privileges are needed.
+
+    Mirrors the part of the docker Container API used by DockerRuntime
+    (`id`, `status`, `start`, `stop`, `remove`, `put_archive`).
+
+    Processes started by a command do not outlive it (no background servers between
+    commands); the network is shared with the host.
+    """
+
+    def __init__(self, root_dir: str, sandbox_dir: str):
+        self.root_dir = root_dir
+        self.path = sandbox_dir
+        self.id = sandbox_dir
+        self.status = "running"
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.path)
+
+    def create(self) -> None:
+        if shutil.which("bwrap") is None:
+            raise RuntimeError("The local backend needs bubblewrap (bwrap) on the PATH")
+        if not os.path.isdir(self.root_dir):
+            raise RuntimeError(
+                f"No local root at {self.root_dir}: export it with `export_local_root`"
+            )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        subprocess.run(
+            ["cp", "-a", "--reflink=auto", self.root_dir, self.path],
+            check=True,
+            capture_output=True,
+        )
+        # mount points of the host system directories (symlinks, e.g. /bin -> usr/bin, are copied)
+        for path in HOST_SYSTEM_DIRS:
+            target = self.host_path(path)
+            if os.path.islink(path):
+                if not os.path.lexists(target):
+                    os.symlink(os.readlink(path), target)
+            elif os.path.isdir(path):
+                os.makedirs(target, exist_ok=True)
+        for path in SANDBOX_OVERLAY_DIRS + ["/tmp", "/var/tmp", "/proc", "/dev"]:
+            os.makedirs(self.host_path(path), exist_ok=True)
+        os.chmod(self.host_path("/tmp"), 0o1777)
+        os.chmod(self.host_path("/var/tmp"), 0o1777)
+
+    def host_path(self, path: str) -> str:
+        """Host path of a path in the sandbox."""
+        return os.path.join(self.path, path.lstrip("/"))
+
+    def command(
+        self, argv: List[str], workdir: str = "/", environment: Optional[Dict[str, str]] = None
+    ) -> List[str]:
+        """Host command line running `argv` in the sandbox."""
+        args = ["bwrap", "--die-with-parent", "--unshare-pid", "--bind", self.path, "/"]
+        for path in HOST_SYSTEM_DIRS:
+            if os.path.isdir(path) and not os.path.islink(path):
+                args += ["--ro-bind", path, path]
+        for path in SANDBOX_OVERLAY_DIRS:
+            if os.path.isdir(path):
+                args += ["--bind", self.host_path(path), path]
+        args += ["--proc", "/proc", "--dev", "/dev", "--clearenv"]
+        for key, value in {"HOME": "/root", **(environment or {})}.items():
+            args += ["--setenv", key, str(value)]
+        args += ["--chdir", workdir, "--"]
+        return args + list(argv)
+
+    def put_archive(self, path: str, data: bytes) -> bool:
+        _extract(data, self.host_path(path))
+        return True
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def remove(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    from fire import Fire
+
+    Fire({"export": export_local_root})
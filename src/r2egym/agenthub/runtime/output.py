@@ -0,0 +1,78 @@
+import re
+from typing import Optional
+
+ANSI_ESCAPE_RE = re.compile(r"\x1b\[[0-9;]*m|\r")
+
+
+##############################################################################
+# Bounded output capture
+##############################################################################
+class OutputCapture:
+    """
+    File-like sink for streamed command output that keeps at most `head_bytes` from the
+    start and `tail_bytes` from the end of the stream, plus total byte / line counts, so
+    that memory per command is bounded regardless of how much the command prints.
+
+    `head_bytes=None` keeps everything (no truncation).
+
+    Usage:
+        capture = OutputCapture(head_bytes=1024, tail_bytes=1024)
+        for chunk in stream:
+            capture.write(chunk)
+        output = capture.getvalue(strip_ansi=True)
+    """
+
+    def __init__(self, head_bytes: Optional[int] = None, tail_bytes: Optional[int] = None):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes or 0
+        self._head = bytearray()
+        self._tail = bytearray()
+        self.total_bytes = 0
+        self.total_lines = 0
+
+    def write(self, data: bytes) -> None:
+        if not data:
+            return
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.total_bytes += len(data)
+        self.total_lines += data.count(b"\n")
+        if self.head_bytes is None:
+            self._head += data
+            return
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if data and self.tail_bytes:
+            self._tail += data
+            # trim lazily so that appends stay amortized O(1) (buffer stays < 2 * tail_bytes)
+            if len(self._tail) > 2 * self.tail_bytes:
+                del self._tail[: len(self._tail) - self.tail_bytes]
+
+    @property
+    def omitted_bytes(self) -> int:
+        return self.total_bytes - len(self._head) - min(len(self._tail), self.tail_bytes)
+
+    @property
+    def truncated(self) -> bool:
+        return self.omitted_bytes > 0
+
+    def getvalue(self, strip_ansi: bool = False) -> str:
+        """Decoded output, with a marker in place of the omitted middle part (if any)."""
+        head = self._head.decode("utf-8", errors="replace")
+        tail = bytes(self._tail[-self.tail_bytes :] if self.tail_bytes else b"")
+        tail = tail.decode("utf-8", errors="replace")
+        if self.truncated:
+            output = (
+                f"{head}\n"
+                f"<< {self.omitted_bytes} bytes omitted from the middle of the output "
+                f"({self.total_bytes} bytes, {self.total_lines} lines in total) >>\n"
+                f"{tail}"
+            )
+        else:
+            output = head + tail
+        if strip_ansi:
+            # Remove ANSI escape codes and \r characters
+            output = ANSI_ESCAPE_RE.sub("", output)
+        return output
@@ -0,0 +1,128 @@
+import threading
+import concurrent.futures
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+from r2egym.agenthub.runtime.docker import DockerRuntime
+from r2egym.agenthub.utils.log import get_logger
+
+
+##############################################################################
+# Warm container pool
+##############################################################################
+class ContainerPool:
+    """
+    Keeps pre-started, already `setup_env`'d containers for upcoming dataset entries
+    and hands them out on demand.
+
+    Containers are warmed in background threads of the current process. A warm
+    container is handed out by name (see `acquire`) so that it can be attached to from
+    any process with `DockerRuntime(ds, container_name=name)` / `RepoEnv(..., container_name=name)`
+    which then skips the cold start and `setup_env`.
+
+    Usage:
+        with ContainerPool(backend="docker") as pool:
+            pool.warm(ds_entry)
+            ...
+            container_name = pool.acquire(ds_entry)  # None -> cold start as usual
+    """
+
+    def __init__(
+        self,
+        backend: str = "docker",
+        max_warming: int = 4,
+        command=["/bin/bash", "-l"],
+        logger=None,
+        **docker_kwargs,
+    ):
+        self.backend = backend
+        self.command = command
+        self.docker_kwargs = docker_kwargs
+        if logger is None:
+            self.logger = get_logger("ContainerPool")
+        else:
+            self.logger = logger
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_warming)
+        # image -> queue of futures resolving to warm DockerRuntime handles
+        self._pending: Dict[str, deque] = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @staticmethod
+    def image_key(ds: dict) -> str:
+        return ds["docker_image"] if "docker_image" in ds else ds["image_name"]
+
+    def _start_warm(self, ds: dict) -> DockerRuntime:
+        return DockerRuntime(
+            ds=ds,
+            command=self.command,
+            logger=self.logger,
+            backend=self.backend,
+            **self.docker_kwargs,
+        )
+
+    def warm(self, ds: dict, n: int = 1) -> None:
+        """Start warming `n` containers for the image of the given dataset entry."""
+        with self._lock:
+            if self._closed:
+                return
+            for _ in range(n):
+                future = self._executor.submit(self._start_warm, ds)
+                self._pending[self.image_key(ds)].append(future)
+
+    def num_warm(self, ds: dict) -> int:
+        """Number of containers (ready or still warming) held for the image of `ds`."""
+        with self._lock:
+            return len(self._pending.get(self.image_key(ds), ()))
+
+    def ready(self, ds: dict) -> bool:
+        """Whether `acquire(ds)` returns without waiting (no container held, or it is warm)."""
+        with self._lock:
+            queue = self._pending.get(self.image_key(ds))
+            return not queue or queue[0].done()
+
+    def acquire(self, ds: dict, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Hand out a warm container for the image of `ds`, waiting for it to finish warming if needed.
+
+        Returns:
+            The container name to attach to, or None if no container is held for this image
+            (or warming it failed), in which case the caller should start one as usual.
+        """
+        with self._lock:
+            queue = self._pending.get(self.image_key(ds))
+            if not queue:
+                return None
+            future = queue.popleft()
+        try:
+            runtime = future.result(timeout=timeout)
+        except Exception as e:
+            self.logger.error(
+                f"Failed to warm container for {self.image_key(ds)}: {repr(e)}"
+            )
+            return None
+        if runtime.container is None:
+            runtime.close()
+            return None
+        return runtime.detach()
+
+    def close(self) -> None:
+        """Stop all containers that were warmed but never handed out."""
+        with self._lock:
+            self._closed = True
+            futures = [f for queue in self._pending.values() for f in queue]
+            self._pending.clear()
+        for future in futures:
+            if future.cancel():
+                continue
+            try:
+                future.result().close()
+            except Exception as e:
+                self.logger.error(f"Error closing warm container: {repr(e)}")
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,146 @@
+import time
+import random
+import threading
+import concurrent.futures
+from typing import Dict, Optional
+
+import docker
+
+from r2egym.agenthub.utils.log import get_logger
+
+
+##############################################################################
+# Image prefetch
+##############################################################################
+class ImagePrefetcher:
+    """
+    Pulls docker images in background threads ahead of the instances that need them, so
+    that rollouts start right away and only wait for their own image.
+
+    At most `max_concurrent_pulls` pulls run at a time. A failed pull is retried with
+    exponential backoff (with jitter); registry rate limiting (HTTP 429 / toomanyrequests)
+    pauses all pulls for the backoff period. If an ImageCache is given, images are pinned
+    while being pulled and the cache evicts as needed after each pull. Images are the ones
+    that are started (see `DockerRuntime.resolve_docker_image`), not `ds["docker_image"]`.
+
+    Usage:
+        with ImagePrefetcher(max_concurrent_pulls=4) as prefetcher:
+            for ds_entry in upcoming:
+                prefetcher.prefetch(DockerRuntime.resolve_docker_image(ds_entry))
+            ...
+            prefetcher.wait(DockerRuntime.resolve_docker_image(ds_entry))  # before starting the instance
+    """
+
+    def __init__(
+        self,
+        max_concurrent_pulls: int = 4,
+        retries: int = 5,
+        backoff: float = 5.0,
+        max_backoff: float = 300.0,
+        image_cache=None,
+        client=None,
+        logger=None,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.image_cache = image_cache
+        self.client = client if client is not None else docker.from_env(timeout=600)
+        if logger is None:
+            self.logger = get_logger("ImagePrefetcher")
+        else:
+            self.logger = logger
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_pulls
+        )
+        # image -> future resolving to whether the image is available locally
+        self._futures: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        # no pull starts before this time (registry rate limiting)
+        self._not_before = 0.0
+
+    def prefetch(self, image: str) -> None:
+        """Start pulling `image` in the background (no-op if already pulled / pulling)."""
+        with self._lock:
+            if image not in self._futures:
+                self._futures[image] = self._executor.submit(self._pull, image)
+
+    def ready(self, image: str) -> bool:
+        """Whether `wait(image)` returns without waiting (starts prefetching it if needed)."""
+        self.prefetch(image)
+        with self._lock:
+            return self._futures[image].done()
+
+    def wait(self, image: str, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until `image` is available locally, pulling it now if it was not prefetched.
+        Returns False if the pull failed (the caller can still fall back to an implicit pull).
+        """
+        self.prefetch(image)
+        with self._lock:
+            future = self._futures[image]
+        try:
+            success = future.result(timeout=timeout)
+        except Exception as e:
+            self.logger.error(f"Failed to prefetch Docker image {image}: {repr(e)}")
+            success = False
+        with self._lock:
+            # the next instance with this image checks again (it may have been evicted since)
+            if self._futures.get(image) is future:
+                del self._futures[image]
+        return success
+
+    def _is_local(self, image: str) -> bool:
+        try:
+            self.client.images.get(image)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+
+    def _pull(self, image: str) -> bool:
+        if self.image_cache is not None:
+            self.image_cache.pin(image)
+        try:
+            if self._is_local(image):
+                return True
+            for attempt in range(self.retries + 1):
+                delay = self._not_before - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    self.logger.info(f"Pulling Docker image: {image}")
+                    self.client.images.pull(image)
+                    return True
+                except docker.errors.NotFound as e:
+                    self.logger.error(f"Docker image {image} not found: {repr(e)}")
+                    return False
+                except Exception as e:
+                    if attempt == self.retries:
+                        self.logger.error(f"Failed to pull Docker image {image}: {repr(e)}")
+                        return False
+                    delay = min(self.backoff * 2**attempt, self.max_backoff)
+                    delay *= 1 + random.random() / 2
+                    message = str(e).lower()
+                    if "toomanyrequests" in message or "429" in message:
+                        # back off all pulls, not only this one
+                        with self._lock:
+                            self._not_before = max(self._not_before, time.time() + delay)
+                    self.logger.warning(
+                        f"Pull of {image} failed (attempt {attempt + 1}), retrying in {delay:.0f}s: {repr(e)}"
+                    )
+                    time.sleep(delay)
+            return False
+        finally:
+            if self.image_cache is not None:
+                self.image_cache.unpin(image)
+                self.image_cache.evict()
+
+    def close(self) -> None:
+        """Cancel the pulls that have not started yet and wait for the running ones."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
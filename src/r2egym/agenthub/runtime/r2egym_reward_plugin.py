@@ -0,0 +1,220 @@
+"""
+pytest plugin for the "targeted" reward mode and sharded reward runs of DockerRuntime.
+
+It is shipped into the container and enabled with `-p r2egym_reward_plugin`, so it
+must stay importable by any test interpreter in the images (python >= 3.5, no
+dependencies besides pytest).
+
+The spec is read from the JSON file at $R2EGYM_REWARD_SPEC:
+    {"fail_to_pass": [nodeid, ...], "pass_to_pass": [nodeid, ...]}
+        only run these tests, FAIL_TO_PASS first, and stop at the first one that fails
+    {"expected": {test_key: status, ...}}
+        run everything, stop at the first test whose outcome differs from the expected one
+    {}
+        no selection / early exit (e.g. for sharding only)
+
+$R2EGYM_SHARD=i/n only runs the i-th of n shards of the (selected) tests, and
+$R2EGYM_STOP_FILE is created on early exit and polled, so that concurrent shards stop together.
+
+$R2EGYM_REPORT is the path of a structured report written at the end of the session: one
+line of JSON {nodeid: "PASSED" | "FAILED" | "ERROR"}, with the same statuses (and
+precedence) as the "short test summary info" section the log parsers read; the empty
+marker file $R2EGYM_REPORT.loaded is created as soon as the plugin is configured.
+"""
+import json
+import os
+
+_state = {"spec": None, "session": None, "relevant": None, "report": {}}
+
+# a test can report several outcomes (call + teardown): keep the one the log parsers would see last
+_REPORT_RANK = {"PASSED": 0, "ERROR": 1, "FAILED": 2}
+
+
+def _load_spec():
+    path = os.environ.get("R2EGYM_REWARD_SPEC")
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _test_key(nodeid):
+    # same key as the r2e log parser: "TestClass.test_name[param]"
+    return ".".join(nodeid.split("::")[1:])
+
+
+def _basename(nodeid):
+    return nodeid.rsplit("/", 1)[-1]
+
+
+def _index(test_ids):
+    index = {}
+    for test_id in test_ids:
+        index.setdefault(_basename(test_id), []).append(test_id)
+    return index
+
+
+def _matches(nodeid, index):
+    # test ids may be relative to a different directory than pytest's rootdir
+    for test_id in index.get(_basename(nodeid), ()):
+        if (
+            nodeid == test_id
+            or nodeid.endswith("/" + test_id)
+            or test_id.endswith("/" + nodeid)
+        ):
+            return True
+    return False
+
+
+def _status(report):
+    if report.when == "call":
+        if getattr(report, "wasxfail", None) is not None:
+            # XPASS (non-strict) is not a PASSED line of the summary: not recorded, as in the log
+            return "XFAIL" if report.skipped else "XPASS"
+        return report.outcome.upper()
+    if report.failed:
+        return "ERROR"
+    return None
+
+
+def _select(items, spec):
+    """Relevant tests (FAIL_TO_PASS first), or all items if the ids do not match this collection."""
+    fail_to_pass = _index(spec["fail_to_pass"])
+    pass_to_pass = _index(spec["pass_to_pass"])
+    first, second = [], []
+    for item in items:
+        if _matches(item.nodeid, fail_to_pass):
+            first.append(item)
+        elif _matches(item.nodeid, pass_to_pass):
+            second.append(item)
+    if not first and not second:
+        return items
+    _state["relevant"] = set(item.nodeid for item in first + second)
+    return first + second
+
+
+def _shard(items, index, count):
+    """
+    Tests of shard `index` out of `count`. Tests of a file stay together (so module
+    fixtures run once per shard) unless the file is larger than a shard's fair share;
+    chunks are assigned greedily, largest first, to the least loaded shard.
+    Every shard computes the same partition from the same collection.
+    """
+    chunk_size = max(1, -(-len(items) // count))
+    modules = {}
+    order = []
+    for item in items:
+        module = item.nodeid.split("::")[0]
+        if module not in modules:
+            modules[module] = []
+            order.append(module)
+        modules[module].append(item)
+    chunks = []
+    for module in order:
+        module_items = modules[module]
+        for start in range(0, len(module_items), chunk_size):
+            chunks.append(module_items[start : start + chunk_size])
+    loads = [0] * count
+    keep = set()
+    for position, chunk in sorted(enumerate(chunks), key=lambda x: (-len(x[1]), x[0])):
+        target = loads.index(min(loads))
+        loads[target] += len(chunk)
+        if target == index:
+            keep.update(id(item) for item in chunk)
+    return [item for item in items if id(item) in keep]
+
+
+def _record(nodeid, status):
+    if status not in _REPORT_RANK:
+        return
+    current = _state["report"].get(nodeid)
+    if current is None or _REPORT_RANK[status] > _REPORT_RANK[current]:
+        _state["report"][nodeid] = status
+
+
+def _stop(session, reason):
+    session.shouldstop = reason
+    stop_file = os.environ.get("R2EGYM_STOP_FILE")
+    if stop_file:
+        try:
+            open(stop_file, "a").close()
+        except OSError:
+            pass
+
+
+def pytest_configure(config):
+    _state["spec"] = _load_spec()
+    # marker of a loaded plugin (tells a plugin load failure apart from test import errors)
+    path = os.environ.get("R2EGYM_REPORT")
+    if path:
+        open(path + ".loaded", "w").close()
+
+
+def pytest_sessionstart(session):
+    _state["session"] = session
+
+
+def pytest_collection_modifyitems(session, config, items):
+    spec = _state["spec"] or {}
+    selected = items
+    if "fail_to_pass" in spec:
+        selected = _select(items, spec)
+    shard = os.environ.get("R2EGYM_SHARD")
+    if shard:
+        index, count = [int(x) for x in shard.split("/")]
+        selected = _shard(selected, index, count)
+    if selected is items:
+        return
+    keep = set(id(item) for item in selected)
+    deselected = [item for item in items if id(item) not in keep]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+    items[:] = selected
+
+
+def pytest_collectreport(report):
+    if report.failed:
+        _record(report.nodeid, "ERROR")
+
+
+def pytest_runtest_logreport(report):
+    spec = _state["spec"]
+    session = _state["session"]
+    _record(report.nodeid, _status(report))
+    if session is None:
+        return
+    # status words are lowercase in the stop reasons so that log parsers do not pick them up
+    stop_file = os.environ.get("R2EGYM_STOP_FILE")
+    if stop_file and os.path.exists(stop_file):
+        session.shouldstop = "r2egym: stopped by another shard, the reward is 0"
+        return
+    status = _status(report)
+    if not spec or status is None:
+        return
+    if "fail_to_pass" in spec:
+        relevant = _state["relevant"]
+        if relevant is not None and report.nodeid in relevant and status in ("FAILED", "ERROR"):
+            _stop(session, "r2egym: {} {}, the reward is 0".format(report.nodeid, status.lower()))
+    elif "expected" in spec:
+        expected = spec["expected"].get(_test_key(report.nodeid))
+        if (
+            expected in ("PASSED", "FAILED")
+            and status in ("PASSED", "FAILED")
+            and expected != status
+        ):
+            _stop(
+                session,
+                "r2egym: {} {} (expected {}), the reward is 0".format(
+                    report.nodeid, status.lower(), expected.lower()
+                ),
+            )
+
+
+def pytest_sessionfinish(session, exitstatus):
+    path = os.environ.get("R2EGYM_REPORT")
+    if not path:
+        return
+    # write + rename, so that a reader never sees a partial report
+    with open(path + ".tmp", "w") as f:
+        f.write(json.dumps(_state["report"]) + "\n")
+    os.rename(path + ".tmp", path)
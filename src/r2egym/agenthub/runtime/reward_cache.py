@@ -0,0 +1,220 @@
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import contextlib
+import hashlib
+from typing import Any, Dict, Optional
+
+import docker
+
+from r2egym.agenthub.utils.log import get_logger
+
+# dataset fields that (together with the image and the patch) determine the test outcome
+TEST_SPEC_FIELDS = [
+    "FAIL_TO_PASS",
+    "PASS_TO_PASS",
+    "expected_output_json",
+    "test_patch",
+    "image_name",
+]
+
+
+def normalize_patch(patch: str) -> str:
+    """
+    Canonical form of a unified diff, so that equivalent patches hash the same:
+    line endings and trailing whitespace are normalized, `index` lines (blob hashes
+    and modes) are dropped and per-file blocks are sorted by path.
+    """
+    if not patch:
+        return ""
+    lines = [line.rstrip() for line in patch.replace("\r\n", "\n").split("\n")]
+    blocks = []
+    for line in lines:
+        if line.startswith("diff --git ") or not blocks:
+            blocks.append([])
+        if re.match(r"^index [0-9a-f]+\.\.[0-9a-f]+", line):
+            continue
+        blocks[-1].append(line)
+    blocks = ["\n".join(block).strip("\n") for block in blocks]
+    return "\n".join(sorted(block for block in blocks if block)) + "\n"
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+##############################################################################
+# Reward cache
+##############################################################################
+class RewardCache:
+    """
+    Persistent, content-addressed cache of test outcomes, keyed on
+    (image digest, normalized patch, test script). Entries hold the reward, the parsed
+    test status map and the test output.
+
+    Backed by a sqlite database in `cache_dir` (safe to share between processes); the
+    least recently used entries are evicted once the stored size exceeds `max_size_mb`.
+
+    Usage:
+        cache = RewardCache("~/.cache/r2egym/rewards")
+        key = cache.key_for(ds, patch)
+        entry = cache.get(key)
+        if entry is None:
+            ...  # run the tests
+            cache.put(key, reward, parsed=test_map, output=test_output)
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: int = 2048, logger=None):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db_path = os.path.join(self.cache_dir, "rewards.sqlite")
+        self.max_size = max_size_mb * 1024 * 1024
+        if logger is None:
+            self.logger = get_logger("RewardCache")
+        else:
+            self.logger = logger
+        # image name -> digest (resolved once per process)
+        self._digests: Dict[str, str] = {}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, reward REAL, parsed TEXT, output BLOB, "
+                "size INTEGER, last_access REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one short-lived connection (and transaction) per operation: safe across processes
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    ####################################################################
+    # Keys
+    ####################################################################
+    def image_digest(self, docker_image: str, backend: str = "docker") -> str:
+        """
+        Content digest of a local docker image (the image name itself if it cannot be
+        resolved locally, e.g. on the kubernetes backend).
+        """
+        if docker_image not in self._digests:
+            digest = docker_image
+            if backend == "docker":
+                try:
+                    client = docker.from_env()
+                    digest = client.images.get(docker_image).id
+                    client.close()
+                except Exception as e:
+                    self.logger.warning(
+                        f"Could not resolve digest of {docker_image}: {repr(e)}"
+                    )
+            self._digests[docker_image] = digest
+        return self._digests[docker_image]
+
+    @staticmethod
+    def test_spec(ds: dict, test_script: str = "") -> str:
+        spec = {field: ds[field] for field in TEST_SPEC_FIELDS if field in ds}
+        spec["test_script"] = test_script
+        return json.dumps(spec, sort_keys=True, default=str)
+
+    def key(
+        self, image_digest: str, patch: str, test_spec: str, kind: str = "reward"
+    ) -> str:
+        return hash_text(
+            "\0".join(
+                [kind, image_digest, hash_text(normalize_patch(patch)), hash_text(test_spec)]
+            )
+        )
+
+    def key_for(
+        self,
+        ds: dict,
+        patch: str,
+        test_script: str = "",
+        kind: str = "reward",
+        backend: str = "docker",
+        docker_image: Optional[str] = None,
+    ) -> str:
+        """Key of a dataset entry + patch, computed without starting a container."""
+        from r2egym.agenthub.runtime.docker import DockerRuntime
+
+        docker_image = DockerRuntime.resolve_docker_image(ds, docker_image)
+        return self.key(
+            self.image_digest(docker_image, backend),
+            patch,
+            self.test_spec(ds, test_script),
+            kind=kind,
+        )
+
+    ####################################################################
+    # Entries
+    ####################################################################
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached entry {"reward", "parsed", "output"} for `key`, or None."""
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT reward, parsed, output FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+        except sqlite3.Error as e:
+            self.logger.error(f"Reward cache lookup failed: {repr(e)}")
+            return None
+        reward, parsed, output = row
+        return {
+            "reward": reward,
+            "parsed": json.loads(parsed) if parsed else None,
+            "output": zlib.decompress(output).decode("utf-8") if output else None,
+        }
+
+    def put(
+        self,
+        key: str,
+        reward: Optional[float],
+        parsed: Optional[dict] = None,
+        output: Optional[str] = None,
+    ) -> None:
+        parsed_json = json.dumps(parsed) if parsed is not None else None
+        output_blob = zlib.compress(output.encode("utf-8")) if output is not None else None
+        size = len(parsed_json or "") + len(output_blob or b"")
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, None if reward is None else float(reward), parsed_json, output_blob, size, time.time()),
+                )
+                self._evict(conn)
+        except sqlite3.Error as e:
+            self.logger.error(f"Reward cache store failed: {repr(e)}")
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size:
+            return
+        # drop least recently used entries down to 90% of the budget
+        target = total - int(self.max_size * 0.9)
+        freed = 0
+        stale = []
+        for key, size in conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_access"
+        ):
+            if freed >= target:
+                break
+            stale.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+        self.logger.info(f"Evicted {len(stale)} reward cache entries ({freed} bytes)")
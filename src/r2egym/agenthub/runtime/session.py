@@ -0,0 +1,232 @@
+import os
+import shlex
+import select
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+from kubernetes.stream import stream
+
+from r2egym.agenthub.runtime.output import OutputCapture
+
+
+##############################################################################
+# Transports: a bidirectional byte stream to a long-lived bash in the container
+##############################################################################
+class DockerExecTransport:
+    """stdin/stdout of a `docker exec` (tty=False) attached through the raw API socket."""
+
+    def __init__(self, container, command=["/bin/bash"], environment=None, workdir=None):
+        api = container.client.api
+        self._api = api
+        self._exec_id = exec_id = api.exec_create(
+            container.id,
+            command,
+            stdin=True,
+            stdout=True,
+            stderr=True,
+            tty=False,
+            environment=environment,
+            workdir=workdir,
+        )["Id"]
+        self._response = api.exec_start(exec_id, socket=True)
+        # docker-py returns a SocketIO wrapper: use the underlying socket for raw reads / writes
+        self._sock = getattr(self._response, "_sock", self._response)
+        self._buffer = b""
+
+    def write(self, data: bytes) -> None:
+        self._sock.sendall(data)
+
+    def read(self, timeout: float) -> Optional[bytes]:
+        """
+        Read whatever output is available within `timeout` seconds.
+        Returns b"" if nothing arrived and None once the stream is closed.
+        """
+        ready, _, _ = select.select([self._sock], [], [], timeout)
+        if not ready:
+            return b""
+        chunk = self._sock.recv(65536)
+        if not chunk:
+            return None
+        # demultiplex the docker stream: 8 byte header (stream type, 0, 0, 0, big endian size) + payload
+        self._buffer += chunk
+        payload = b""
+        while len(self._buffer) >= 8:
+            size = int.from_bytes(self._buffer[4:8], "big")
+            if len(self._buffer) < 8 + size:
+                break
+            payload += self._buffer[8 : 8 + size]
+            self._buffer = self._buffer[8 + size :]
+        return payload
+
+    def exit_code(self) -> Optional[int]:
+        """Exit code of the exec'd command (None while it is still running)."""
+        return self._api.exec_inspect(self._exec_id)["ExitCode"]
+
+    def close(self) -> None:
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        self._response.close()
+
+
+class KubernetesExecTransport:
+    """stdin/stdout of a pod exec websocket."""
+
+    def __init__(self, client, pod_name: str, namespace: str, command=["/bin/bash"]):
+        self._resp = stream(
+            client.connect_get_namespaced_pod_exec,
+            pod_name,
+            namespace,
+            command=command,
+            stderr=True,
+            stdin=True,
+            stdout=True,
+            tty=False,
+            _preload_content=False,
+        )
+
+    def write(self, data: bytes) -> None:
+        self._resp.write_stdin(data)
+
+    def read(self, timeout: float) -> Optional[bytes]:
+        if self._resp.is_open():
+            self._resp.update(timeout=timeout)
+        data = ""
+        if self._resp.peek_stdout():
+            data += self._resp.read_stdout()
+        if self._resp.peek_stderr():
+            data += self._resp.read_stderr()
+        # drain what was received before the stream closed
+        if not data and not self._resp.is_open():
+            return None
+        return data.encode("utf-8")
+
+    def exit_code(self) -> Optional[int]:
+        """Exit code of the exec'd command (None while it is still running)."""
+        return self._resp.returncode
+
+    def close(self) -> None:
+        self._resp.close()
+
+
+class LocalProcessTransport:
+    """stdin/stdout (stderr merged) of a local process, e.g. a command in a LocalSandbox."""
+
+    def __init__(self, argv):
+        self._proc = subprocess.Popen(
+            argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        self._eof = False
+
+    def write(self, data: bytes) -> None:
+        self._proc.stdin.write(data)
+        self._proc.stdin.flush()
+
+    def read(self, timeout: float) -> Optional[bytes]:
+        ready, _, _ = select.select([self._proc.stdout], [], [], timeout)
+        if not ready:
+            return b""
+        chunk = os.read(self._proc.stdout.fileno(), 65536)
+        if not chunk:
+            self._eof = True
+            return None
+        return chunk
+
+    def exit_code(self) -> Optional[int]:
+        """Exit code of the process (None while it is still running)."""
+        if self._eof:
+            # the output is closed: the process is exiting
+            return self._proc.wait()
+        return self._proc.poll()
+
+    def close(self) -> None:
+        if self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+        for pipe in [self._proc.stdin, self._proc.stdout]:
+            try:
+                pipe.close()
+            except Exception:
+                pass
+
+
+##############################################################################
+# Shell session
+##############################################################################
+class ShellSession:
+    """
+    Multiplexes commands over one long-lived bash process in the container instead of
+    paying an exec (and, on Kubernetes, a websocket handshake) per command.
+
+    Each command runs in a subshell (so `cd`, `exit`, etc. do not leak into the session)
+    with stdin from /dev/null and stderr merged into stdout. Its output is delimited by a
+    unique sentinel line carrying the exit code.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def run(
+        self, command: str, workdir: str, deadline: float, capture: OutputCapture
+    ) -> Optional[int]:
+        """
+        Run `command` (a /bin/sh command line) in `workdir`, streaming its output into `capture`.
+
+        Args:
+            deadline: seconds to wait for the sentinel before giving up on the command.
+        Returns:
+            The exit code, or None if the deadline was exceeded or the session died, in
+            which case the session is closed and must not be reused.
+        """
+        sentinel = f"__R2EGYM_DONE_{uuid.uuid4().hex}__".encode()
+        marker = b"\n" + sentinel + b":"
+        script = (
+            f"( cd {shlex.quote(workdir)} && /bin/sh -c {shlex.quote(command)} ) < /dev/null 2>&1; "
+            f"printf '\\n%s:%s\\n' '{sentinel.decode()}' \"$?\"\n"
+        )
+        with self._lock:
+            # output not yet handed to the capture (it may hold the start of the sentinel line)
+            window = b""
+            end_time = time.time() + deadline
+            try:
+                self.transport.write(script.encode("utf-8"))
+                while True:
+                    pos = window.find(marker)
+                    if pos != -1:
+                        line_end = window.find(b"\n", pos + 1)
+                        if line_end != -1:
+                            capture.write(window[:pos])
+                            return int(window[pos + len(marker) : line_end])
+                    else:
+                        keep = len(marker) - 1
+                        if len(window) > keep:
+                            capture.write(window[:-keep])
+                            window = window[-keep:]
+                    remaining = end_time - time.time()
+                    if remaining <= 0:
+                        break
+                    chunk = self.transport.read(timeout=min(remaining, 1))
+                    if chunk is None:
+                        break
+                    window += chunk
+            except Exception:
+                pass
+            capture.write(window)
+            self.close()
+            return None
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.transport.close()
+        except Exception:
+            pass
@@ -0,0 +1,161 @@
+import os
+import re
+import json
+from json.decoder import scanstring
+from typing import Any, Dict, Iterable, List, Optional
+
+from r2egym.agenthub.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# characters that change the nesting depth or start a string
+_STRUCTURE_RE = re.compile(r'["{}\[\]]')
+_WHITESPACE_RE = re.compile(r"\s*")
+_decoder = json.JSONDecoder()
+
+
+def extract_fields(line: str, fields: Iterable[str]) -> Dict[str, Any]:
+    """
+    Values of the given top-level fields of a JSON object, without decoding the rest of
+    it: strings are skipped with the C string scanner and only the requested values are
+    decoded, so that e.g. the (large) trajectory steps of a trajectory line are never
+    materialized.
+    """
+    fields = set(fields)
+    values = {}
+    depth = 0
+    pos = 0
+    while len(values) < len(fields):
+        match = _STRUCTURE_RE.search(line, pos)
+        if match is None:
+            break
+        char = match.group()
+        pos = match.end()
+        if char == '"':
+            string, pos = scanstring(line, pos)
+            if depth != 1 or string not in fields:
+                continue
+            colon = _WHITESPACE_RE.match(line, pos).end()
+            if colon >= len(line) or line[colon] != ":":
+                # a value, not a key
+                continue
+            start = _WHITESPACE_RE.match(line, colon + 1).end()
+            values[string], pos = _decoder.raw_decode(line, start)
+        elif char in "{[":
+            depth += 1
+        else:
+            depth -= 1
+    return values
+
+
+##############################################################################
+# Trajectory file index
+##############################################################################
+class TrajectoryIndex:
+    """
+    Sidecar index `<jsonl>.index` of a trajectory JSONL file: one JSON line per
+    trajectory with its instance (`ds["docker_image"]`), reward, exit reason and byte
+    range in the trajectory file, so that finding the completed / solved instances of a
+    run does not mean parsing gigabytes of trajectories.
+
+    The index is appended to with every trajectory (`record`); trajectories appended
+    without it (or a missing index) are indexed on `refresh` by streaming the end of the
+    file through `extract_fields`.
+
+    Usage:
+        index = TrajectoryIndex(jsonl_file)
+        done = {entry["docker_image"] for entry in index.entries()}
+        ...
+        offset = f.tell(); f.write(line + "\\n"); f.flush()
+        index.record(line, offset)
+    """
+
+    FIELDS = ["ds", "docker_image", "reward", "exit_reason"]
+
+    def __init__(self, jsonl_path):
+        self.jsonl_path = str(jsonl_path)
+        self.path = f"{self.jsonl_path}.index"
+
+    @classmethod
+    def entry(cls, line: str, offset: int) -> Optional[Dict[str, Any]]:
+        """Index entry of one trajectory line (None if the line is not a trajectory)."""
+        try:
+            values = extract_fields(line, cls.FIELDS)
+        except (ValueError, IndexError) as e:
+            logger.warning(f"Could not index trajectory at byte {offset}: {repr(e)}")
+            return None
+        ds = values.get("ds") or {}
+        docker_image = ds.get("docker_image", values.get("docker_image"))
+        if docker_image is None:
+            return None
+        return {
+            "docker_image": docker_image,
+            "reward": values.get("reward"),
+            "exit_reason": values.get("exit_reason"),
+            "offset": offset,
+            "end": offset + len(line.encode("utf-8")) + 1,
+        }
+
+    def _read(self) -> List[Dict[str, Any]]:
+        """Entries of the index; a torn last line (crash during an append) is truncated away."""
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        good_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entries.append(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+                good_bytes += len(line)
+        if good_bytes < os.path.getsize(self.path):
+            # the entries past it are re-indexed from the trajectory file by `refresh`
+            logger.warning(f"Dropping torn entries at the end of index {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+        return entries
+
+    def _append(self, entries: List[Dict[str, Any]], mode: str = "a") -> None:
+        with open(self.path, mode) as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+
+    def refresh(self) -> List[Dict[str, Any]]:
+        """Bring the index up to date with the trajectory file and return its entries."""
+        if not os.path.exists(self.jsonl_path):
+            return []
+        entries = self._read()
+        size = os.path.getsize(self.jsonl_path)
+        indexed = entries[-1]["end"] if entries else 0
+        if indexed == size:
+            return entries
+        if indexed > size:
+            # the trajectory file was rewritten: rebuild
+            entries, indexed = [], 0
+        new_entries = []
+        with open(self.jsonl_path, "rb") as f:
+            f.seek(indexed)
+            offset = indexed
+            for raw in f:
+                if raw.endswith(b"\n"):
+                    entry = self.entry(raw[:-1].decode("utf-8", errors="replace"), offset)
+                    if entry is not None:
+                        new_entries.append(entry)
+                offset += len(raw)
+        if new_entries or not entries:
+            self._append(new_entries, mode="a" if entries else "w")
+        logger.info(f"Indexed {len(new_entries)} trajectories of {self.jsonl_path}")
+        return entries + new_entries
+
+    def entries(self) -> List[Dict[str, Any]]:
+        return self.refresh()
+
+    def record(self, line: str, offset: int) -> None:
+        """Index a trajectory line just appended at byte `offset` of the trajectory file."""
+        entry = self.entry(line, offset)
+        if entry is not None:
+            self._append([entry])
@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from r2egym.agenthub.trajectory.trajectory import TrajectoryStep
+from r2egym.agenthub.utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# how the environment is brought back to the journaled state on resume
+RESUME_MODES = ["patch", "replay"]
+
+
+@dataclass
+class JournalState:
+    """Agent loop state rebuilt from a journal."""
+
+    history: List[Dict[str, Any]]
+    steps: List[TrajectoryStep] = field(default_factory=list)
+    # repo diff after the last step (if recorded)
+    patch: Optional[str] = None
+    exit_reason: Optional[str] = None
+
+    @property
+    def step_count(self) -> int:
+        return len(self.steps)
+
+    @property
+    def total_time_traj(self) -> float:
+        return self.steps[-1].total_time_traj if self.steps else 0
+
+    @property
+    def done(self) -> bool:
+        return bool(self.steps) and self.steps[-1].done
+
+
+##############################################################################
+# Trajectory journal
+##############################################################################
+class TrajectoryJournal:
+    """
+    Crash-safe, append-only JSONL journal of one agent run, so that a run interrupted
+    (e.g. by a preempted node) can be resumed from its last step instead of from scratch.
+
+    Records:
+        {"type": "start", "history": [...]}                   initial messages
+        {"type": "step", "step": {...}, "stepcount_message": str,
+         "messages": [...], "patch": str, "exit_reason": str}  one per TrajectoryStep
+
+    A step record holds the messages the step appended to the history (plus the step
+    count message appended to the last message before the LLM query, None when it is
+    a message of its own, see the "append_only" prompt layout of the Agent), so that
+    the history is rebuilt exactly. Each record is flushed and fsync'ed; a torn last line
+    is dropped on load.
+
+    On resume the environment is brought back to the journaled state by applying the
+    patch recorded after the last step (resume="patch") or by re-executing the
+    journaled actions (resume="replay").
+
+    Usage:
+        journal = TrajectoryJournal("journals/exp/image/attempt_0_0.jsonl")
+        trajectory = agent.run(env, journal=journal, ...)
+    """
+
+    def __init__(self, path: str, resume: str = "patch", record_patch: bool = True):
+        assert resume in RESUME_MODES, f"Invalid resume mode: {resume}, must be one of {RESUME_MODES}"
+        self.path = path
+        self.resume = resume
+        self.record_patch = record_patch or resume == "patch"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _append(self, record: dict) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, history: List[Dict[str, Any]]) -> None:
+        """Start a new journal (dropping any previous one) with the initial history."""
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"type": "start", "history": history}, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append_step(
+        self,
+        step: TrajectoryStep,
+        stepcount_message: Optional[str],
+        messages: List[Dict[str, Any]],
+        patch: Optional[str] = None,
+        exit_reason: Optional[str] = None,
+    ) -> None:
+        self._append(
+            {
+                "type": "step",
+                "step": step.model_dump(),
+                "stepcount_message": stepcount_message,
+                "messages": messages,
+                "patch": patch,
+                "exit_reason": exit_reason,
+            }
+        )
+
+    def load(self, history: List[Dict[str, Any]]) -> Optional[JournalState]:
+        """
+        State after the last journaled step, or None if there is nothing to resume (no
+        journal, no step yet, or a journal of a different initial history).
+        """
+        if not os.path.exists(self.path):
+            return None
+        records = []
+        good_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Dropping torn record at the end of journal {self.path}")
+                    break
+                good_bytes += len(line)
+        if good_bytes < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+
+        if not records or records[0].get("type") != "start":
+            return None
+        if records[0]["history"] != history:
+            logger.warning(f"Journal {self.path} is for a different prompt, starting over")
+            return None
+        state = JournalState(history=[dict(message) for message in history])
+        for record in records[1:]:
+            if state.history and record.get("stepcount_message") is not None:
+                state.history[-1]["content"] += f"\n{record['stepcount_message']}"
+            state.history.extend(record["messages"])
+            state.steps.append(TrajectoryStep(**record["step"]))
+            if record.get("patch") is not None:
+                state.patch = record["patch"]
+            state.exit_reason = record.get("exit_reason")
+        if not state.steps:
+            return None
+        return state
+
+    @staticmethod
+    def remove_dir(journal_dir: str) -> None:
+        """Remove the journals of an instance (once its trajectory is safely stored)."""
+        shutil.rmtree(journal_dir, ignore_errors=True)
+
+
+def instance_journal_dir(journal_dir: str, exp_name: str, docker_image: str) -> str:
+    """Directory holding the journals of one instance of an experiment."""
+    return os.path.join(journal_dir, exp_name, docker_image.replace("/", "_"))
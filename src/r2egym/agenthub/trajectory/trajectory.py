@@ -30,6 +30,8 @@ class TrajectoryStep(BaseModel):
     token_usage_prompt: int
     token_usage_completion: int
     token_usage_total: int
+    # prompt tokens served from the provider's prefix cache (prompt_tokens_details)
+    token_usage_cached: int = 0
 
     ## metadata (current step stats)
     llm_exec_time: float
@@ -128,6 +130,19 @@ class Trajectory(BaseModel):
     def num_tokens_total(self):
         return sum([step.token_usage_total for step in self.trajectory_steps])
 
+    @property
+    def num_tokens_cached(self):
+        return sum([step.token_usage_cached for step in self.trajectory_steps])
+
+    @property
+    def prefix_cache_hit_rate(self):
+        """Fraction of the prompt tokens served from the prefix cache (steps with usage)."""
+        steps = [step for step in self.trajectory_steps if step.token_usage_prompt > 0]
+        prompt_tokens = sum([step.token_usage_prompt for step in steps])
+        if not prompt_tokens:
+            return 0.0
+        return sum([step.token_usage_cached for step in steps]) / prompt_tokens
+
     @property
     def total_llm_time(self):
         return sum([step.llm_exec_time for step in self.trajectory_steps])
@@ -209,6 +224,7 @@ class Trajectory(BaseModel):
             "num_created_files": len(self.created_files),
             "p2p_rate": len(p2p_rate),
             "regression_pass_count": self.regression_pass_count,
+            "prefix_cache_hit_rate": self.prefix_cache_hit_rate,
         }
 
     @property
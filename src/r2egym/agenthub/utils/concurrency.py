@@ -0,0 +1,108 @@
+import os
+import functools
+import contextlib
+import multiprocessing
+from typing import Optional, Tuple
+
+##############################################################################
+# Process-wide concurrency limits
+##############################################################################
+# Semaphores shared by all rollout worker processes (set by `init_limits`), None: unlimited.
+_limits = {"llm": None, "exec": None}
+
+
+def make_limits(
+    max_llm_concurrency: Optional[int] = None,
+    max_exec_concurrency: Optional[int] = None,
+) -> Tuple:
+    """Semaphores for `init_limits`, to be created in the parent process (None: unlimited)."""
+    context = multiprocessing.get_context()
+    return (
+        context.BoundedSemaphore(max_llm_concurrency) if max_llm_concurrency else None,
+        context.BoundedSemaphore(max_exec_concurrency) if max_exec_concurrency else None,
+    )
+
+
+def init_limits(llm_semaphore=None, exec_semaphore=None) -> None:
+    """
+    Install the limits in the current process. Used as the `initializer` of the
+    ProcessPoolExecutor running the rollouts, so that all workers share the semaphores:
+
+        limits = make_limits(max_llm_concurrency=32, max_exec_concurrency=16)
+        ProcessPoolExecutor(max_workers, initializer=init_limits, initargs=limits)
+    """
+    _limits["llm"] = llm_semaphore
+    _limits["exec"] = exec_semaphore
+
+
+@contextlib.contextmanager
+def _slot(kind: str):
+    semaphore = _limits[kind]
+    if semaphore is None:
+        yield
+        return
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def llm_slot():
+    """Hold one of the LLM request slots (no-op without limits)."""
+    return _slot("llm")
+
+
+def exec_slot():
+    """Hold one of the container exec slots (no-op without limits)."""
+    return _slot("exec")
+
+
+def exec_limited(fn):
+    """Decorator: run `fn` holding an exec slot."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with exec_slot():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+##############################################################################
+# Host admission control
+##############################################################################
+def available_memory() -> Optional[int]:
+    """MemAvailable of the host in bytes (None if unknown)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def load_per_cpu() -> Optional[float]:
+    """1 minute load average per CPU (None if unknown)."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+def host_has_capacity(
+    max_load_per_cpu: Optional[float] = None,
+    min_free_memory_gb: Optional[float] = None,
+) -> bool:
+    """Whether the (local docker) host can take one more container (unknown metrics pass)."""
+    if max_load_per_cpu is not None:
+        load = load_per_cpu()
+        if load is not None and load > max_load_per_cpu:
+            return False
+    if min_free_memory_gb is not None:
+        memory = available_memory()
+        if memory is not None and memory < min_free_memory_gb * 1024**3:
+            return False
+    return True
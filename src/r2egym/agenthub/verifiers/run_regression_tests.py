@@ -1,4 +1,5 @@
 from pathlib import Path
+from functools import partial
 from concurrent.futures import ProcessPoolExecutor
 
 import fire
@@ -10,6 +11,7 @@ from datasets import load_dataset
 from r2egym.logging import setup_logging
 from r2egym.agenthub.agent.agent import AgentArgs
 from r2egym.agenthub.environment.env import EnvArgs, RepoEnv
+from r2egym.agenthub.runtime.reward_cache import RewardCache
 from r2egym.agenthub.trajectory.trajectory import Trajectory
 
 agent_args = AgentArgs.from_yaml(
@@ -22,11 +24,28 @@ swebv_dataset = (
 )
 
 
-def compute_regression_output(trajectory: Trajectory, mode="modeloutput"):
+def compute_regression_output(
+    trajectory: Trajectory, mode="modeloutput", reward_cache_dir: str | None = None
+):
     docker_image = trajectory.docker_image
     run_tests_regression = swebv_dataset.loc[docker_image, "run_tests_regression"]
 
     ds = trajectory.ds
+    # the regression output only depends on the image, the applied patch and the test script
+    if reward_cache_dir:
+        reward_cache = RewardCache(reward_cache_dir)
+        patch = {
+            "modeloutput": trajectory.true_output_patch,
+            "gt": ds["patch"],
+            "no": "",
+        }[mode]
+        cache_key = reward_cache.key_for(
+            ds, patch or "", test_script=run_tests_regression, kind="regression"
+        )
+        entry = reward_cache.get(cache_key)
+        if entry is not None:
+            return entry["output"]
+
     env_args = EnvArgs(ds=ds)
     logger = setup_logging(f"REGRESSION_{docker_image}", console=False)
     env = RepoEnv(env_args, logger=logger)
@@ -57,15 +76,24 @@ def compute_regression_output(trajectory: Trajectory, mode="modeloutput"):
 
     output = env.runtime.run_swebv_regression(run_tests_regression)
     env.close()
+    if reward_cache_dir:
+        reward_cache.put(cache_key, None, output=output)
     return output
 
 
-def add_regression_output(trajectories: list[Trajectory], max_workers: int = 42):
+def add_regression_output(
+    trajectories: list[Trajectory],
+    max_workers: int = 42,
+    reward_cache_dir: str | None = None,
+):
 
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
         reg_outputs = list(
             tqdm.tqdm(
-                executor.map(compute_regression_output, trajectories),
+                executor.map(
+                    partial(compute_regression_output, reward_cache_dir=reward_cache_dir),
+                    trajectories,
+                ),
                 total=len(trajectories),
             )
         )
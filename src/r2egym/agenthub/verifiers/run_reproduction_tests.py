@@ -6,6 +6,7 @@ import math
 import traceback
 import pandas as pd
 from pathlib import Path
+from functools import partial
 from collections import defaultdict
 from datasets import load_dataset, Dataset, concatenate_datasets
 from concurrent.futures import (
@@ -20,6 +21,7 @@ from tqdm import tqdm
 
 from r2egym.logging import setup_logging, INFO
 from r2egym.agenthub.environment.env import EnvArgs, RepoEnv
+from r2egym.agenthub.runtime.reward_cache import RewardCache
 from r2egym.agenthub.agent.agent import AgentArgs, Agent
 from r2egym.agenthub.trajectory.trajectory import Trajectory
 
@@ -32,13 +34,25 @@ logger = setup_logging(
 )
 
 
-def run_test_patch(ds, test_patch, patch):
+def run_test_patch(ds, test_patch, patch, reward_cache_dir=None):
     """
     Applies a patch in the given environment, runs a test command, and computes the predicted reward.
 
     If the output contains the word 'resolved', the predicted reward is 1.0, otherwise 0.0.
     The patch is undone after testing.
+    If `reward_cache_dir` is given, a cached result for (image, patch, test patch) is returned
+    without starting a container.
     """
+    if not test_patch:
+        return 0
+    if reward_cache_dir:
+        reward_cache = RewardCache(reward_cache_dir)
+        cache_key = reward_cache.key_for(
+            ds, patch or "", test_script=test_patch, kind="reproduction"
+        )
+        entry = reward_cache.get(cache_key)
+        if entry is not None:
+            return entry["reward"]
     # print(ds)
     name = ds["docker_image"].replace("/", "_") + str(hash(patch + test_patch))
     custom_logger = setup_logging(
@@ -78,6 +92,8 @@ def run_test_patch(ds, test_patch, patch):
 
             pred_reward = out.count("resolved")
             custom_logger.info(f"Predicted reward: {pred_reward}")
+            if reward_cache_dir:
+                reward_cache.put(cache_key, pred_reward, output=out)
 
         except Exception as e:
             custom_logger.error(f"Error during patch testing: {e}")
@@ -92,7 +108,7 @@ def run_test_patch(ds, test_patch, patch):
         env.close()
 
 
-def process_single_task(args, timeout=600, max_retries=3):
+def process_single_task(args, timeout=600, max_retries=3, reward_cache_dir=None):
     ds, test_patch, patch, test_index = args
 
     for attempt in range(max_retries):
@@ -101,7 +117,9 @@ def process_single_task(args, timeout=600, max_retries=3):
 
             def worker():
                 try:
-                    result = run_test_patch(ds, test_patch, patch)
+                    result = run_test_patch(
+                        ds, test_patch, patch, reward_cache_dir=reward_cache_dir
+                    )
                     result_queue.put(("success", result))
                 except Exception as e:
                     result_queue.put(("error", str(e)))
@@ -155,7 +173,11 @@ def load_reproduction_tests():
     return ds
 
 
-def add_reproduction_tests(trajectories: list[Trajectory], max_workers: int = 32):
+def add_reproduction_tests(
+    trajectories: list[Trajectory],
+    max_workers: int = 32,
+    reward_cache_dir: str | None = None,
+):
     reproduction_tests_df = load_reproduction_tests()
 
     all_tasks = []
@@ -173,7 +195,13 @@ def add_reproduction_tests(trajectories: list[Trajectory], max_workers: int = 32
 
     with ProcessPoolExecutor(max_workers=max_workers) as ex:
         results = list(
-            tqdm(ex.map(process_single_task, all_tasks), total=len(all_tasks))
+            tqdm(
+                ex.map(
+                    partial(process_single_task, reward_cache_dir=reward_cache_dir),
+                    all_tasks,
+                ),
+                total=len(all_tasks),
+            )
         )
 
     # defaultdict(defaultdict(int))
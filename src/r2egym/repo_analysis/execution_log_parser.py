@@ -35,6 +35,32 @@ def parse_log_pytest(log: str | None) -> dict[str, str]:
     return test_status_map
 
 
+# precedence of the statuses of a test name in the "short test summary info" of `-rA`
+_STATUS_PRECEDENCE = {"PASSED": 0, "ERROR": 1, "FAILED": 2}
+
+
+def parse_test_report(report: dict[str, str] | None) -> dict[str, str]:
+    """
+    Parser for structured test reports ({nodeid: status}, see r2egym_reward_plugin.py)
+
+    Args:
+        report (dict): pytest node id to status mapping
+    Returns:
+        dict: test case to test status mapping, with the same keys as parse_log_pytest
+    """
+    if not report:
+        return {}
+    test_status_map = {}
+    for nodeid, status in report.items():
+        test_name = ".".join(nodeid.split("::")[1:])
+        # node ids of several files can share a test name: as in the log, where the
+        # summary lists PASSED, then ERROR, then FAILED lines, the last one wins
+        current = test_status_map.get(test_name)
+        if current is None or _STATUS_PRECEDENCE[status] > _STATUS_PRECEDENCE[current]:
+            test_status_map[test_name] = status
+    return test_status_map
+
+
 def parse_log_fn(repo_name: str):
     if repo_name == "sympy":
         return parse_log_pytest
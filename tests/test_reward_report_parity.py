@@ -0,0 +1,88 @@
+"""
+The structured report of the reward plugin must give the same test status map as the
+log parser the expected outputs were generated with.
+"""
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+sys.path.insert(0, SRC)
+
+from r2egym.repo_analysis.execution_log_parser import parse_log_pytest, parse_test_report
+
+PLUGIN_DIR = os.path.join(SRC, "r2egym", "agenthub", "runtime")
+
+TEST_1 = """
+import pytest
+
+
+class TestA:
+    def test_x(self):
+        assert False
+
+    @pytest.mark.xfail(reason="not strict")
+    def test_xp(self):
+        pass
+
+    @pytest.mark.xfail(reason="fails")
+    def test_xf(self):
+        assert False
+
+    def test_ok(self):
+        pass
+
+    @pytest.fixture
+    def broken(self):
+        yield
+        raise RuntimeError("teardown")
+
+    def test_teardown(self, broken):
+        pass
+
+
+def test_skip():
+    pytest.skip("skipped")
+"""
+
+TEST_2 = """
+class TestA:
+    def test_x(self):
+        pass
+
+    def test_ok(self):
+        pass
+
+
+def test_param_free():
+    pass
+"""
+
+
+def test_report_matches_log(tmp_path):
+    tests_dir = tmp_path / "r2e_tests"
+    tests_dir.mkdir()
+    (tests_dir / "test_1.py").write_text(TEST_1)
+    (tests_dir / "test_2.py").write_text(TEST_2)
+    report_path = tmp_path / "report.json"
+    env = dict(
+        os.environ,
+        PYTHONPATH=PLUGIN_DIR,
+        R2EGYM_REPORT=str(report_path),
+    )
+    env.pop("R2EGYM_REWARD_SPEC", None)
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-rA", "-p", "r2egym_reward_plugin", "r2e_tests"],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert os.path.exists(f"{report_path}.loaded")
+    with open(report_path) as f:
+        report = json.load(f)
+
+    from_log = parse_log_pytest(result.stdout)
+    assert from_log
+    assert parse_test_report(report) == from_log